@@ -9,6 +9,7 @@ from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 from config import GRID_CELLS
+from tracing import traced
 
 
 def load_criteria(criteria_dir: Union[str, Path]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
@@ -73,6 +74,7 @@ def _cell_tone_score(vision_cell: Dict[str, Any], text_raw: str, is_zhiding: boo
     return (raw * weight, confidence)
 
 
+@traced("aggregate_scores", "aggregate")
 def aggregate_scores(
     cells: List[Dict[str, Any]],
     vision_results: List[Dict[str, Any]],
@@ -83,17 +85,24 @@ def aggregate_scores(
     ref_store_path: Optional[Union[str, Path]] = None,
     cell_embeddings: Optional[List[Optional[List[float]]]] = None,
     similarity_bonus_scale: float = 0.5,
+    ann_nprobe: Optional[int] = None,
+    max_cells: int = GRID_CELLS,
 ) -> Dict[str, Any]:
-    ref_store: List[dict] = []
-    max_sim_fn = None
-    if ref_store_path and Path(ref_store_path).exists():
+    # max_cells：参与聚合的格子数上限（整页长截图流式切格时可大于 24）
+    n = min(len(cells), len(vision_results), max_cells)
+    # 整格相似度一次矩阵乘算出（type / tone 两个过滤器共用同一次乘法）
+    sim_type: List[float] = []
+    sim_tone: List[float] = []
+    if ref_store_path and cell_embeddings and Path(ref_store_path).exists():
         try:
-            from embedding_store import load_reference_store, max_similarity_to_references
-            ref_store = load_reference_store(ref_store_path)
-            max_sim_fn = max_similarity_to_references
+            from embedding_store import load_reference_index
+            ref_index = load_reference_index(ref_store_path)
+            if ref_index is not None and len(ref_index):
+                sims = ref_index.max_similarities(list(cell_embeddings[:n]), ("type", "tone"), nprobe=ann_nprobe)
+                sim_type = sims["type"].tolist()
+                sim_tone = sims["tone"].tolist()
         except Exception:
-            ref_store = []
-    n = min(len(cells), len(vision_results), GRID_CELLS)
+            sim_type, sim_tone = [], []
     type_scores, type_confs, tone_scores, tone_confs, reasons = [], [], [], [], []
     for i in range(n):
         c = cells[i]
@@ -109,15 +118,9 @@ def aggregate_scores(
             continue
         ts, tc = _cell_type_score(v, text_raw, is_zhiding, criteria_type)
         os_, oc = _cell_tone_score(v, text_raw, is_zhiding, criteria_tone)
-        if ref_store and cell_embeddings and i < len(cell_embeddings) and max_sim_fn is not None:
-            try:
-                emb = cell_embeddings[i]
-                sim_type = max_sim_fn(emb, ref_store, "type")
-                sim_tone = max_sim_fn(emb, ref_store, "tone")
-                ts += sim_type * similarity_bonus_scale
-                os_ += sim_tone * similarity_bonus_scale
-            except Exception:
-                pass
+        if i < len(sim_type):
+            ts += sim_type[i] * similarity_bonus_scale
+            os_ += sim_tone[i] * similarity_bonus_scale
         type_scores.append(ts)
         type_confs.append(tc)
         tone_scores.append(os_)
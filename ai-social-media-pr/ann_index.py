@@ -0,0 +1,116 @@
+"""
+参考向量库的近似最近邻索引（IVF，纯 NumPy 实现）：球面 k-means 把参考向量分到 nlist 个倒排桶，
+查询时只扫描与查询最相近的 nprobe 个桶。nprobe 越大召回越高、延迟越大；nprobe >= nlist 等价于精确搜索。
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+from config import ANN_KMEANS_ITERS
+
+
+def default_nlist(n: int) -> int:
+    """桶数经验值：约 4·√n，限制在 [16, 4096]。"""
+    return int(min(4096, max(16, round(4 * n ** 0.5))))
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return np.divide(x, norms, out=np.zeros_like(x), where=norms > 0)
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """按内积把每行分到最近的质心（分块避免 n×nlist 大矩阵）。"""
+    out = np.empty(len(x), dtype=np.int32)
+    for s in range(0, len(x), chunk):
+        out[s:s + chunk] = np.argmax(x[s:s + chunk] @ centroids.T, axis=1)
+    return out
+
+
+class IVFIndex:
+    """倒排索引：centroids (nlist, d)；list_ids 按桶排好的参考行号；offsets[k]:offsets[k+1] 为第 k 桶。"""
+
+    def __init__(self, centroids: np.ndarray, list_ids: np.ndarray, offsets: np.ndarray):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_ids = np.asarray(list_ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def size(self) -> int:
+        return len(self.list_ids)
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        nlist: Optional[int] = None,
+        iters: int = ANN_KMEANS_ITERS,
+        seed: int = 0,
+        max_train_per_list: int = 64,
+    ) -> "IVFIndex":
+        """对（已归一化的）参考矩阵做球面 k-means；训练用至多 nlist×max_train_per_list 行的子样本。"""
+        x = np.asarray(matrix, dtype=np.float32)
+        n = len(x)
+        nlist = max(1, min(nlist or default_nlist(n), n))
+        rng = np.random.default_rng(seed)
+        train = x if n <= nlist * max_train_per_list else x[rng.choice(n, nlist * max_train_per_list, replace=False)]
+        centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = _assign(train, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # 空桶用随机样本重新播种
+                sums[empty] = train[rng.choice(len(train), int(empty.sum()), replace=False)]
+            centroids = _normalize(sums)
+        assign = _assign(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        return cls(centroids, order, offsets)
+
+    def candidates(self, queries: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        一批（已归一化）查询各取最相近的 nprobe 个桶，返回这些桶中参考行号的并集（升序）。
+        同一格子的 24 个查询共用一次候选集上的矩阵乘。
+        """
+        nprobe = max(1, min(nprobe, self.nlist))
+        if nprobe >= self.nlist:
+            return np.arange(self.size, dtype=np.int64)
+        sims = queries @ self.centroids.T
+        probe = np.argpartition(-sims, nprobe - 1, axis=1)[:, :nprobe]
+        lists = np.unique(probe)
+        parts = [self.list_ids[self.offsets[k]:self.offsets[k + 1]] for k in lists]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def save(self, path: Union[str, Path], store_signature: Tuple[int, int]) -> None:
+        """保存为 .npz；store_signature 为向量库文件的 (mtime_ns, size)，加载时据此判断索引是否过期。"""
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp, centroids=self.centroids, list_ids=self.list_ids, offsets=self.offsets, store_signature=np.array(store_signature, dtype=np.int64))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], store_signature: Tuple[int, int]) -> Optional["IVFIndex"]:
+        """加载索引；文件缺失、损坏或向量库已被改写（签名不一致）时返回 None。"""
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as data:
+                if tuple(int(v) for v in data["store_signature"]) != tuple(store_signature):
+                    return None
+                return cls(data["centroids"], data["list_ids"], data["offsets"])
+        except (OSError, KeyError, ValueError):
+            return None
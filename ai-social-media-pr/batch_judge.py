@@ -0,0 +1,422 @@
+"""
+批量 judge：一个进程里筛查一整批达人截图（目录或清单），三个阶段流水线重叠执行：
+切格/OCR（CPU 密集）在进程池中进行，每个工作进程常驻 OCR 引擎；Vision（I/O 密集）由若干线程各处理一个达人；
+CLIP 编码在单独的线程里把多个达人的封面合并成一批，编码后打分并落盘。阶段之间是有界队列，
+下游变慢时上游随之阻塞，内存中同时存在的达人数有上界。
+每个达人的结果写到 <输出目录>/<id>/，同时逐行追加到 <输出目录>/summary.jsonl。
+每个达人目录下有断点清单（checkpoint.py）：重跑同一批时已打完分的达人直接取清单中的结果，
+其余达人从各自第一个未完成的阶段继续，Vision 只重发出错或缺失的格子。
+每个达人一个 Tracer（tracing.py，切格子进程中的 span 随结果带回），result.json 中有该达人的 timings；
+合并编码记在批量级 Tracer 上。整批各阶段 p50/p95、逐达人耗时分布与 Vision 费用写入 <输出目录>/batch_timings.json。
+"""
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from config import (
+    BATCH_EMBED_MAX_COVERS,
+    BATCH_QUEUE_SIZE,
+    BATCH_SLICE_WORKERS,
+    BATCH_SUMMARY_FILENAME,
+    BATCH_TIMINGS_FILENAME,
+    BATCH_VISION_WORKERS,
+    VISION_BATCH_SIZE,
+    VISION_CONCURRENCY,
+    VISION_DETAIL,
+)
+from checkpoint import covers_needed, open_checkpoint, record_score, restore_covers, resume_vision, stage_keys
+from disk_cache import DiskCache
+from ocr_engines import ocr_error_scope
+from pipeline import JudgeContext, persist_context, stage_embed_many, stage_score, stage_slice_ocr
+from tracing import Tracer, activate, export_trace, percentile, span, summarize_tracers
+
+SCREENSHOT_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp"}
+# summary.jsonl 每行保留的结果字段（两种 profile 模式的分数与结论）
+SUMMARY_KEYS = (
+    "profile_mode",
+    "score_total", "qualifies", "very_recommended",
+    "score_type", "qualifies_type", "very_qualifies_type",
+    "score_tone", "qualifies_tone", "very_qualifies_tone",
+)
+
+
+@dataclass
+class BatchJob:
+    """批量中的一个达人：id 用作输出子目录名与 summary 中的标识。"""
+
+    id: str
+    screenshot: Path
+    creator_name: Optional[str] = None
+    creator_desc: Optional[str] = None
+    note_titles: Optional[List[str]] = None
+
+
+def load_batch_jobs(source: Union[str, Path]) -> List[BatchJob]:
+    """
+    目录：其中每张截图（png/jpg/jpeg/webp，按文件名排序）为一个达人，文件名（不含扩展名）作为 id 与达人名称。
+    清单：.jsonl 每行一个对象，或 .json 对象数组；字段 screenshot（必填，相对路径相对清单所在目录）、
+    id、creator_name、creator_desc、note_titles。id 重复时依次加 _2、_3 后缀。
+    """
+    source = Path(source)
+    raw: List[Dict[str, Any]] = []
+    if source.is_dir():
+        for p in sorted(source.iterdir()):
+            if p.is_file() and p.suffix.lower() in SCREENSHOT_SUFFIXES:
+                raw.append({"screenshot": str(p), "id": p.stem, "creator_name": p.stem})
+    else:
+        text = source.read_text(encoding="utf-8")
+        if source.suffix.lower() == ".jsonl":
+            raw = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            raw = json.loads(text)
+        if not isinstance(raw, list):
+            raise ValueError(f"清单应为对象数组: {source}")
+    jobs: List[BatchJob] = []
+    seen: Dict[str, int] = {}
+    for item in raw:
+        if not item.get("screenshot"):
+            raise ValueError(f"清单条目缺少 screenshot: {item}")
+        shot = Path(item["screenshot"])
+        if not shot.is_absolute():
+            shot = (source if source.is_dir() else source.parent) / shot
+        job_id = str(item.get("id") or shot.stem)
+        seen[job_id] = seen.get(job_id, 0) + 1
+        if seen[job_id] > 1:
+            job_id = f"{job_id}_{seen[job_id]}"
+        jobs.append(BatchJob(
+            id=job_id,
+            screenshot=shot.resolve(),
+            creator_name=item.get("creator_name") or None,
+            creator_desc=item.get("creator_desc") or None,
+            note_titles=item.get("note_titles") or None,
+        ))
+    return jobs
+
+
+# --- 切格/OCR 工作进程 ---
+_WORKER_OCR_CACHE: Optional[DiskCache] = None
+
+
+def _init_slice_worker(ocr_cache_dir: Optional[str]) -> None:
+    """工作进程初始化：每个进程打开自己的 OCR 缓存连接（SQLite WAL，多进程共享同一文件）。"""
+    global _WORKER_OCR_CACHE
+    if ocr_cache_dir:
+        from ocr_cache import open_ocr_cache
+        _WORKER_OCR_CACHE = open_ocr_cache(ocr_cache_dir)
+
+
+def _slice_job(ctx: JudgeContext, options: Dict[str, Any], restored: bool, encode: bool) -> tuple:
+    """
+    在工作进程中切格 + OCR，并按 Vision 档位编码上传负载（都是 CPU 工作），返回 (填好的 ctx, OCR 是否未出错, span 快照)。
+    restored 时 ctx.cells 已从断点清单恢复，只切出封面；encode=False（Vision 已完成）时不编码上传负载。
+    """
+    from vision_prompt import load_cover_payload
+    tracer = Tracer(ctx.creator_name)
+    with activate(tracer), ocr_error_scope() as errors:
+        if restored:
+            with span("restore_covers", "stage"):
+                restore_covers(ctx, options["max_cells"])
+        else:
+            stage_slice_ocr(
+                ctx, ocr_lang=options["ocr_lang"], ocr_engine=options["ocr_engine"], ocr_threads=options["ocr_threads"],
+                ocr_cache=_WORKER_OCR_CACHE, max_cells=options["max_cells"],
+            )
+        if encode:
+            with span("encode_payloads", "vision", cells=len(ctx.covers)):
+                ctx.cover_payloads = [load_cover_payload(im, detail=options["vision_detail"]) for im in ctx.covers]
+    return ctx, errors[0] == 0, tracer.export_state()
+
+
+def _summary_line(
+    job: BatchJob,
+    result: Optional[Dict[str, Any]],
+    elapsed: float,
+    error: Optional[str] = None,
+    cells: Optional[int] = None,
+    resumed: bool = False,
+    cost_usd: Optional[float] = None,
+) -> Dict[str, Any]:
+    line: Dict[str, Any] = {"id": job.id, "screenshot": str(job.screenshot), "creator_name": job.creator_name}
+    if result is not None:
+        line.update({k: result[k] for k in SUMMARY_KEYS if k in result})
+    line["cells"] = cells
+    line["seconds"] = round(elapsed, 2)
+    line["cost_usd"] = cost_usd
+    if resumed:
+        line["resumed"] = True
+    if error:
+        line["error"] = error
+    return {k: v for k, v in line.items() if v is not None}
+
+
+_DONE = object()
+
+
+def run_batch_judge(
+    jobs: List[BatchJob],
+    output_dir: Union[str, Path],
+    profile_dir: Path,
+    api_client: str = "openai",
+    vision_model: Optional[str] = None,
+    ref_store_path: Optional[Path] = None,
+    similarity_bonus_scale: float = 0.5,
+    ocr_lang: str = "chi_sim+eng",
+    ocr_engine: Optional[str] = None,
+    ocr_threads: Optional[int] = None,
+    ocr_cache_dir: Optional[Union[str, Path]] = None,
+    max_cells: Optional[int] = None,
+    vision_concurrency: int = VISION_CONCURRENCY,
+    vision_batch_size: int = VISION_BATCH_SIZE,
+    vision_detail: str = VISION_DETAIL,
+    vision_cache: Optional[DiskCache] = None,
+    embedding_cache: Optional[DiskCache] = None,
+    ann_nprobe: Optional[int] = None,
+    save_covers: bool = True,
+    slice_workers: Optional[int] = BATCH_SLICE_WORKERS,
+    vision_workers: int = BATCH_VISION_WORKERS,
+    queue_size: int = BATCH_QUEUE_SIZE,
+    resume: bool = True,
+    trace_path: Optional[Union[str, Path]] = None,
+) -> Dict[str, Any]:
+    """
+    批量筛查 jobs，结果写入 output_dir/<id>/ 与 output_dir/summary.jsonl（逐个完成逐行追加，顺序为完成顺序）。
+    slice_workers 个进程切格/OCR（每进程 OCR 线程数默认 1），vision_workers 个达人同时在 Vision 阶段
+    （每个达人内部最多 vision_concurrency 个在途请求），CLIP 阶段每次合并最多 BATCH_EMBED_MAX_COVERS 张封面。
+    单个达人出错只记录在 summary 中，不影响其余达人。返回批量统计（达人数、出错数、从清单直接取结果的达人数、耗时、summary 路径）。
+    resume 时按 output_dir/<id>/checkpoint/ 断点续跑（summary.jsonl 仍整体重写）；resume=False 时忽略已有清单。
+    统计中的 timings 与 output_dir/batch_timings.json 相同；trace_path 不为 None 时导出整批的 span 时间线（见 tracing.export_trace）。
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    summary_path = output_dir / BATCH_SUMMARY_FILENAME
+    summary_path.write_text("", encoding="utf-8")
+    slice_workers = max(1, int(slice_workers or min(4, os.cpu_count() or 1)))
+    vision_workers = max(1, int(vision_workers))
+    queue_size = max(1, int(queue_size))
+    api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("GEMINI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")
+    options = {
+        "ocr_lang": ocr_lang, "ocr_engine": ocr_engine, "ocr_threads": ocr_threads or 1,
+        "max_cells": max_cells, "vision_detail": vision_detail,
+    }
+    vision_q: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    embed_q: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    summary_lock = threading.Lock()
+    counts = {"done": 0, "errors": 0, "resumed": 0}
+    started: Dict[str, float] = {}
+    seconds: List[float] = []
+    tracers: Dict[str, Tracer] = {}
+    batch_tracer = Tracer("batch")
+    t_batch = time.perf_counter()
+
+    def finish(
+        job: BatchJob, result: Optional[Dict[str, Any]], error: Optional[str] = None, cells: Optional[int] = None, resumed: bool = False,
+    ) -> None:
+        elapsed = time.perf_counter() - started[job.id]
+        usage = tracers[job.id].summary()["vision_usage"] if job.id in tracers else None
+        cost = usage["cost_usd"] if usage and usage["requests"] else None
+        line = _summary_line(job, result, elapsed, error, cells, resumed, cost)
+        with summary_lock:
+            if not resumed:
+                seconds.append(elapsed)
+            with open(summary_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            counts["done"] += 1
+            counts["errors"] += 1 if error else 0
+            counts["resumed"] += 1 if resumed else 0
+
+    def vision_worker() -> None:
+        while True:
+            item = vision_q.get()
+            if item is _DONE:
+                return
+            job, ctx, cp, keys = item
+            try:
+                # 清单中成功的格子直接复用，只对出错或缺失的格子发请求，每组完成后记录
+                with activate(tracers[job.id]):
+                    resume_vision(
+                        ctx, cp, keys, max_cells=max_cells, api_client=api_client, model=vision_model, api_key=api_key,
+                        concurrency=vision_concurrency, cache=vision_cache,
+                        batch_size=vision_batch_size, detail=vision_detail,
+                    )
+            except Exception as e:
+                finish(job, None, f"vision: {type(e).__name__}: {e}")
+                continue
+            embed_q.put(item)
+
+    def score_and_write(group: List[tuple]) -> None:
+        # 单个达人出错只记入 summary，不能让编码线程退出（否则 Vision 线程阻塞在 embed_q 上，整批挂起）
+        live, fresh = [], []
+        for item in group:
+            job, ctx, cp, keys = item
+            try:
+                if cp.get("embed", keys["embed"]) is not None:
+                    ctx.cell_embeddings = cp.load_embeddings(keys["embed"])
+                else:
+                    fresh.append(item)
+            except Exception as e:
+                finish(job, None, f"embed: {type(e).__name__}: {e}")
+                continue
+            live.append(item)
+        # 合并编码分不到单个达人，记在批量级 Tracer 上；合并编码失败时逐个达人重试，定位出错的达人
+        try:
+            with activate(batch_tracer):
+                stage_embed_many([item[1] for item in fresh], cache=embedding_cache)
+            encoded = fresh
+        except Exception:
+            encoded = []
+            for item in fresh:
+                try:
+                    with activate(batch_tracer):
+                        stage_embed_many([item[1]], cache=embedding_cache)
+                except Exception as e:
+                    finish(item[0], None, f"embed: {type(e).__name__}: {e}")
+                    live.remove(item)
+                    continue
+                encoded.append(item)
+        for item in encoded:
+            job, ctx, cp, keys = item
+            try:
+                cp.save_embeddings(keys["embed"], ctx.cell_embeddings)
+            except Exception as e:
+                finish(job, None, f"embed: {type(e).__name__}: {e}")
+                live.remove(item)
+        for job, ctx, cp, keys in live:
+            tracer = tracers[job.id]
+            try:
+                with activate(tracer):
+                    result = stage_score(ctx, similarity_bonus_scale=similarity_bonus_scale, ann_nprobe=ann_nprobe)
+                    # 清单中只记录打分结果本身，timings 加在写入 result.json 的副本上
+                    ctx.result = dict(result, timings=tracer.summary())
+                    persist_context(ctx, output_dir / job.id, save_covers=save_covers)
+                record_score(cp, keys, result)
+            except Exception as e:
+                finish(job, None, f"score: {type(e).__name__}: {e}")
+                continue
+            finish(job, result, cells=len(ctx.cells))
+
+    def embed_worker() -> None:
+        # 取到一个达人后把队列里已就绪的也一并取出（封面总数不超过 BATCH_EMBED_MAX_COVERS），合并编码一次
+        while True:
+            item = embed_q.get()
+            if item is _DONE:
+                return
+            group = [item]
+            covers = len(item[1].covers)
+            stop = False
+            while covers < BATCH_EMBED_MAX_COVERS:
+                try:
+                    nxt = embed_q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _DONE:
+                    stop = True
+                    break
+                group.append(nxt)
+                covers += len(nxt[1].covers)
+            score_and_write(group)
+            if stop:
+                return
+
+    vision_threads = [
+        threading.Thread(target=vision_worker, name=f"batch-vision-{i}", daemon=True) for i in range(vision_workers)
+    ]
+    embed_thread = threading.Thread(target=embed_worker, name="batch-embed", daemon=True)
+    for t in vision_threads + [embed_thread]:
+        t.start()
+
+    # spawn：工作进程不继承本进程的线程与 SQLite 连接
+    with ProcessPoolExecutor(
+        max_workers=slice_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_slice_worker,
+        initargs=(str(ocr_cache_dir) if ocr_cache_dir else None,),
+    ) as pool:
+        pending: Dict[Any, tuple] = {}
+        remaining = list(jobs)
+        while remaining or pending:
+            # 在途的切格任务不超过 进程数 + 队列长度，Vision 积压时不再提交新任务
+            while remaining and len(pending) < slice_workers + queue_size:
+                job = remaining.pop(0)
+                started[job.id] = time.perf_counter()
+                tracers[job.id] = Tracer(job.id)
+                ctx = JudgeContext(
+                    screenshot=job.screenshot, profile_dir=profile_dir,
+                    creator_name=job.creator_name, creator_desc=job.creator_desc,
+                    note_titles=job.note_titles, ref_store_path=ref_store_path,
+                )
+                try:
+                    cp = open_checkpoint(output_dir / job.id, job.screenshot, fresh=not resume)
+                    keys = stage_keys(
+                        ctx, cp.input_hash, ocr_lang=ocr_lang, ocr_engine=ocr_engine, max_cells=max_cells,
+                        api_client=api_client, vision_model=vision_model, vision_detail=vision_detail,
+                        similarity_bonus_scale=similarity_bonus_scale, ann_nprobe=ann_nprobe,
+                    )
+                except Exception as e:
+                    finish(job, None, f"checkpoint: {type(e).__name__}: {e}")
+                    continue
+                scored = cp.get("score", keys["score"])
+                if scored is not None:
+                    finish(job, scored, cells=len(cp.get("ocr", keys["ocr"]) or []), resumed=True)
+                    continue
+                cells = cp.get("ocr", keys["ocr"])
+                restored = cells is not None
+                if restored:
+                    ctx.cells = cells
+                    if not covers_needed(cp, keys, output_dir / job.id, len(cells), save_covers):
+                        vision_q.put((job, ctx, cp, keys))
+                        continue
+                encode = cp.get("vision", keys["vision"]) is None
+                pending[pool.submit(_slice_job, ctx, options, restored, encode)] = (job, cp, keys, restored)
+            if not pending:
+                continue
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done:
+                job, cp, keys, restored = pending.pop(fut)
+                try:
+                    ctx, ocr_clean, trace_state = fut.result()
+                except Exception as e:
+                    finish(job, None, f"slice: {type(e).__name__}: {e}")
+                    continue
+                tracers[job.id].merge_state(trace_state)
+                if not restored:
+                    cp.put("ocr", keys["ocr"], ctx.cells, done=ocr_clean)
+                vision_q.put((job, ctx, cp, keys))
+
+    for _ in vision_threads:
+        vision_q.put(_DONE)
+    for t in vision_threads:
+        t.join()
+    embed_q.put(_DONE)
+    embed_thread.join()
+    all_tracers = list(tracers.values()) + [batch_tracer]
+    timings = summarize_tracers(all_tracers)
+    timings["creator_seconds"] = {
+        "count": len(seconds),
+        "p50": round(percentile(seconds, 50), 2),
+        "p95": round(percentile(seconds, 95), 2),
+        "max": round(max(seconds), 2) if seconds else 0.0,
+    }
+    timings_path = output_dir / BATCH_TIMINGS_FILENAME
+    timings_path.write_text(json.dumps(timings, ensure_ascii=False, indent=2), encoding="utf-8")
+    stats = {
+        "creators": len(jobs),
+        "done": counts["done"],
+        "errors": counts["errors"],
+        "resumed": counts["resumed"],
+        "seconds": round(time.perf_counter() - t_batch, 2),
+        "cost_usd": timings["vision_usage"]["cost_usd"],
+        "summary_path": str(summary_path),
+        "timings_path": str(timings_path),
+    }
+    if trace_path is not None:
+        stats["trace_path"] = str(export_trace(all_tracers, trace_path))
+    return stats
@@ -0,0 +1,136 @@
+"""
+已提供笔记标题时的轻量文案检测：不对文案区做整段 OCR，只读取封面上叠加的两处信息。
+- 置顶角标：各格封面左上角区域缩放到同一尺寸后堆叠成一个数组，按颜色（黄底）一次算出每格角标框内/外的黄色像素占比。
+- 点赞数：封面底部爱心右侧的小框，白字二值化为白底黑字并放大，交给数字白名单的 OCR 引擎（ocr_engines，whitelist 模式）。
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from config import (
+    LIKES_BOX,
+    LIKES_OCR_SCALE,
+    LIKES_OCR_WHITELIST,
+    ZHIDING_BADGE_BOX,
+    ZHIDING_MAX_OUTSIDE,
+    ZHIDING_MIN_FILL,
+    ZHIDING_SEARCH_BOX,
+)
+from grid import GridCell
+from ocr_utils import ocr_text_regions_batch, parse_like_count
+from tracing import annotate, traced
+
+if TYPE_CHECKING:
+    from disk_cache import DiskCache
+
+FracBox = Tuple[float, float, float, float]
+# 角标搜索区统一缩放到的尺寸（宽, 高）
+_SEARCH_SIZE = (64, 32)
+# 点赞数白字：三通道最小值高于该值
+_WHITE_MIN = 200
+
+
+def _frac_box(size: Tuple[int, int], frac: FracBox) -> Tuple[int, int, int, int]:
+    w, h = size
+    return (int(w * frac[0]), int(h * frac[1]), max(int(w * frac[0]) + 1, int(w * frac[2])), max(int(h * frac[1]) + 1, int(h * frac[3])))
+
+
+def _badge_template() -> np.ndarray:
+    """搜索区（_SEARCH_SIZE）内角标框的布尔模板。"""
+    sx0, sy0, sx1, sy1 = ZHIDING_SEARCH_BOX
+    bx0, by0, bx1, by1 = ZHIDING_BADGE_BOX
+    w, h = _SEARCH_SIZE
+    tpl = np.zeros((h, w), dtype=bool)
+    x0 = int(round((bx0 - sx0) / (sx1 - sx0) * w))
+    x1 = int(round((bx1 - sx0) / (sx1 - sx0) * w))
+    y0 = int(round((by0 - sy0) / (sy1 - sy0) * h))
+    y1 = int(round((by1 - sy0) / (sy1 - sy0) * h))
+    tpl[max(0, y0):min(h, y1), max(0, x0):min(w, x1)] = True
+    return tpl
+
+
+def detect_zhiding(cells: Sequence[GridCell]) -> List[bool]:
+    """
+    各格封面是否带「置顶」角标。每格只裁出左上角搜索区（ZHIDING_SEARCH_BOX）并缩放到同一尺寸，
+    堆叠后一次计算黄色掩码：角标框内黄色占比 >= ZHIDING_MIN_FILL 且框外 <= ZHIDING_MAX_OUTSIDE 即为置顶。
+    """
+    if not cells:
+        return []
+    stack = np.empty((len(cells), _SEARCH_SIZE[1], _SEARCH_SIZE[0], 3), dtype=np.uint8)
+    for i, cell in enumerate(cells):
+        x0, y0, x1, y1 = cell.cover_box
+        sx0, sy0, sx1, sy1 = _frac_box((x1 - x0, y1 - y0), ZHIDING_SEARCH_BOX)
+        region = cell.source.crop((x0 + sx0, y0 + sy0, x0 + sx1, y0 + sy1))
+        stack[i] = np.asarray(region.convert("RGB").resize(_SEARCH_SIZE, Image.NEAREST))
+    r, g, b = (stack[..., c].astype(np.int16) for c in range(3))
+    yellow = (r > 190) & (g > 150) & (b < 100) & (r - b > 120)
+    tpl = _badge_template()
+    inside = yellow[:, tpl].mean(axis=1)
+    outside = yellow[:, ~tpl].mean(axis=1)
+    return ((inside >= ZHIDING_MIN_FILL) & (outside <= ZHIDING_MAX_OUTSIDE)).tolist()
+
+
+def likes_region(cell: GridCell, scale: int = LIKES_OCR_SCALE) -> Optional[Image.Image]:
+    """
+    封面底部点赞数小框：白色文字转为白底黑字（L 模式），裁到文字外接框后放大 scale 倍、四周留白。
+    框内没有白色文字时返回 None（不必 OCR）。
+    """
+    x0, y0, x1, y1 = cell.cover_box
+    lx0, ly0, lx1, ly1 = _frac_box((x1 - x0, y1 - y0), LIKES_BOX)
+    rgb = np.asarray(cell.source.crop((x0 + lx0, y0 + ly0, x0 + lx1, y0 + ly1)).convert("RGB"))
+    ink = rgb.min(axis=2) > _WHITE_MIN
+    ys, xs = np.flatnonzero(ink.any(axis=1)), np.flatnonzero(ink.any(axis=0))
+    if ys.size == 0:
+        return None
+    ink = ink[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1]
+    im = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), "L")
+    if scale > 1:
+        im = im.resize((im.width * scale, im.height * scale), Image.LANCZOS)
+    return ImageOps.expand(im, border=8, fill=255)
+
+
+def read_likes(
+    cells: Sequence[GridCell],
+    lang: str = "chi_sim+eng",
+    engine: Optional[str] = None,
+    threads: Optional[int] = None,
+    cache: Optional["DiskCache"] = None,
+) -> List[Optional[int]]:
+    """
+    各格点赞数：有文字的点赞小框批量交给白名单（数字、小数点、万、w）OCR，再解析单位。
+    小框内没有文字或没有可用引擎时为 None；cache 同 ocr_utils.ocr_text_regions_batch。
+    """
+    regions = [likes_region(cell) for cell in cells]
+    todo = [i for i, im in enumerate(regions) if im is not None]
+    likes: List[Optional[int]] = [None] * len(regions)
+    if todo:
+        texts = ocr_text_regions_batch(
+            [regions[i] for i in todo], lang=lang, engine=engine, threads=threads, whitelist=LIKES_OCR_WHITELIST, cache=cache,
+        )
+        for i, text in zip(todo, texts):
+            likes[i] = parse_like_count(text)
+    return likes
+
+
+@traced("detect_cell_badges", "ocr")
+def detect_cell_badges(
+    cells: Sequence[GridCell],
+    lang: str = "chi_sim+eng",
+    engine: Optional[str] = None,
+    threads: Optional[int] = None,
+    cache: Optional["DiskCache"] = None,
+) -> List[dict]:
+    """
+    不做文案区 OCR 的 cell_info（raw 为空串，title 由调用方填入）：has_zhiding 来自封面角标颜色检测，
+    likes_approx 来自点赞小框的数字 OCR。
+    """
+    annotate(cells=len(cells))
+    flags = detect_zhiding(cells)
+    likes = read_likes(cells, lang=lang, engine=engine, threads=threads, cache=cache)
+    return [
+        {"raw": "", "title": "", "has_zhiding": bool(z), "likes_approx": n}
+        for z, n in zip(flags, likes)
+    ]
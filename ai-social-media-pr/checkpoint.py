@@ -0,0 +1,294 @@
+"""
+judge 的断点续跑：每个达人的输出目录下 checkpoint/manifest.json 记录各阶段（slice/OCR、vision、embed、score）的完成情况，
+每个阶段的键 = 截图内容哈希 + 该阶段及其上游的配置哈希，任一输入或配置变化时该阶段及下游自动作废。
+重跑时从第一个未完成的阶段继续：已完成的 OCR 结果、逐格 Vision 结果、封面向量与打分直接复用，
+Vision 只重新发送出错或缺失的格子，并且每完成一组格子就落盘一次，中途崩溃/断网最多损失一组。
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from PIL import Image
+
+from config import (
+    CELL_COVER_HEIGHT_RATIO,
+    CHECKPOINT_DIRNAME,
+    CROP_BOTTOM,
+    CROP_LEFT,
+    CROP_RIGHT,
+    CROP_TOP,
+    GRID_AUTO_DETECT,
+    GRID_COLS,
+    GRID_ROWS,
+    OCR_ENGINE,
+    OCR_LAZY_WITH_TITLES,
+    VISION_BATCH_SIZE,
+    VISION_CONCURRENCY,
+    VISION_DETAIL,
+)
+from disk_cache import DiskCache, sha256_hex
+from ocr_engines import ocr_error_scope, resolve_ocr_engine
+from pipeline import JudgeContext, stage_embed, stage_slice_ocr
+from tracing import traced
+from vision_cell import run_vision_on_cells
+from vision_prompt import COVER_JUDGE_SYSTEM, COVER_JUDGE_USER_TEMPLATE, load_cover_payload
+
+MANIFEST_VERSION = 1
+STAGES = ("ocr", "vision", "embed", "score")
+
+
+def screenshot_hash(source: Union[str, Path, Image.Image]) -> str:
+    """截图内容哈希：路径按文件字节，内存图按像素。"""
+    if isinstance(source, Image.Image):
+        return sha256_hex(source.mode, f"{source.width}x{source.height}", source.tobytes())
+    return sha256_hex(Path(source).read_bytes())
+
+
+def _digest(obj: Any) -> str:
+    return sha256_hex(json.dumps(obj, ensure_ascii=False, sort_keys=True, default=str))
+
+
+def _profile_digest(profile_dir: Path) -> str:
+    parts = []
+    for name in ("scoring.json", "criteria_type.json", "criteria_tone.json"):
+        p = Path(profile_dir) / name
+        parts.append(sha256_hex(p.read_bytes()) if p.exists() else "")
+    return _digest(parts)
+
+
+def stage_keys(
+    ctx: JudgeContext,
+    input_hash: str,
+    ocr_lang: str = "chi_sim+eng",
+    ocr_engine: Optional[str] = None,
+    max_cells: Optional[int] = None,
+    api_client: str = "openai",
+    vision_model: Optional[str] = None,
+    vision_detail: str = VISION_DETAIL,
+    similarity_bonus_scale: float = 0.5,
+    ann_nprobe: Optional[int] = None,
+) -> Dict[str, str]:
+    """
+    各阶段的键：下游的键包含上游的键，上游失效时下游随之失效。
+    Vision 的键不含每次请求的封面数（batch_size）：逐格结果与分组方式无关，改批次大小不作废已付费的结果。
+    """
+    grid = _digest([input_hash, GRID_ROWS, GRID_COLS, CROP_TOP, CROP_BOTTOM, CROP_LEFT, CROP_RIGHT,
+                    CELL_COVER_HEIGHT_RATIO, GRID_AUTO_DETECT, max_cells])
+    ocr = _digest([grid, ocr_lang, resolve_ocr_engine(ocr_engine or OCR_ENGINE), ctx.note_titles, OCR_LAZY_WITH_TITLES])
+    vision = _digest([grid, api_client, vision_model, vision_detail,
+                      sha256_hex(COVER_JUDGE_SYSTEM, COVER_JUDGE_USER_TEMPLATE)])
+    ref = ctx.resolve_ref_store()
+    ref_sig = None
+    if ref is not None:
+        st = ref.stat()
+        ref_sig = [str(ref), st.st_mtime_ns, st.st_size]
+    embed = _digest([grid, ref_sig, _embedding_tag()])
+    score = _digest([ocr, vision, embed, _profile_digest(ctx.profile_dir), ctx.creator_name, ctx.creator_desc,
+                     similarity_bonus_scale, ann_nprobe])
+    return {"ocr": ocr, "vision": vision, "embed": embed, "score": score}
+
+
+def _embedding_tag() -> str:
+    try:
+        from embedding_store import embedding_model_tag
+        return embedding_model_tag()
+    except Exception:
+        return "none"
+
+
+class Checkpoint:
+    """
+    单个达人的阶段清单：{"version", "input_hash", "stages": {阶段: {"key", "done", "data"}}}。
+    封面向量另存为同目录的 embeddings.npy（缺失行为 NaN）。写入先写临时文件再原子替换。
+    """
+
+    def __init__(self, directory: Union[str, Path], input_hash: str):
+        self.dir = Path(directory)
+        self.path = self.dir / "manifest.json"
+        self.input_hash = input_hash
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, json.JSONDecodeError):
+                data = {}
+            if data.get("version") == MANIFEST_VERSION and data.get("input_hash") == input_hash:
+                self.stages = data.get("stages") or {}
+
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        """阶段已完成且键一致时返回其数据，否则 None。"""
+        entry = self.stages.get(stage)
+        if entry and entry.get("key") == key and entry.get("done"):
+            return entry.get("data")
+        return None
+
+    def partial(self, stage: str, key: str) -> Optional[Any]:
+        """键一致时返回该阶段已保存的数据（可能未完成，如部分格子的 Vision 结果）。"""
+        entry = self.stages.get(stage)
+        if entry and entry.get("key") == key:
+            return entry.get("data")
+        return None
+
+    def put(self, stage: str, key: str, data: Any, done: bool = True) -> None:
+        with self._lock:
+            self.stages[stage] = {"key": key, "done": done, "data": data}
+            self._save_locked()
+
+    def status(self) -> Dict[str, str]:
+        return {s: ("done" if self.stages.get(s, {}).get("done") else "partial" if s in self.stages else "missing") for s in STAGES}
+
+    def save_embeddings(self, key: str, embs: Optional[List[Optional[List[float]]]]) -> None:
+        """有向量时写 embeddings.npy（需 numpy；没有参考库时 embs 为 None，只记录阶段完成）。"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if embs:
+            import numpy as np
+            dim = max((len(e) for e in embs if e is not None), default=0)
+            arr = np.full((len(embs), dim), np.nan, dtype=np.float32)
+            for i, e in enumerate(embs):
+                if e is not None:
+                    arr[i] = e
+            tmp = self.dir / "embeddings.tmp.npy"
+            np.save(tmp, arr)
+            os.replace(tmp, self.dir / "embeddings.npy")
+        self.put("embed", key, {"count": len(embs) if embs else 0, "present": embs is not None})
+
+    def load_embeddings(self, key: str) -> Optional[List[Optional[List[float]]]]:
+        """已完成的 embed 阶段的封面向量（缺失的格子为 None）；阶段未完成或当时没有向量时返回 None。"""
+        data = self.get("embed", key)
+        if not data or not data.get("present"):
+            return None
+        import numpy as np
+        arr = np.load(self.dir / "embeddings.npy")
+        return [None if np.isnan(row).all() else row.tolist() for row in arr]
+
+    def _save_locked(self) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        payload = {"version": MANIFEST_VERSION, "input_hash": self.input_hash, "stages": self.stages}
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def open_checkpoint(output_dir: Union[str, Path], screenshot: Union[str, Path, Image.Image], fresh: bool = False) -> Checkpoint:
+    """打开 output_dir/checkpoint/；截图内容变了或 fresh=True 时从空清单开始（旧清单在首次写入时被覆盖）。"""
+    cp = Checkpoint(Path(output_dir) / CHECKPOINT_DIRNAME, screenshot_hash(screenshot))
+    if fresh:
+        cp.stages = {}
+    return cp
+
+
+def restore_covers(ctx: JudgeContext, max_cells: Optional[int] = None) -> None:
+    """只切格取封面、不做 OCR（OCR 已从清单恢复，但 Vision/embed/落盘还需要封面像素时）。"""
+    if ctx.covers:
+        return
+    if max_cells is None:
+        from grid import slice_screenshot
+        ctx.covers = [cell.cover for cell in slice_screenshot(ctx.screenshot)]
+    else:
+        from grid_stream import iter_grid_cells
+        ctx.covers = [cell.cover for cell in iter_grid_cells(ctx.screenshot, max_cells=max_cells)]
+
+
+def covers_needed(cp: Checkpoint, keys: Dict[str, str], output_dir: Union[str, Path], n_cells: int, save_covers: bool = True) -> bool:
+    """OCR 已恢复时是否仍需切出封面：Vision 或 embed 未完成，或需要落盘封面而 covers/ 不全。"""
+    if cp.get("vision", keys["vision"]) is None or cp.get("embed", keys["embed"]) is None:
+        return True
+    covers_dir = Path(output_dir) / "covers"
+    return save_covers and not all((covers_dir / f"cell_{i:02d}.jpg").exists() for i in range(n_cells))
+
+
+def resume_slice_ocr(
+    ctx: JudgeContext,
+    cp: Checkpoint,
+    keys: Dict[str, str],
+    ocr_lang: str = "chi_sim+eng",
+    ocr_engine: Optional[str] = None,
+    ocr_threads: Optional[int] = None,
+    ocr_cache: Optional[DiskCache] = None,
+    max_cells: Optional[int] = None,
+) -> bool:
+    """
+    OCR 阶段：清单中已完成时恢复 ctx.cells（不切格），否则切格 + OCR 并记录。
+    本次 OCR 引擎出过错时只记为未完成（下次重跑），返回是否从清单恢复。
+    """
+    cells = cp.get("ocr", keys["ocr"])
+    if cells is not None:
+        ctx.cells = cells
+        return True
+    # 只统计本次调用的出错次数：引擎在并发任务间共享，进程级累计值会被其它达人的 OCR 错误影响
+    with ocr_error_scope() as errors:
+        stage_slice_ocr(ctx, ocr_lang=ocr_lang, ocr_engine=ocr_engine, ocr_threads=ocr_threads, ocr_cache=ocr_cache, max_cells=max_cells)
+    cp.put("ocr", keys["ocr"], ctx.cells, done=errors[0] == 0)
+    return False
+
+
+@traced("resume_vision", "stage")
+def resume_vision(
+    ctx: JudgeContext,
+    cp: Checkpoint,
+    keys: Dict[str, str],
+    max_cells: Optional[int] = None,
+    api_client: str = "openai",
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    concurrency: int = VISION_CONCURRENCY,
+    cache: Optional[DiskCache] = None,
+    batch_size: int = VISION_BATCH_SIZE,
+    detail: str = VISION_DETAIL,
+) -> int:
+    """
+    Vision 阶段：沿用清单中成功的逐格结果，只对出错或缺失的格子发请求；每组（concurrency × batch_size 格）完成后落盘。
+    全部格子成功时阶段记为完成。返回本次实际发送的格子数。
+    """
+    n = len(ctx.cells)
+    saved = cp.partial("vision", keys["vision"]) or []
+    results: List[Optional[Dict[str, Any]]] = [
+        saved[i] if i < len(saved) and saved[i] and not saved[i].get("error") else None for i in range(n)
+    ]
+    todo = [i for i, r in enumerate(results) if r is None]
+    if todo:
+        restore_covers(ctx, max_cells)
+        if len(ctx.cover_payloads) != len(ctx.covers):
+            ctx.cover_payloads = [None] * len(ctx.covers)
+        step = max(1, concurrency) * max(1, batch_size)
+        for s in range(0, len(todo), step):
+            chunk = todo[s:s + step]
+            for i in chunk:
+                if ctx.cover_payloads[i] is None:
+                    ctx.cover_payloads[i] = load_cover_payload(ctx.covers[i], detail=detail)
+            out = run_vision_on_cells(
+                [ctx.cover_payloads[i] for i in chunk], api_client=api_client, model=model, api_key=api_key,
+                concurrency=concurrency, cache=cache, batch_size=batch_size, detail=detail,
+                cover_labels=[ctx.cover_label(i) for i in chunk],
+            )
+            for i, r in zip(chunk, out):
+                results[i] = r
+            cp.put("vision", keys["vision"], results, done=all(r and not r.get("error") for r in results))
+    elif cp.get("vision", keys["vision"]) is None:
+        cp.put("vision", keys["vision"], results, done=True)
+    ctx.vision_results = [r for r in results if r is not None]
+    return len(todo)
+
+
+def resume_embed(ctx: JudgeContext, cp: Checkpoint, keys: Dict[str, str], max_cells: Optional[int] = None, cache: Optional[DiskCache] = None) -> bool:
+    """embed 阶段：清单中已完成时恢复向量（没有参考库时为 None），否则编码并记录。返回是否从清单恢复。"""
+    if cp.get("embed", keys["embed"]) is not None:
+        ctx.cell_embeddings = cp.load_embeddings(keys["embed"])
+        return True
+    if ctx.resolve_ref_store() is not None:
+        restore_covers(ctx, max_cells)
+    stage_embed(ctx, cache=cache)
+    cp.save_embeddings(keys["embed"], ctx.cell_embeddings)
+    return False
+
+
+def record_score(cp: Checkpoint, keys: Dict[str, str], result: Dict[str, Any]) -> None:
+    """记录打分结果；上游有未完成的阶段（如部分格子 Vision 出错）时记为未完成，下次重跑会补齐后重新打分。"""
+    done = all(cp.get(stage, keys[stage]) is not None for stage in ("ocr", "vision", "embed"))
+    cp.put("score", keys["score"], result, done=done)
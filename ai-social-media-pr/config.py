@@ -19,3 +19,116 @@ CELL_COVER_HEIGHT_RATIO = 0.72
 
 REFERENCE_WIDTH = 1920
 REFERENCE_HEIGHT = 1080
+
+# 自动检测网格（grid_detect.py）：按行/列剖面找封面块与间隔，检测失败时回退到上面的固定比例
+GRID_AUTO_DETECT = True
+GRID_DETECT_DOWNSCALE = 2  # 在 1/2 缩略图上检测
+GRID_DETECT_CACHE_SIZE = 64  # 进程内缓存的版式数
+# 长截图流式切格（grid_stream.py）：每次解码的行带高度（像素），窗口约为 行带 + 上一行带未用完的部分
+GRID_STREAM_BAND_HEIGHT = 1600
+
+# OCR 批量模式：多格文案区纵向拼成一张图只调用一次 Tesseract（TSV 输出按包围框映射回各格）
+OCR_BATCH = True
+OCR_BATCH_MAX_CELLS = 24  # 每张拼图的格子数（长截图流式切格时按此分批）
+OCR_MONTAGE_GAP = 16  # 每格上下留白（像素），避免相邻格的文字被识别为同一行
+OCR_MONTAGE_PSM = 4  # Tesseract 页面分割模式：4 = 单列、行高可变的文本
+# OCR 引擎（ocr_engines.py）：auto（依次尝试 tesserocr、tesseract、rapidocr）/ tesseract / tesserocr / rapidocr
+OCR_ENGINE = "auto"
+OCR_THREADS = None  # OCR 工作线程数（每线程一个常驻会话）；None 为 min(4, CPU 核数)
+# 已提供全部笔记标题时跳过文案区整段 OCR，只检测封面上的置顶角标并对点赞数小框做数字 OCR（cell_badges.py）
+OCR_LAZY_WITH_TITLES = True
+# 以下框均为相对封面宽高的比例 (x0, y0, x1, y1)
+ZHIDING_SEARCH_BOX = (0.0, 0.0, 0.4, 0.2)  # 置顶角标所在的左上角区域
+ZHIDING_BADGE_BOX = (0.05, 0.043, 0.245, 0.13)  # 角标本身（黄底「置顶」）
+ZHIDING_MIN_FILL = 0.5  # 角标框内黄色像素占比下限
+ZHIDING_MAX_OUTSIDE = 0.1  # 搜索区内角标框外黄色像素占比上限（排除大面积黄色封面）
+LIKES_BOX = (0.19, 0.88, 0.75, 0.975)  # 封面底部爱心图标右侧的点赞数
+LIKES_OCR_SCALE = 2  # 点赞数小框放大倍数（字号约 14px，放大后识别更稳）
+LIKES_OCR_WHITELIST = "0123456789.万w"
+# OCR 结果缓存（SQLite，键 = 文案区文字掩码摘要 + 语言 + 引擎 + 字符白名单）：重复筛查同一达人时未变化的格子不再 OCR
+OCR_CACHE_FILENAME = "ocr_cache.sqlite"
+OCR_CACHE_MAX_ENTRIES = 200_000
+OCR_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 按最近访问时间淘汰
+OCR_CACHE_VERSION = "2"  # 改动键或预处理时递增，使旧条目整体失效
+
+# Vision：同时在途请求数的起点（1 表示逐格串行），之后按限流/成功自适应调整（见 rate_limit.py）
+VISION_CONCURRENCY = 6
+
+# Vision 结果缓存（SQLite，键 = 封面内容哈希 + Prompt 哈希 + provider + model）
+VISION_CACHE_FILENAME = "vision_cache.sqlite"
+VISION_CACHE_MAX_ENTRIES = 200_000
+VISION_CACHE_MAX_AGE_DAYS = 90
+
+# Vision 批量模式：每次请求发送的封面数（1 表示逐格请求；如 6/8/12 可把 24 次请求降到 2–4 次）
+VISION_BATCH_SIZE = 1
+
+# Vision 限流与重试：按 provider 的每秒请求数（令牌桶，按 provider+model 共享），
+# 自适应并发在 [1, max(起点, VISION_ADAPTIVE_MAX_CONCURRENCY)] 内随限流/成功调整
+VISION_RATE_LIMITS = {"openai": 8.0, "gemini": 4.0, "anthropic": 4.0, "stub": 1000.0, "default": 4.0}
+VISION_ADAPTIVE_MAX_CONCURRENCY = 16
+VISION_MAX_RETRIES = 5
+VISION_RETRY_BASE_DELAY = 1.0  # 秒，指数退避基数
+VISION_RETRY_MAX_DELAY = 60.0
+
+# Vision 上传前的缩放/重编码档位：max_side 为长边上限（None 不缩放），detail 为 OpenAI image_url.detail
+# low 档（≤512px）对应 OpenAI 低细节固定 token 档，上传体积与延迟最小
+VISION_DETAIL_TIERS = {
+    "low": {"max_side": 512, "quality": 80, "detail": "low"},
+    "high": {"max_side": 1024, "quality": 85, "detail": "high"},
+    "original": {"max_side": None, "quality": None, "detail": "auto"},
+}
+VISION_DETAIL = "low"
+# 离线 Vision 后端（--api stub）：不联网，按封面内容哈希生成确定性结果；每次请求模拟的延迟（秒）
+VISION_STUB_LATENCY = 0.0
+# Vision 单价（美元 / 百万 token：输入, 输出），用于 tracing 汇总 API 费用；未登记的模型只统计 token 不计费
+VISION_PRICING = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "claude-sonnet-4-20250514": (3.00, 15.00),
+    "stub-v1": (0.0, 0.0),
+}
+
+# 批量 judge（judge.py --batch）：切格/OCR 进程数（None 为 min(4, CPU 核数)）、同时在 Vision 阶段的达人数、
+# 阶段间有界队列长度、每次 CLIP 编码合并的封面数上限
+BATCH_SLICE_WORKERS = None
+BATCH_VISION_WORKERS = 4
+BATCH_QUEUE_SIZE = 8
+BATCH_EMBED_MAX_COVERS = 256
+BATCH_SUMMARY_FILENAME = "summary.jsonl"
+BATCH_TIMINGS_FILENAME = "batch_timings.json"  # 批量级各阶段 p50/p95 与 API 费用
+# 断点续跑（checkpoint.py）：每个输出目录下的清单子目录（manifest.json + embeddings.npy）
+CHECKPOINT_DIRNAME = "checkpoint"
+
+# 常驻 judge 服务（scripts/judge_server.py）：同时执行的任务数、排队上限（满时返回 503）、内存中保留的已完成任务数、
+# 单次请求体上限（base64 截图）
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_WORKERS = 2
+SERVICE_QUEUE_SIZE = 64
+SERVICE_MAX_JOBS = 1000
+SERVICE_MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# 封面向量模型（sentence-transformers 名称），进程内只加载一次
+EMBEDDING_MODEL_NAME = "clip-ViT-B-32"
+# 模型修订号：替换同名模型权重或改动预处理时递增，使封面向量缓存整体失效
+EMBEDDING_MODEL_REVISION = "1"
+
+# 封面向量缓存：按图片内容哈希 + 模型名/版本存 embedding（SQLite，与 Vision 缓存同目录），外加进程内 LRU
+EMBEDDING_CACHE_FILENAME = "embedding_cache.sqlite"
+EMBEDDING_CACHE_MAX_ENTRIES = 500_000
+EMBEDDING_LRU_SIZE = 4096
+
+# 封面编码后端："auto"（已导出 ONNX 且装了 onnxruntime 时用 ONNX，否则 sentence-transformers）、"onnx"、"sentence-transformers"
+# ONNX 图像塔由 scripts/export_clip_onnx.py 导出到 <项目>/EMBEDDING_ONNX_DIR（默认 int8 量化）
+EMBEDDING_BACKEND = "auto"
+EMBEDDING_ONNX_DIR = "models"
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_THREADS = None  # None 时由后端决定（通常为物理核数）
+
+# 参考向量库近似最近邻（IVF）：条数 ≥ ANN_MIN_REFS 时 build 阶段自动建索引；
+# ANN_NPROBE 为查询时扫描的桶数（0 表示始终精确搜索），越大召回越高
+ANN_MIN_REFS = 4096
+ANN_NLIST = None  # None 时按 4·√n 自动选择
+ANN_NPROBE = 16
+ANN_KMEANS_ITERS = 15
@@ -0,0 +1,171 @@
+"""
+基于 SQLite 的持久化键值缓存：按内容哈希存取结果，支持按条数/字节数/时长淘汰（LRU），并统计命中率。
+供 Vision 结果等「贵且可复用」的中间结果使用；多线程安全，WAL 模式下可被多个进程共享。
+读命中只在内存中记下访问时间，攒够 _ACCESS_FLUSH 条或下次写入/淘汰时一并写回；淘汰检查每 _EVICT_EVERY 次写入做一次
+（两次检查之间条数/字节数最多超出上限 _EVICT_EVERY 条），避免大缓存上每次读写都扫全表。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+# 每多少次写入做一次淘汰检查（首次写入时也检查一次）
+_EVICT_EVERY = 256
+# 读命中的访问时间攒够多少条写回一次
+_ACCESS_FLUSH = 256
+
+
+def sha256_hex(*parts: Union[bytes, str]) -> str:
+    """对若干段 bytes/str 依次做 sha256，返回十六进制摘要。"""
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, str):
+            p = p.encode("utf-8")
+        h.update(len(p).to_bytes(8, "big"))
+        h.update(p)
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    SQLite 缓存。max_entries / max_bytes 超限时按最近访问时间淘汰；max_age_seconds 过期的条目视为未命中并删除。
+    任何参数为 None 表示不限制。
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_age_seconds: Optional[float] = None,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_created ON entries(created)")
+        self._conn.commit()
+        self._accessed: Dict[str, float] = {}
+        self._writes_since_evict = _EVICT_EVERY - 1
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created = row
+            if self.max_age_seconds is not None and now - created > self.max_age_seconds:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= _ACCESS_FLUSH:
+                self._flush_accessed_locked()
+                self._conn.commit()
+            self.hits += 1
+            return bytes(value)
+
+    def set(self, key: str, value: bytes) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), now, now),
+            )
+            self.writes += 1
+            self._accessed.pop(key, None)
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= _EVICT_EVERY:
+                self._writes_since_evict = 0
+                self._flush_accessed_locked()
+                self._evict_locked(now)
+            self._conn.commit()
+
+    def get_json(self, key: str) -> Optional[Any]:
+        raw = self.get(key)
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return None
+
+    def set_json(self, key: str, value: Any) -> None:
+        self.set(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def _flush_accessed_locked(self) -> None:
+        if self._accessed:
+            self._conn.executemany("UPDATE entries SET accessed = ? WHERE key = ?", [(t, k) for k, t in self._accessed.items()])
+            self._accessed.clear()
+
+    def _evict_locked(self, now: float) -> None:
+        cur = self._conn
+        if self.max_age_seconds is not None:
+            n = cur.execute("DELETE FROM entries WHERE created < ?", (now - self.max_age_seconds,)).rowcount
+            self.evictions += max(n, 0)
+        if self.max_entries is not None:
+            count = cur.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            over = count - self.max_entries
+            if over > 0:
+                n = cur.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed ASC LIMIT ?)",
+                    (over,),
+                ).rowcount
+                self.evictions += max(n, 0)
+        if self.max_bytes is not None:
+            total = cur.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                freed = 0
+                victims = []
+                for key, size in cur.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+                    victims.append((key,))
+                    freed += size
+                    if total - freed <= self.max_bytes:
+                        break
+                cur.executemany("DELETE FROM entries WHERE key = ?", victims)
+                self.evictions += len(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "path": str(self.path),
+            "entries": count,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_accessed_locked()
+            self._conn.commit()
+            self._conn.close()
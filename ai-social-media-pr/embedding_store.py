@@ -1,50 +1,262 @@
 """
 封面向量化：对样本正例封面生成 embedding 并存储；对新封面算 embedding 与参考向量相似度，可融入打分。
+sentence-transformers（及 torch）在首次需要模型时才导入，模型句柄按名称在进程内缓存，只加载一次。
+封面 embedding 按图片内容哈希缓存（进程内 LRU + 可选 SQLite），缓存全部命中时不加载模型。
+编码后端可选 sentence-transformers 或 ONNX Runtime（int8 量化的 CLIP 图像塔，见 onnx_clip.py），按批处理内存中的 PIL 图。
 """
 from __future__ import annotations
 
+import importlib.util
 import json
+import os
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from config import (
+    ANN_MIN_REFS,
+    ANN_NLIST,
+    ANN_NPROBE,
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CACHE_FILENAME,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_LRU_SIZE,
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_MODEL_REVISION,
+    EMBEDDING_THREADS,
+)
+from disk_cache import DiskCache, sha256_hex
+from tracing import annotate, traced
 
 try:
-    from sentence_transformers import SentenceTransformer
-    _ST_AVAILABLE = True
+    import numpy as np
+    _NP_AVAILABLE = True
 except ImportError:
-    _ST_AVAILABLE = False
+    _NP_AVAILABLE = False
 
+_MODEL_LOCK = threading.Lock()
+_MODELS: Dict[Tuple[str, str], Any] = {}
 
-def get_image_embedding_model():
-    if not _ST_AVAILABLE:
-        return None
-    try:
-        return SentenceTransformer("clip-ViT-B-32")
-    except Exception:
-        return None
+# 封面输入：路径、PIL 图或 (H, W, 3) uint8 数组
+ImageInput = Union[str, Path, Image.Image, "np.ndarray"]
 
 
-def embed_image(image_path: Union[str, Path], model) -> Optional[List[float]]:
-    if model is None:
-        return None
-    try:
-        path = Path(image_path)
-        if not path.exists():
+def sentence_transformers_available() -> bool:
+    """是否安装了 sentence-transformers（只查找模块，不导入 torch）。"""
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+
+def resolve_embedding_backend(model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND) -> str:
+    """
+    "auto"/"onnx" 在已导出 ONNX 图像塔且装了 onnxruntime 时解析为 "onnx"，否则回退 "sentence-transformers"。
+    只检查文件与模块是否存在，不导入。
+    """
+    if backend in ("auto", "onnx"):
+        from onnx_clip import default_onnx_path, onnxruntime_available
+        if onnxruntime_available() and default_onnx_path(model_name).exists():
+            return "onnx"
+    return "sentence-transformers"
+
+
+def get_image_embedding_model(
+    model_name: str = EMBEDDING_MODEL_NAME,
+    backend: str = EMBEDDING_BACKEND,
+    threads: Optional[int] = EMBEDDING_THREADS,
+):
+    """
+    返回进程内共享的模型句柄（按 模型名 + 后端 缓存）；首次调用时才导入 sentence_transformers / onnxruntime 并加载。
+    两种后端都提供 encode(images, batch_size=...)。threads 为 CPU 推理线程数（仅首次加载时生效）。
+    未安装或加载失败时返回 None（失败结果同样缓存，避免每次重试加载）。
+    """
+    resolved = resolve_embedding_backend(model_name, backend)
+    key = (model_name, resolved)
+    with _MODEL_LOCK:
+        if key in _MODELS:
+            return _MODELS[key]
+        model = None
+        if resolved == "onnx":
+            try:
+                from onnx_clip import OnnxClipImageEncoder, default_onnx_path
+                model = OnnxClipImageEncoder(default_onnx_path(model_name), threads=threads)
+            except Exception:
+                model = None
+        elif sentence_transformers_available():
+            try:
+                from sentence_transformers import SentenceTransformer
+                if threads:
+                    import torch
+                    torch.set_num_threads(int(threads))
+                model = SentenceTransformer(model_name)
+            except Exception:
+                model = None
+        _MODELS[key] = model
+        return model
+
+
+def _as_pil(image: ImageInput) -> Image.Image:
+    """CLIP 模型只把 PIL 图当作图像编码（字符串会被当作文本），路径需先打开，数组转为 PIL。"""
+    if isinstance(image, Image.Image):
+        return image.convert("RGB") if image.mode != "RGB" else image
+    if _NP_AVAILABLE and isinstance(image, np.ndarray):
+        return Image.fromarray(np.ascontiguousarray(image, dtype=np.uint8)).convert("RGB")
+    with Image.open(image) as im:
+        return im.convert("RGB")
+
+
+def embedding_model_tag(
+    model_name: str = EMBEDDING_MODEL_NAME,
+    backend: str = EMBEDDING_BACKEND,
+    model: Any = None,
+) -> str:
+    """
+    缓存键中的模型标识：模型名 + config.EMBEDDING_MODEL_REVISION + 后端（sentence-transformers 版本，
+    或 ONNX 文件名与大小）。int8 量化结果与原模型略有差异，两者缓存互不混用。不导入 torch。
+    """
+    tag = getattr(model, "cache_tag", None)
+    if tag is None and model is None and resolve_embedding_backend(model_name, backend) == "onnx":
+        from onnx_clip import default_onnx_path
+        p = default_onnx_path(model_name)
+        tag = f"ort:{p.name}:{p.stat().st_size}"
+    if tag is None:
+        try:
+            from importlib.metadata import version
+            tag = f"st{version('sentence-transformers')}"
+        except Exception:
+            tag = "stnone"
+    return f"{model_name}@{EMBEDDING_MODEL_REVISION}/{tag}"
+
+
+def open_embedding_cache(cache_dir: Union[str, Path]) -> DiskCache:
+    """在 cache_dir 下打开（或创建）封面向量缓存。"""
+    return DiskCache(Path(cache_dir) / EMBEDDING_CACHE_FILENAME, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+
+
+def image_content_hash(image: ImageInput) -> str:
+    """路径按文件字节、内存图按 RGB 像素做 sha256（命中缓存时路径输入无需解码）。"""
+    if _NP_AVAILABLE and isinstance(image, np.ndarray):
+        image = _as_pil(image)
+    if isinstance(image, Image.Image):
+        im = image.convert("RGB") if image.mode != "RGB" else image
+        return sha256_hex("RGB", f"{im.width}x{im.height}", im.tobytes())
+    return sha256_hex(Path(image).read_bytes())
+
+
+_EMB_LRU: "OrderedDict[str, List[float]]" = OrderedDict()
+_EMB_LOCK = threading.Lock()
+_EMB_STATS = {"lru_hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def _cached_embedding(key: str, cache: Optional[DiskCache]) -> Optional[List[float]]:
+    with _EMB_LOCK:
+        emb = _EMB_LRU.get(key)
+        if emb is not None:
+            _EMB_LRU.move_to_end(key)
+            _EMB_STATS["lru_hits"] += 1
+            return emb
+    raw = cache.get(key) if cache is not None else None
+    with _EMB_LOCK:
+        if raw is None:
+            _EMB_STATS["misses"] += 1
             return None
-        emb = model.encode(str(path))
-        return emb.tolist()
-    except Exception:
+        _EMB_STATS["disk_hits"] += 1
+    emb = np.frombuffer(raw, dtype=np.float32).tolist()
+    _remember_embedding(key, emb)
+    return emb
+
+
+def _remember_embedding(key: str, emb: List[float]) -> None:
+    with _EMB_LOCK:
+        _EMB_LRU[key] = emb
+        _EMB_LRU.move_to_end(key)
+        while len(_EMB_LRU) > EMBEDDING_LRU_SIZE:
+            _EMB_LRU.popitem(last=False)
+
+
+def embedding_cache_stats(cache: Optional[DiskCache] = None) -> Dict[str, Any]:
+    """进程内 LRU / 磁盘缓存的命中统计；传入 cache 时附带其 SQLite 统计。"""
+    with _EMB_LOCK:
+        s: Dict[str, Any] = dict(_EMB_STATS)
+        s["lru_entries"] = len(_EMB_LRU)
+    lookups = s["lru_hits"] + s["disk_hits"] + s["misses"]
+    s["hit_rate"] = round((s["lru_hits"] + s["disk_hits"]) / lookups, 3) if lookups else 0.0
+    if cache is not None:
+        s["disk"] = cache.stats()
+    return s
+
+
+def embed_image(
+    image_path: ImageInput,
+    model=None,
+    cache: Optional[DiskCache] = None,
+) -> Optional[List[float]]:
+    if isinstance(image_path, (str, Path)) and not Path(image_path).exists():
         return None
+    return embed_images([image_path], model, cache=cache)[0]
 
 
-def embed_images(image_paths: List[Union[str, Path]], model) -> List[Optional[List[float]]]:
+@traced("embed_images", "embed")
+def embed_images(
+    image_paths: List[ImageInput],
+    model=None,
+    cache: Optional[DiskCache] = None,
+    model_name: str = EMBEDDING_MODEL_NAME,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    threads: Optional[int] = EMBEDDING_THREADS,
+    backend: str = EMBEDDING_BACKEND,
+) -> List[Optional[List[float]]]:
+    """
+    对一组封面（路径、内存中的 PIL 图或 uint8 数组）编码，返回与输入等长的 embedding 列表（失败项为 None）。
+    先按内容哈希查进程内 LRU 与 cache（键含模型名/版本/后端），只把未命中的封面送入模型；
+    model 为 None 时仅在确有未命中时才按 backend/threads 加载模型。
+    未命中的封面每 batch_size 张解码并编码一批，大批量（上千张）时内存占用有上界。
+    """
+    out: List[Optional[List[float]]] = [None] * len(image_paths)
+    if not _NP_AVAILABLE:
+        return out
+    tag = embedding_model_tag(model_name, backend, model)
+    keys: List[Optional[str]] = [None] * len(image_paths)
+    pending: List[int] = []
+    for i, p in enumerate(image_paths):
+        try:
+            keys[i] = f"emb:{tag}:{image_content_hash(p)}"
+        except Exception:
+            continue
+        out[i] = _cached_embedding(keys[i], cache)
+        if out[i] is None:
+            pending.append(i)
+    annotate(images=len(image_paths), encoded=len(pending))
+    if not pending:
+        return out
     if model is None:
-        return [None] * len(image_paths)
-    try:
-        paths = [str(Path(p)) for p in image_paths]
-        embs = model.encode(paths)
-        return [e.tolist() for e in embs]
-    except Exception:
-        return [None] * len(image_paths)
+        model = get_image_embedding_model(model_name, backend=backend, threads=threads)
+        if model is None:
+            return out
+    batch_size = max(1, int(batch_size))
+    for start in range(0, len(pending), batch_size):
+        images, indices = [], []
+        for i in pending[start:start + batch_size]:
+            try:
+                images.append(_as_pil(image_paths[i]))
+                indices.append(i)
+            except Exception:
+                continue
+        if not images:
+            continue
+        try:
+            embs = model.encode(images, batch_size=batch_size)
+        except Exception:
+            continue
+        for i, e in zip(indices, embs):
+            vec = np.asarray(e, dtype=np.float32)
+            out[i] = vec.tolist()
+            _remember_embedding(keys[i], out[i])
+            if cache is not None:
+                cache.set(keys[i], vec.tobytes())
+    return out
 
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -58,43 +270,378 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
     return dot / (na * nb)
 
 
-def build_reference_store(cover_paths: List[Union[str, Path]], labels: List[dict], output_path: Union[str, Path]) -> bool:
-    model = get_image_embedding_model()
-    if model is None:
+# 参考向量库默认文件名：二进制向量块 + 元数据 sidecar；旧版 JSON 仍可读取
+REF_STORE_FILENAME = "ref_embeddings.npy"
+LEGACY_REF_STORE_FILENAME = "ref_embeddings.json"
+REF_STORE_FORMAT_VERSION = 1
+
+
+def meta_path_for(store_path: Union[str, Path]) -> Path:
+    """ref_embeddings.npy 对应的元数据文件 ref_embeddings.meta.json。"""
+    return Path(store_path).with_suffix(".meta.json")
+
+
+def ann_path_for(store_path: Union[str, Path]) -> Path:
+    """ref_embeddings.npy 对应的 IVF 近似最近邻索引 ref_embeddings.ivf.npz。"""
+    return Path(store_path).with_suffix(".ivf.npz")
+
+
+def _store_signature(store_path: Path) -> Tuple[int, int]:
+    st = store_path.stat()
+    return (st.st_mtime_ns, st.st_size)
+
+
+def build_ann_index(store_path: Union[str, Path], nlist: Optional[int] = ANN_NLIST) -> bool:
+    """为已有的 .npy 参考库（重新）构建 IVF 索引并保存到 ann_path_for(store_path)。"""
+    from ann_index import IVFIndex
+    store_path = Path(store_path)
+    if store_path.suffix != ".npy" or not store_path.exists():
         return False
-    embs = embed_images(cover_paths, model)
+    matrix = np.load(store_path, mmap_mode="r")
+    if len(matrix) == 0:
+        return False
+    IVFIndex.build(matrix, nlist=nlist).save(ann_path_for(store_path), _store_signature(store_path))
+    return True
+
+
+def resolve_reference_store_path(profile_dir: Union[str, Path]) -> Optional[Path]:
+    """profile 下的参考向量库：优先二进制 .npy，其次旧版 ref_embeddings.json；都没有时返回 None。"""
+    d = Path(profile_dir)
+    for name in (REF_STORE_FILENAME, LEGACY_REF_STORE_FILENAME):
+        p = d / name
+        if p.exists():
+            return p
+    return None
+
+
+def _write_binary_store(
+    output_path: Path,
+    matrix: "np.ndarray",
+    metadata: List[dict],
+    sources: Optional[Dict[str, dict]] = None,
+) -> None:
+    """
+    写 .npy（预归一化 float32，(n, d)）+ .meta.json。先写临时文件再原子替换，
+    其他进程正在 mmap 的旧文件不受影响。sources 为已处理样本截图 {内容哈希: 信息}，供增量构建跳过。
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    if len(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "format_version": REF_STORE_FORMAT_VERSION,
+        "model": EMBEDDING_MODEL_NAME,
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "count": len(metadata),
+        "normalized": True,
+        "entries": metadata,
+    }
+    if sources is not None:
+        meta["sources"] = sources
+    tmp_npy = output_path.with_name(output_path.name + ".tmp")
+    tmp_meta = meta_path_for(output_path).with_name(meta_path_for(output_path).name + ".tmp")
+    with open(tmp_npy, "wb") as f:
+        np.save(f, matrix)
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_npy, output_path)
+    os.replace(tmp_meta, meta_path_for(output_path))
+
+
+def _refresh_ann_index(store_path: Path, count: int) -> None:
+    """库足够大时重建 IVF 索引，否则删除可能残留的旧索引（小库精确搜索已足够快）。"""
+    if count >= ANN_MIN_REFS:
+        build_ann_index(store_path)
+    else:
+        ann_path_for(store_path).unlink(missing_ok=True)
+
+
+def _ref_id(i: int, label: dict) -> str:
+    """带来源哈希的条目用「哈希前缀_格号」作稳定 id，增量追加时不会与已有条目冲突。"""
+    sha = label.get("source_sha256")
+    if sha and label.get("cell_index") is not None:
+        return f"{sha[:12]}_{int(label['cell_index']):02d}"
+    return f"ref_{i}"
+
+
+def _embed_entries(
+    cover_paths: List[Union[str, Path]],
+    labels: List[dict],
+    start: int = 0,
+    cache: Optional[DiskCache] = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    threads: Optional[int] = EMBEDDING_THREADS,
+) -> List[dict]:
+    embs = embed_images(cover_paths, cache=cache, batch_size=batch_size, threads=threads)
     store = []
     for i, (path, lab) in enumerate(zip(cover_paths, labels)):
         if embs[i] is None:
             continue
-        store.append({"id": f"ref_{i}", "cover_path": str(path), "embedding": embs[i], **lab})
-    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        store.append({"id": _ref_id(start + i, lab), "cover_path": str(path), "embedding": embs[i], **lab})
+    return store
+
+
+def build_reference_store(
+    cover_paths: List[Union[str, Path]],
+    labels: List[dict],
+    output_path: Union[str, Path],
+    cache: Optional[DiskCache] = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    threads: Optional[int] = EMBEDDING_THREADS,
+) -> bool:
+    """
+    对封面编码并写出参考向量库。output_path 以 .npy 结尾时写二进制格式（向量块 + .meta.json），
+    以 .json 结尾时写旧版 JSON。二进制库条数 ≥ config.ANN_MIN_REFS 时同时构建 IVF 近似最近邻索引。
+    cache 为封面向量缓存（open_embedding_cache），已编码过的封面不再过模型；batch_size/threads 见 embed_images。
+    """
+    store = _embed_entries(cover_paths, labels, cache=cache, batch_size=batch_size, threads=threads)
+    if cover_paths and not store and get_image_embedding_model() is None:
+        return False
+    output_path = Path(output_path)
+    if output_path.suffix == ".npy":
+        dim = len(store[0]["embedding"]) if store else 0
+        matrix = np.array([r["embedding"] for r in store], dtype=np.float32).reshape(len(store), dim)
+        _write_binary_store(output_path, matrix, [{k: v for k, v in r.items() if k != "embedding"} for r in store])
+        _refresh_ann_index(output_path, len(store))
+        return True
+    output_path.parent.mkdir(parents=True, exist_ok=True)
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(store, f, ensure_ascii=False, indent=2)
     return True
 
 
+def _load_binary_store(path: Path, mmap: bool = True) -> Tuple["np.ndarray", dict]:
+    """只读 mmap 打开向量块（O(1)，多进程共享页缓存），返回 (matrix, meta)。"""
+    matrix = np.load(path, mmap_mode="r" if mmap else None)
+    with open(meta_path_for(path), encoding="utf-8") as f:
+        meta = json.load(f)
+    return matrix, meta
+
+
+def _store_model_matches(meta: dict) -> bool:
+    return meta.get("model") == EMBEDDING_MODEL_NAME and meta.get("format_version") == REF_STORE_FORMAT_VERSION
+
+
+def reference_store_sources(path: Union[str, Path]) -> Dict[str, dict]:
+    """
+    返回 .npy 参考库已处理过的样本截图 {内容哈希: {"name", "positives"}}。
+    库不存在、为旧版 JSON 或由其他 embedding 模型生成时返回空 dict（需全量重建）。
+    """
+    p = Path(path)
+    if p.suffix != ".npy" or not p.exists() or not meta_path_for(p).exists():
+        return {}
+    with open(meta_path_for(p), encoding="utf-8") as f:
+        meta = json.load(f)
+    if not _store_model_matches(meta):
+        return {}
+    return dict(meta.get("sources") or {})
+
+
+def update_reference_store(
+    cover_paths: List[Union[str, Path]],
+    labels: List[dict],
+    output_path: Union[str, Path],
+    drop_sources: Optional[set] = None,
+    sources: Optional[Dict[str, dict]] = None,
+    replace: bool = False,
+    cache: Optional[DiskCache] = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    threads: Optional[int] = EMBEDDING_THREADS,
+) -> bool:
+    """
+    增量更新 .npy 参考库：删除 label 中 source_sha256 属于 drop_sources 的旧条目，只对新封面编码并追加，
+    sources（本次新处理的截图）并入 meta["sources"]。已有条目的向量原样保留，不重新编码。
+    replace=True 或现有库由其他模型生成（或不存在）时等同于全量新建。
+    """
+    output_path = Path(output_path)
+    if output_path.suffix != ".npy":
+        return False
+    drop_sources = drop_sources or set()
+    old_matrix, old_entries, old_sources = None, [], {}
+    if not replace and output_path.exists() and meta_path_for(output_path).exists():
+        matrix, meta = _load_binary_store(output_path, mmap=False)
+        if _store_model_matches(meta):
+            old_matrix, old_entries = matrix, meta.get("entries", [])
+            old_sources = meta.get("sources") or {}
+    keep = [i for i, e in enumerate(old_entries) if e.get("source_sha256") not in drop_sources]
+    new_store: List[dict] = []
+    if cover_paths:
+        new_store = _embed_entries(
+            cover_paths, labels, start=len(keep), cache=cache, batch_size=batch_size, threads=threads,
+        )
+        if not new_store and get_image_embedding_model() is None:
+            return False
+    dim = int(old_matrix.shape[1]) if old_matrix is not None and old_matrix.ndim == 2 and len(old_matrix) else 0
+    if new_store and dim and len(new_store[0]["embedding"]) != dim:
+        # 维度不一致说明模型已变，旧条目作废
+        keep, dim, old_sources = [], 0, {}
+    dim = dim or (len(new_store[0]["embedding"]) if new_store else 0)
+    parts = []
+    if keep:
+        parts.append(np.asarray(old_matrix[keep], dtype=np.float32))
+    if new_store:
+        parts.append(np.array([r["embedding"] for r in new_store], dtype=np.float32))
+    matrix = np.concatenate(parts) if parts else np.zeros((0, dim), dtype=np.float32)
+    entries = [old_entries[i] for i in keep] + [{k: v for k, v in r.items() if k != "embedding"} for r in new_store]
+    merged_sources = {k: v for k, v in old_sources.items() if k not in drop_sources}
+    merged_sources.update(sources or {})
+    _write_binary_store(output_path, matrix, entries, sources=merged_sources)
+    _refresh_ann_index(output_path, len(entries))
+    return True
+
+
 def load_reference_store(path: Union[str, Path]) -> List[dict]:
+    """以 list[dict]（含 embedding 列表）返回参考库，兼容 .npy 与旧版 JSON；打分请用 load_reference_index。"""
     p = Path(path)
     if not p.exists():
         return []
+    if p.suffix == ".npy":
+        matrix, meta = _load_binary_store(p, mmap=False)
+        return [{**entry, "embedding": row.tolist()} for entry, row in zip(meta.get("entries", []), matrix)]
     with open(p, encoding="utf-8") as f:
         return json.load(f)
 
 
-def max_similarity_to_references(query_embedding: Optional[List[float]], reference_store: List[dict], label_filter: Optional[str] = None) -> float:
+# 相似度过滤器：type 仅比对 label_type 为「宝妈」的参考；tone 仅比对有 label_tone 的参考
+LABEL_FILTERS = ("type", "tone")
+
+
+def _ref_weight(ref: dict) -> float:
+    return 1.5 if ref.get("weight") == "high" else 1.0
+
+
+def _ref_matches(ref: dict, label_filter: Optional[str]) -> bool:
+    if label_filter == "type":
+        return ref.get("label_type") == "宝妈"
+    if label_filter == "tone":
+        return bool(ref.get("label_tone"))
+    return True
+
+
+class ReferenceIndex:
+    """
+    参考向量库的矩阵形式：预归一化的 float32 矩阵 (n, d) + 权重向量 + 各过滤器的布尔掩码。
+    一次矩阵乘即可得到一整格（或一批格子）对全部参考的加权最大相似度，语义与 max_similarity_to_references 一致。
+    带 IVF 索引（ann）时只在探测到的桶内计算，nprobe 控制召回/延迟。
+    """
+
+    def __init__(self, matrix: "np.ndarray", metadata: List[dict], normalized: bool = False, ann: Any = None):
+        self.ann = ann  # 可选 ann_index.IVFIndex
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if not normalized and len(matrix):
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        self.matrix = matrix
+        self.metadata = metadata
+        self.weights = np.array([_ref_weight(m) for m in metadata], dtype=np.float32)
+        self.masks: Dict[Optional[str], "np.ndarray"] = {None: np.ones(len(metadata), dtype=bool)}
+        for f in LABEL_FILTERS:
+            self.masks[f] = np.array([_ref_matches(m, f) for m in metadata], dtype=bool)
+
+    @classmethod
+    def from_store(cls, reference_store: List[dict]) -> "ReferenceIndex":
+        """由 load_reference_store 的 list[dict] 构建；缺 embedding 或维度不一致的条目跳过。"""
+        dim = next((len(r["embedding"]) for r in reference_store if r.get("embedding")), 0)
+        kept = [r for r in reference_store if r.get("embedding") and len(r["embedding"]) == dim]
+        matrix = np.array([r["embedding"] for r in kept], dtype=np.float32).reshape(len(kept), dim)
+        metadata = [{k: v for k, v in r.items() if k != "embedding"} for r in kept]
+        return cls(matrix, metadata)
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0
+
+    def _normalize_queries(self, queries: List[Optional[List[float]]]) -> "np.ndarray":
+        """None、空或维度不符的查询置为零向量（相似度为 0）。"""
+        q = np.zeros((len(queries), self.dim), dtype=np.float32)
+        for i, emb in enumerate(queries):
+            if emb is not None and len(emb) == self.dim:
+                q[i] = emb
+        norms = np.linalg.norm(q, axis=1, keepdims=True)
+        return np.divide(q, norms, out=np.zeros_like(q), where=norms > 0)
+
+    def max_similarities(
+        self,
+        queries: List[Optional[List[float]]],
+        label_filters: Tuple[Optional[str], ...] = LABEL_FILTERS,
+        nprobe: Optional[int] = None,
+    ) -> Dict[Optional[str], "np.ndarray"]:
+        """
+        对 m 个查询一次算出各过滤器下的加权最大相似度，返回 {filter: shape (m,) 数组}，下限为 0。
+        nprobe 为 IVF 探测桶数（None 取 config.ANN_NPROBE，0 或无索引时精确搜索）。
+        """
+        m = len(queries)
+        if m == 0 or len(self) == 0 or self.dim == 0:
+            return {f: np.zeros(m, dtype=np.float32) for f in label_filters}
+        q = self._normalize_queries(queries)
+        nprobe = ANN_NPROBE if nprobe is None else nprobe
+        if self.ann is not None and nprobe > 0:
+            cand = self.ann.candidates(q, nprobe)
+            matrix, weights = self.matrix[cand], self.weights[cand]
+            masks = {f: self.masks[f][cand] for f in label_filters}
+        else:
+            matrix, weights, masks = self.matrix, self.weights, self.masks
+        if len(weights) == 0:
+            return {f: np.zeros(m, dtype=np.float32) for f in label_filters}
+        scores = (q @ matrix.T) * weights
+        out: Dict[Optional[str], "np.ndarray"] = {}
+        for f in label_filters:
+            mask = masks[f]
+            if not mask.any():
+                out[f] = np.zeros(m, dtype=np.float32)
+                continue
+            best = scores.max(axis=1) if mask.all() else scores[:, mask].max(axis=1)
+            out[f] = np.maximum(best, 0.0)
+        return out
+
+    def max_similarity(self, query_embedding: Optional[List[float]], label_filter: Optional[str] = None) -> float:
+        return float(self.max_similarities([query_embedding], (label_filter,))[label_filter][0])
+
+
+_INDEX_CACHE: Dict[Tuple[str, int, int], ReferenceIndex] = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def load_reference_index(path: Union[str, Path]) -> Optional[ReferenceIndex]:
+    """
+    加载参考向量库为 ReferenceIndex，按 (路径, mtime, 大小) 在进程内缓存，同一文件只解析一次。
+    .npy 格式直接 mmap 只读映射向量块（不拷贝、不解析），并加载未过期的 IVF 索引；旧版 JSON 解析后转为矩阵。
+    文件不存在或未安装 numpy 时返回 None。
+    """
+    p = Path(path)
+    if not _NP_AVAILABLE or not p.exists():
+        return None
+    st = p.stat()
+    key = (str(p.resolve()), st.st_mtime_ns, st.st_size)
+    with _INDEX_LOCK:
+        index = _INDEX_CACHE.get(key)
+        if index is None:
+            if p.suffix == ".npy":
+                from ann_index import IVFIndex
+                matrix, meta = _load_binary_store(p)
+                ann = IVFIndex.load(ann_path_for(p), _store_signature(p))
+                index = ReferenceIndex(matrix, meta.get("entries", []), normalized=bool(meta.get("normalized")), ann=ann)
+            else:
+                index = ReferenceIndex.from_store(load_reference_store(p))
+            _INDEX_CACHE.clear()
+            _INDEX_CACHE[key] = index
+        return index
+
+
+def max_similarity_to_references(query_embedding: Optional[List[float]], reference_store: Union[List[dict], ReferenceIndex], label_filter: Optional[str] = None) -> float:
     if not query_embedding or not reference_store:
         return 0.0
+    if isinstance(reference_store, ReferenceIndex):
+        return reference_store.max_similarity(query_embedding, label_filter)
     best = 0.0
     for ref in reference_store:
         emb = ref.get("embedding")
-        if not emb:
-            continue
-        if label_filter == "type" and ref.get("label_type") != "宝妈":
-            continue
-        if label_filter == "tone" and not ref.get("label_tone"):
+        if not emb or not _ref_matches(ref, label_filter):
             continue
         sim = cosine_similarity(query_embedding, emb)
-        w = 1.5 if ref.get("weight") == "high" else 1.0
-        best = max(best, sim * w)
+        best = max(best, sim * _ref_weight(ref))
     return best
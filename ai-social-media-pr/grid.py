@@ -1,11 +1,12 @@
 """
 从整屏截图中按 4×6 网格切分出 24 个格子，每格拆成封面图与文案区。
-截图默认含顶部登录栏与左侧导航栏，由 config 的 CROP_* 排除。
+截图默认含顶部登录栏与左侧导航栏：优先自动检测网格位置（grid_detect.py，按版式缓存），检测失败时按 config 的 CROP_* 比例排除。
+切格只计算坐标：每格是共享整图解码缓冲区上的轻量视图（GridCell），封面/文案区像素在被访问时才裁出。
 """
 from __future__ import annotations
 
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import Iterator, List, Optional, Tuple, Union
 
 from PIL import Image
 
@@ -15,9 +16,13 @@ from config import (
     CROP_RIGHT,
     CROP_TOP,
     CELL_COVER_HEIGHT_RATIO,
+    GRID_AUTO_DETECT,
     GRID_COLS,
     GRID_ROWS,
 )
+from tracing import traced
+
+Box = Tuple[int, int, int, int]
 
 
 def open_image(source: Union[str, Path, Image.Image]) -> Image.Image:
@@ -28,52 +33,169 @@ def open_image(source: Union[str, Path, Image.Image]) -> Image.Image:
     return im
 
 
-def crop_content_region(img: Image.Image) -> Image.Image:
-    """按配置比例裁掉顶部栏与左侧栏，只保留 4×6 内容区."""
-    w, h = img.size
-    x0 = int(w * CROP_LEFT)
-    x1 = int(w * CROP_RIGHT)
-    y0 = int(h * CROP_TOP)
-    y1 = int(h * CROP_BOTTOM)
-    return img.crop((x0, y0, x1, y1))
+def load_screenshot(source: Union[str, Path, Image.Image]) -> Image.Image:
+    """解码一次截图并保留原始模式（不做整图 RGB 转换，只在裁出的格子上转换）。"""
+    if isinstance(source, Image.Image):
+        return source
+    im = Image.open(source)
+    im.load()
+    return im
 
 
-def slice_grid(
-    img: Image.Image,
+def content_box(size: Tuple[int, int]) -> Box:
+    """按配置比例算出去掉顶部栏与左侧栏后的 4×6 内容区 (x0, y0, x1, y1)."""
+    w, h = size
+    return (int(w * CROP_LEFT), int(h * CROP_TOP), int(w * CROP_RIGHT), int(h * CROP_BOTTOM))
+
+
+def detect_layout(img: Image.Image, cols: int = GRID_COLS):
+    """自动检测网格（按版式指纹缓存）；未安装 numpy 或检测失败时返回 None。"""
+    try:
+        from grid_detect import cached_grid_layout
+    except ImportError:
+        return None
+    return cached_grid_layout(img, cols=cols)
+
+
+def crop_content_region(img: Image.Image, auto_detect: bool = GRID_AUTO_DETECT) -> Image.Image:
+    """裁掉顶部栏与左侧栏，只保留笔记内容区：优先用检测到的网格外接框，否则按配置比例."""
+    layout = detect_layout(img) if auto_detect else None
+    return img.crop(layout.content_box if layout is not None else content_box(img.size))
+
+
+def grid_boxes(
+    region: Box,
     rows: int = GRID_ROWS,
     cols: int = GRID_COLS,
     cover_height_ratio: float = CELL_COVER_HEIGHT_RATIO,
-) -> List[Tuple[Image.Image, Image.Image]]:
+) -> List[Tuple[Box, Box]]:
     """
-    将已裁好内容区的图按 rows×cols 切格，每格再拆成封面图 + 文案区。
-    返回 list of (cover_pil, text_region_pil)，长度 rows*cols。
+    把内容区 region 均分为 rows×cols 格，返回每格 (封面框, 文案区框)，坐标相对整图。
     """
-    im = crop_content_region(img)
-    w, h = im.size
-    cell_w = w / cols
-    cell_h = h / rows
+    rx0, ry0, rx1, ry1 = region
+    cell_w = (rx1 - rx0) / cols
+    cell_h = (ry1 - ry0) / rows
     cover_h_per_cell = cell_h * cover_height_ratio
+    boxes: List[Tuple[Box, Box]] = []
     for row in range(rows):
         for col in range(cols):
-            x0 = int(col * cell_w)
-            x1 = int((col + 1) * cell_w)
+            x0 = rx0 + int(col * cell_w)
+            x1 = rx0 + int((col + 1) * cell_w)
             y_cell_top = int(row * cell_h)
-            y_cover_bottom = int(y_cell_top + cover_h_per_cell)
-            y_cell_bottom = int((row + 1) * cell_h)
-            cover = im.crop((x0, y_cell_top, x1, y_cover_bottom))
-            text_region = im.crop((x0, y_cover_bottom, x1, y_cell_bottom))
-            yield (cover, text_region)
+            y_cover_bottom = ry0 + int(y_cell_top + cover_h_per_cell)
+            y_cell_bottom = ry0 + int((row + 1) * cell_h)
+            boxes.append(((x0, ry0 + y_cell_top, x1, y_cover_bottom), (x0, y_cover_bottom, x1, y_cell_bottom)))
+    return boxes
+
+
+class GridCell:
+    """
+    单格视图：只持有整图引用与封面/文案区坐标。cover / text_region 每次访问时裁出新的 RGB 图，
+    cover_array / text_array 返回共享 NumPy 缓冲区上的切片（不拷贝）。
+    可像旧接口一样解包：cover, text_region = cell。
+    """
+
+    __slots__ = ("index", "source", "cover_box", "text_box", "_buffer")
+
+    def __init__(self, index: int, source: Image.Image, cover_box: Box, text_box: Box, buffer: Optional["SharedBuffer"] = None):
+        self.index = index
+        self.source = source
+        self.cover_box = cover_box
+        self.text_box = text_box
+        self._buffer = buffer
+
+    @staticmethod
+    def _crop(source: Image.Image, box: Box) -> Image.Image:
+        im = source.crop(box)
+        return im.convert("RGB") if im.mode != "RGB" else im
+
+    @property
+    def cover(self) -> Image.Image:
+        return self._crop(self.source, self.cover_box)
+
+    @property
+    def text_region(self) -> Image.Image:
+        return self._crop(self.source, self.text_box)
+
+    def _array(self, box: Box, gray: bool):
+        if self._buffer is None:
+            self._buffer = SharedBuffer(self.source)
+        arr = self._buffer.gray if gray else self._buffer.rgb
+        x0, y0, x1, y1 = box
+        return arr[y0:y1, x0:x1]
+
+    def cover_array(self, gray: bool = False):
+        """封面区域 (h, w, 3)（gray=True 时为 (h, w)）uint8 视图。"""
+        return self._array(self.cover_box, gray)
+
+    def text_array(self, gray: bool = True):
+        """文案区 (h, w)（gray=False 时为 (h, w, 3)）uint8 视图，供 OCR 预处理等向量化操作。"""
+        return self._array(self.text_box, gray)
+
+    def __iter__(self) -> Iterator[Image.Image]:
+        yield self.cover
+        yield self.text_region
+
+    def __repr__(self) -> str:
+        return f"GridCell(index={self.index}, cover={self.cover_box}, text={self.text_box})"
+
+
+class SharedBuffer:
+    """整图的 NumPy 缓冲区（RGB / 灰度各在首次使用时转换一次），同一张截图的所有 GridCell 共用。"""
+
+    def __init__(self, source: Image.Image):
+        self.source = source
+        self._rgb = None
+        self._gray = None
+
+    @property
+    def rgb(self):
+        if self._rgb is None:
+            import numpy as np
+            im = self.source if self.source.mode == "RGB" else self.source.convert("RGB")
+            self._rgb = np.asarray(im)
+        return self._rgb
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            import numpy as np
+            self._gray = np.asarray(self.source.convert("L"))
+        return self._gray
+
+
+def slice_grid(
+    img: Image.Image,
+    rows: int = GRID_ROWS,
+    cols: int = GRID_COLS,
+    cover_height_ratio: float = CELL_COVER_HEIGHT_RATIO,
+    auto_detect: bool = GRID_AUTO_DETECT,
+) -> List[GridCell]:
+    """
+    将整屏截图切成 rows×cols 格，每格拆成封面框 + 文案区框。auto_detect 时用检测到的封面位置
+    （需检测到至少 rows 行），否则按配置比例裁出内容区后均分。
+    返回 rows*cols 个 GridCell 视图（只算坐标，不裁像素）；旧写法 for cover, text in slice_grid(...) 仍可用。
+    """
+    buffer = SharedBuffer(img)
+    layout = detect_layout(img, cols=cols) if auto_detect else None
+    if layout is not None and len(layout.rows) >= rows:
+        boxes = layout.cell_boxes(max_rows=rows)
+    else:
+        boxes = grid_boxes(content_box(img.size), rows=rows, cols=cols, cover_height_ratio=cover_height_ratio)
+    return [GridCell(i, img, cover_box, text_box, buffer) for i, (cover_box, text_box) in enumerate(boxes)]
 
 
+@traced("slice_screenshot", "slice")
 def slice_screenshot(
     source: Union[str, Path, Image.Image],
     rows: int = GRID_ROWS,
     cols: int = GRID_COLS,
     cover_height_ratio: float = CELL_COVER_HEIGHT_RATIO,
-) -> List[Tuple[Image.Image, Image.Image]]:
+    auto_detect: bool = GRID_AUTO_DETECT,
+) -> List[GridCell]:
     """
-    从整屏截图切出 24 个 (封面图, 文案区图)。
-    source: 截图路径或 PIL Image。
+    从整屏截图切出 24 个格子视图（可解包为 (封面图, 文案区图)）。
+    source: 截图路径或 PIL Image；整图只解码一次，不做整图 RGB 转换。
     """
-    img = open_image(source)
-    return list(slice_grid(img, rows=rows, cols=cols, cover_height_ratio=cover_height_ratio))
+    img = load_screenshot(source)
+    return slice_grid(img, rows=rows, cols=cols, cover_height_ratio=cover_height_ratio, auto_detect=auto_detect)
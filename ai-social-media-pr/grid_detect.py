@@ -0,0 +1,229 @@
+"""
+自动检测截图中的笔记网格：按行/列「非背景像素占比」剖面找出封面块与间隔（gutter），
+得到每列的 x 范围和每行封面的 y 范围，不依赖 config 中针对 1920×1080 调好的 CROP_* 比例。
+检测结果按版式指纹（分辨率 + 顶部区域缩略剖面）在进程内缓存，同一版式只检测一次。
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import GRID_COLS, GRID_DETECT_CACHE_SIZE, GRID_DETECT_DOWNSCALE
+
+Box = Tuple[int, int, int, int]
+Span = Tuple[int, int]
+
+# 与背景灰度差超过该值视为「有内容」（留出 JPEG 噪声余量）
+_ACTIVE_DELTA = 16
+# 列宽/行高与中位数的相对偏差上限
+_SIZE_TOLERANCE = 0.12
+
+
+@dataclass(frozen=True)
+class GridLayout:
+    """检测到的网格：columns 为各列 (x0, x1)，rows 为各行封面 (y0, y1)，pitch 为行距；坐标均为原图像素。"""
+
+    width: int
+    height: int
+    columns: Tuple[Span, ...]
+    rows: Tuple[Span, ...]
+    pitch: int
+
+    @property
+    def content_box(self) -> Box:
+        """网格外接框（首列左缘、首行封面顶部到末列右缘、末行文案区底部）。"""
+        return (self.columns[0][0], self.rows[0][0], self.columns[-1][1], min(self.height, self.rows[-1][0] + self.pitch))
+
+    def cell_boxes(self, max_rows: Optional[int] = None) -> List[Tuple[Box, Box]]:
+        """按行优先返回每格 (封面框, 文案区框)；文案区从封面底部到下一行封面顶部（末行按行距外推并裁到图内）。"""
+        rows = self.rows if max_rows is None else self.rows[:max_rows]
+        boxes: List[Tuple[Box, Box]] = []
+        for r, (y0, y1) in enumerate(rows):
+            text_bottom = self.rows[r + 1][0] if r + 1 < len(self.rows) else min(self.height, y0 + self.pitch)
+            text_bottom = max(text_bottom, y1)
+            for x0, x1 in self.columns:
+                boxes.append(((x0, y0, x1, y1), (x0, y1, x1, text_bottom)))
+        return boxes
+
+
+def _runs(mask: np.ndarray) -> List[Span]:
+    """布尔序列中连续 True 段的 [start, end)。"""
+    m = np.concatenate([[0], mask.astype(np.int8), [0]])
+    d = np.diff(m)
+    return list(zip(np.flatnonzero(d == 1).tolist(), np.flatnonzero(d == -1).tolist()))
+
+
+def _close_gaps(runs: List[Span], max_gap: int) -> List[Span]:
+    """合并间隔不超过 max_gap 的相邻段（封面里偏暗的局部不会把封面切断）。"""
+    out: List[Span] = []
+    for a, b in runs:
+        if out and a - out[-1][1] <= max_gap:
+            out[-1] = (out[-1][0], b)
+        else:
+            out.append((a, b))
+    return out
+
+
+def _regular_columns(runs: List[Span], cols: int) -> Optional[List[Span]]:
+    """在候选段中找连续 cols 段、宽度相近且间距相近的一组（取最右侧满足条件的一组，左侧导航栏不会混入）。"""
+    for start in range(len(runs) - cols, -1, -1):
+        group = runs[start:start + cols]
+        widths = np.array([b - a for a, b in group], dtype=np.float32)
+        med = float(np.median(widths))
+        if med <= 0 or np.any(np.abs(widths - med) > _SIZE_TOLERANCE * med):
+            continue
+        if cols > 1:
+            gaps = np.diff([a for a, _ in group]).astype(np.float32)
+            gmed = float(np.median(gaps))
+            if np.any(np.abs(gaps - gmed) > _SIZE_TOLERANCE * gmed):
+                continue
+        return group
+    return None
+
+
+def _cover_rows(runs: List[Span], sh: int) -> List[Span]:
+    """
+    从行方向的封面段中挑出封面行：高度与典型封面高度相近（偏暗封面被切开的相邻段先合并），
+    再只保留行距一致的一串（排除顶部横幅等），中间漏检的行按行距补齐；贴底且被截断的末行保留。
+    """
+    if not runs:
+        return []
+    # 估计封面高度时不计贴底的段（可能被截断）
+    inner = [(a, b) for a, b in runs if b < sh - 1] or runs
+    max_h = max(b - a for a, b in inner)
+    full_h = float(np.median([b - a for a, b in inner if b - a >= 0.5 * max_h]))
+    lo, hi = (1 - _SIZE_TOLERANCE) * full_h, (1 + _SIZE_TOLERANCE) * full_h
+    merged: List[Span] = []
+    for a, b in runs:
+        prev = merged[-1] if merged else None
+        if prev and prev[1] - prev[0] < lo and b - a < lo and a - prev[1] <= 0.1 * full_h and lo <= b - prev[0] <= hi:
+            merged[-1] = (prev[0], b)
+        else:
+            merged.append((a, b))
+    full = [(a, b) for a, b in merged if lo <= b - a <= hi]
+    if not full:
+        return []
+    last = merged[-1]
+    truncated = last if last[1] >= sh - 1 and 0.2 * full_h <= last[1] - last[0] < lo and last[0] >= full[-1][1] else None
+    if len(full) < 2:
+        return full + ([truncated] if truncated else [])
+    # 行距取相邻封面行顶部间距的最小值：漏检行只会让间距变大，顶部横幅与首行的距离也大于行距
+    pitch = float(np.min(np.diff([a for a, _ in full])))
+    # 自下而上找行距一致的链（网格在页面下方，顶部的横幅/头像区不会与其对齐）
+    chain = [full[-1]]
+    for a, b in reversed(full[:-1]):
+        k = round((chain[0][0] - a) / pitch) if pitch > 0 else 0
+        if k >= 1 and abs((chain[0][0] - a) - k * pitch) <= _SIZE_TOLERANCE * pitch:
+            for j in range(k - 1, 0, -1):
+                top = int(round(a + j * pitch))
+                chain.insert(0, (top, int(round(top + full_h))))
+            chain.insert(0, (a, b))
+    if truncated and abs(truncated[0] - chain[-1][0] - pitch) <= _SIZE_TOLERANCE * pitch:
+        chain.append(truncated)
+    return chain
+
+
+def _active_mask(gray: np.ndarray) -> np.ndarray:
+    """背景取灰度直方图众数（页面底色占比最大），与之差异明显的像素为内容。"""
+    hist = np.bincount(gray.ravel(), minlength=256)
+    bg = int(np.argmax(hist))
+    return np.abs(gray.astype(np.int16) - bg) > _ACTIVE_DELTA
+
+
+def detect_grid_layout(img: Image.Image, cols: int = GRID_COLS, downscale: int = GRID_DETECT_DOWNSCALE) -> Optional[GridLayout]:
+    """
+    检测封面网格；找不到 cols 列规则排布或一行完整封面都没有时返回 None（调用方回退到固定比例）。
+    在 1/downscale 缩略灰度图上计算，耗时为毫秒级。
+    """
+    w, h = img.size
+    f = max(1, int(downscale))
+    small = img.convert("L").reduce(f) if f > 1 else img.convert("L")
+    act = _active_mask(np.asarray(small))
+    sh, sw = act.shape
+    if sh < 8 or sw < cols * 4:
+        return None
+
+    # 列：只看「较满」的行（封面行），间隔列在这些行上几乎全是背景
+    row_fill = act.mean(axis=1)
+    dense = row_fill > 0.3
+    if not dense.any():
+        return None
+    col_fill = act[dense].mean(axis=0)
+    # 阈值相对于封面列的典型填充率，偏暗的封面不会被当成间隔
+    col_mask = col_fill > 0.4 * float(np.percentile(col_fill, 90))
+    col_runs = _close_gaps(_runs(col_mask), max(1, sw // 100))
+    columns = _regular_columns([r for r in col_runs if r[1] - r[0] >= max(2, sw // (cols * 4))], cols)
+    if columns is None:
+        return None
+
+    # 行：每列内按行计算填充率，过半数列为封面、且列间隔仍为背景的行视为封面行（排除横跨多列的横幅）
+    votes = np.zeros(sh, dtype=np.int32)
+    for a, b in columns:
+        votes += act[:, a:b].mean(axis=1) > 0.5
+    gutter = np.zeros(sw, dtype=bool)
+    for (_, b), (a, _) in zip(columns[:-1], columns[1:]):
+        gutter[b:a] = True
+    cover_mask = votes * 2 >= len(columns)
+    if gutter.any():
+        cover_mask &= act[:, gutter].mean(axis=1) < 0.5
+    rows = _cover_rows(_close_gaps(_runs(cover_mask), 1), sh)
+    if not rows:
+        return None
+    full_h = float(np.median([b - a for a, b in rows]))
+    tops = [a for a, _ in rows]
+    pitch = float(np.median(np.diff(tops))) if len(tops) > 1 else full_h * 1.25
+
+    def up(span: Span, limit: int) -> Span:
+        return (min(limit, span[0] * f), min(limit, span[1] * f))
+
+    return GridLayout(
+        width=w,
+        height=h,
+        columns=tuple(up(c, w) for c in columns),
+        rows=tuple(up(r, h) for r in rows),
+        pitch=int(round(pitch * f)),
+    )
+
+
+def layout_fingerprint(img: Image.Image, header_ratio: float = 0.3) -> Tuple[int, int, bytes]:
+    """
+    版式指纹：(宽, 高, 顶部 header_ratio 区域的缩略行剖面)。剖面取 32 段的非背景占比并量化为 4 级，
+    头像/文字内容的小变化不改变指纹，简介行数变化导致网格上下平移时指纹随之改变。
+    """
+    w, h = img.size
+    top = img.crop((0, 0, w, max(1, int(h * header_ratio)))).convert("L")
+    thumb = np.asarray(top.resize((64, 32), Image.BILINEAR))
+    prof = _active_mask(thumb).mean(axis=1)
+    return (w, h, np.minimum(3, (prof * 4).astype(np.uint8)).tobytes())
+
+
+_CACHE: "OrderedDict[Tuple, Optional[GridLayout]]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0}
+
+
+def cached_grid_layout(img: Image.Image, cols: int = GRID_COLS) -> Optional[GridLayout]:
+    """按 layout_fingerprint 缓存的 detect_grid_layout（检测失败的结果也缓存，避免同版式反复检测）。"""
+    key = (layout_fingerprint(img), cols)
+    with _CACHE_LOCK:
+        if key in _CACHE:
+            _CACHE.move_to_end(key)
+            _STATS["hits"] += 1
+            return _CACHE[key]
+        _STATS["misses"] += 1
+    layout = detect_grid_layout(img, cols=cols)
+    with _CACHE_LOCK:
+        _CACHE[key] = layout
+        while len(_CACHE) > GRID_DETECT_CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    return layout
+
+
+def layout_cache_stats() -> dict:
+    with _CACHE_LOCK:
+        return {**_STATS, "layouts": len(_CACHE)}
@@ -0,0 +1,267 @@
+"""
+长截图（open_and_screenshot.py 的 full_page 整页截图，可远超 4 行）的流式切格：按行带（band）读取截图，
+在「上一行带剩余部分 + 新行带」组成的窗口里检测封面行，每凑齐一整行就产出该行 6 个 GridCell，不限 24 格。
+非隔行 8 bit PNG 按行带解压，不整图解码；其他格式整图解码一次后按行带裁切。已产出行之上的像素随即丢弃，
+内存只与行带高度有关。
+"""
+from __future__ import annotations
+
+import io
+import struct
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from config import GRID_COLS, GRID_STREAM_BAND_HEIGHT
+from grid import GridCell, SharedBuffer, load_screenshot, slice_grid
+
+Span = Tuple[int, int]
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG 颜色类型 -> 每像素通道数（只支持 8 bit 深度）
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def _read_png_chunks(fp) -> Iterator[Tuple[bytes, bytes]]:
+    while True:
+        head = fp.read(8)
+        if len(head) < 8:
+            return
+        length, tag = struct.unpack(">I4s", head)
+        data = fp.read(length)
+        fp.read(4)  # CRC（由 zlib 校验数据流完整性）
+        yield tag, data
+        if tag == b"IEND":
+            return
+
+
+def _iter_png_bands(path: Path, band_height: int) -> Optional[Iterator[Tuple[int, Image.Image]]]:
+    """
+    非隔行 8 bit PNG 的行带读取器；不支持的 PNG 返回 None（调用方整图解码）。
+    IDAT 数据流式解压，每凑够 band_height 行就把这些行（连同上一行带末行的像素作为滤波上下文，
+    以 None 滤波写在最前）重新打包成一张小 PNG 交给 Pillow 解码，去掉上下文行后产出 (y0, 行带图)。
+    """
+    fp = open(path, "rb")
+    if fp.read(8) != _PNG_SIGNATURE:
+        fp.close()
+        return None
+    chunks = _read_png_chunks(fp)
+    tag, ihdr = next(chunks, (b"", b""))
+    if tag != b"IHDR" or len(ihdr) != 13:
+        fp.close()
+        return None
+    width, height, depth, ctype, _, _, interlace = struct.unpack(">IIBBBBB", ihdr)
+    if depth != 8 or interlace or ctype not in _PNG_CHANNELS:
+        fp.close()
+        return None
+    stride = width * _PNG_CHANNELS[ctype] + 1
+
+    def gen() -> Iterator[Tuple[int, Image.Image]]:
+        extra = b""  # PLTE / tRNS 等原样写入每个行带
+        inflater = zlib.decompressobj()
+        pending = bytearray()
+        context: Optional[bytes] = None
+        y = 0
+
+        def emit(nrows: int) -> Tuple[int, Image.Image]:
+            nonlocal context, pending, y
+            raw = bytes(pending[:nrows * stride])
+            del pending[:nrows * stride]
+            if context is not None:
+                raw = b"\x00" + context + raw
+            ctx_rows = 1 if context is not None else 0
+            header = struct.pack(">IIBBBBB", width, nrows + ctx_rows, 8, ctype, 0, 0, 0)
+            data = _PNG_SIGNATURE + _png_chunk(b"IHDR", header) + extra + _png_chunk(b"IDAT", zlib.compress(raw, 0)) + _png_chunk(b"IEND", b"")
+            band = Image.open(io.BytesIO(data))
+            band.load()
+            if ctx_rows:
+                band = band.crop((0, 1, width, band.height))
+            # 下一行带的滤波上下文：本行带末行的原始（未滤波）像素
+            context = band.crop((0, band.height - 1, width, band.height)).tobytes()
+            y0, y = y, y + nrows
+            return y0, band
+
+        try:
+            for tag, data in chunks:
+                if tag in (b"PLTE", b"tRNS"):
+                    extra += _png_chunk(tag, data)
+                    continue
+                if tag != b"IDAT":
+                    continue
+                # 限制单次解压的输出长度：纯色区域压缩比极高，一个 IDAT 块可能解出上百 MB
+                buf = data
+                while buf:
+                    pending += inflater.decompress(buf, band_height * stride)
+                    buf = inflater.unconsumed_tail
+                    while len(pending) >= band_height * stride and y + band_height < height:
+                        yield emit(band_height)
+            pending += inflater.flush()
+            while y < height and len(pending) >= stride:
+                yield emit(min(height - y, band_height, len(pending) // stride))
+        finally:
+            fp.close()
+
+    return gen()
+
+
+def iter_bands(source: Union[str, Path, Image.Image], band_height: int = GRID_STREAM_BAND_HEIGHT) -> Iterator[Tuple[int, Image.Image]]:
+    """按行带产出 (y0, 行带图)；PNG 文件流式解码，PIL 图或其他格式整图解码后裁切。"""
+    band_height = max(1, int(band_height))
+    if not isinstance(source, Image.Image):
+        bands = _iter_png_bands(Path(source), band_height)
+        if bands is not None:
+            yield from bands
+            return
+    img = load_screenshot(source)
+    for y0 in range(0, img.height, band_height):
+        yield y0, img.crop((0, y0, img.width, min(img.height, y0 + band_height)))
+
+
+def _vstack(top: Optional[Image.Image], bottom: Image.Image) -> Image.Image:
+    if top is None or top.height == 0:
+        return bottom
+    out = Image.new(bottom.mode, (bottom.width, top.height + bottom.height))
+    out.paste(top, (0, 0))
+    out.paste(bottom, (0, top.height))
+    return out
+
+
+def _detect_rows(window: Image.Image, cols: int):
+    from grid_detect import detect_grid_layout
+    return detect_grid_layout(window, cols=cols)
+
+
+def _expected_rows(detected: List[Span], first_top: int, pitch: int, cover_h: int, height: int) -> List[Tuple[Span, bool]]:
+    """
+    从 first_top 起按行距排出窗口内的预期封面行；顶部与预期相差不超过 1/8 行距、高度与封面高度相近的检测结果
+    用于校准（消除累计误差），返回 [((y0, y1), 是否被检测证实)]。
+    """
+    tol = max(1, pitch // 8)
+    detected = [r for r in detected if abs((r[1] - r[0]) - cover_h) <= 0.12 * cover_h]
+    out: List[Tuple[Span, bool]] = []
+    top = first_top
+    while top < height:
+        match = min(detected, key=lambda r: abs(r[0] - top), default=None)
+        if match is not None and abs(match[0] - top) <= tol:
+            out.append((match, True))
+            top = match[0]
+        else:
+            out.append(((top, top + cover_h), False))
+        top += pitch
+    return out
+
+
+def iter_grid_cells(
+    source: Union[str, Path, Image.Image],
+    max_cells: Optional[int] = None,
+    cols: int = GRID_COLS,
+    band_height: int = GRID_STREAM_BAND_HEIGHT,
+) -> Iterator[GridCell]:
+    """
+    流式切格：按行产出 GridCell（index 从 0 连续编号），max_cells 为 None 或 <=0 时切到页面底部。
+    列位置、行距、封面高度取首个检测到至少三个完整行（不贴窗口底边）的窗口，小于 3 倍行距的窗口会误把导航栏等
+    细条当作网格、或把被截断的行当作整行；之后的窗口按行距预期下一行位置，
+    用该窗口的检测结果校准，夹在两个已证实行之间的漏检行按预期补齐，最后一个证实行之后的行等下一行带再定。
+    每行格子共享一张只含该行（封面 + 文案区）的小图，不持有整页像素；封面比 cover_h 矮出容差的检测行不产出。
+    读到页面底部或窗口达到 4 个行带（至少 4 个默认行带）仍检测不到网格时退回到固定比例 4×6 切格。
+    """
+    limit = max_cells if max_cells and max_cells > 0 else None
+    bands = iter_bands(source, band_height)
+    window: Optional[Image.Image] = None
+    win_y0 = 0
+    exhausted = False
+    columns: Optional[Tuple[Span, ...]] = None
+    pitch = cover_h = 0
+    next_top = 0  # 绝对坐标：下一行封面的预期顶部
+    index = 0
+    need_more = True
+
+    while True:
+        while not exhausted and (need_more or window is None or window.height < max(band_height, 3 * pitch)):
+            band = next(bands, None)
+            if band is None:
+                exhausted = True
+                break
+            window = _vstack(window, band[1])
+            need_more = False
+        if window is None or window.height == 0:
+            return
+
+        layout = _detect_rows(window, cols)
+        if columns is None:
+            complete = [row for row in layout.rows if row[1] < window.height - 2] if layout is not None else []
+            if layout is None or (len(complete) < 3 and not exhausted):
+                if exhausted or window.height >= 4 * max(band_height, GRID_STREAM_BAND_HEIGHT):
+                    for cell in slice_grid(window, cols=cols, auto_detect=False):
+                        if limit is not None and cell.index >= limit:
+                            return
+                        yield cell
+                    return
+                need_more = True
+                continue
+            columns, pitch = layout.columns, layout.pitch
+            sizes = complete or list(layout.rows)
+            cover_h = int(sorted(b - a for a, b in sizes)[len(sizes) // 2])
+            next_top = layout.rows[0][0]
+
+        # 贴窗口底边的检测段可能是被截断的封面连着上一行文案，不用于校准（页面已读完时除外）
+        detected = [r for r in layout.rows if exhausted or r[1] < window.height - 2] if layout is not None else []
+        rows = _expected_rows(detected, next_top - win_y0, pitch, cover_h, window.height)
+        if not any(ok for _, ok in rows) and next_top - win_y0 + 2 * pitch < window.height:
+            # 整窗检测只保留行距一致的一串，网格中途错位时错位之前的行会被丢掉：只在预期行附近再检测一次
+            head = _detect_rows(window.crop((0, 0, window.width, next_top - win_y0 + 2 * pitch)), cols)
+            if head is not None:
+                rows = _expected_rows(list(head.rows), next_top - win_y0, pitch, cover_h, window.height)
+        if not any(ok for _, ok in rows):
+            # 网格整体错位（如中间插入了分区标题）：从预期位置之后的第一个检测行重新对齐
+            later = [a for a, b in detected if win_y0 + a >= next_top and abs((b - a) - cover_h) <= 0.12 * cover_h]
+            if later:
+                rows = _expected_rows(detected, later[0], pitch, cover_h, window.height)
+        last_confirmed = max((i for i, (_, ok) in enumerate(rows) if ok), default=-1)
+
+        emitted = False
+        context_top = 0  # 窗口坐标：最后处理的一行的顶部
+        tol = max(1, pitch // 8)
+        for r, ((y0, y1), _) in enumerate(rows[:last_confirmed + 1]):
+            text_bottom = rows[r + 1][0][0] if r + 1 < len(rows) else y0 + pitch
+            if y1 - y0 < cover_h - tol and not (exhausted and y1 >= window.height - 2):
+                # 比封面矮得多的检测段不是整行封面（细条或被截断的行），不产出；跳过后从下一行继续
+                next_top, context_top = win_y0 + text_bottom, y0
+                emitted = True
+                continue
+            if text_bottom > window.height:
+                if not exhausted:
+                    break
+                # 页面底部：文案区（以及被截断的末行封面）裁到页面边缘
+                text_bottom, y1 = window.height, min(y1, window.height)
+            strip = window.crop((0, y0, window.width, text_bottom))
+            buffer = SharedBuffer(strip)
+            for x0, x1 in columns:
+                yield GridCell(index, strip, (x0, 0, x1, y1 - y0), (x0, y1 - y0, x1, text_bottom - y0), buffer)
+                index += 1
+                if limit is not None and index >= limit:
+                    return
+            next_top, context_top = win_y0 + text_bottom, y0
+            emitted = True
+
+        if exhausted:
+            return
+        if emitted:
+            # 丢掉已产出的行，但保留最后一行作为检测上下文（网格检测至少要两行，页面末尾只剩一行时也能证实）
+            cut = context_top
+            window = window.crop((0, cut, window.width, window.height))
+            win_y0 += cut
+        else:
+            need_more = True
+            if window.height > 4 * max(band_height, pitch):
+                # 长时间没有可证实的行（如页面中段的非网格内容）：只保留末尾一个行带，避免窗口无限增长
+                keep = max(band_height, 2 * pitch)
+                win_y0 += window.height - keep
+                window = window.crop((0, window.height - keep, window.width, window.height))
+                next_top = max(next_top, win_y0)
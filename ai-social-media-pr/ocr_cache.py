@@ -0,0 +1,57 @@
+"""
+OCR 结果缓存：文案区（或点赞小框）转灰度后按背景色取出文字掩码，对原分辨率的二值掩码取摘要，
+与 OCR 语言、引擎、字符白名单一起组成 DiskCache 的键。页面底色不同、背景上的轻微压缩噪声不改变掩码；
+不缩放、不做近似匹配，一个像素的差异也只会导致未命中，不会把相似标题或相近点赞数的 OCR 结果张冠李戴。
+需要 numpy；未安装时 open_ocr_cache 返回 None（不缓存，照常 OCR）。
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional, Union
+
+from PIL import Image
+
+from config import (
+    OCR_CACHE_FILENAME,
+    OCR_CACHE_MAX_BYTES,
+    OCR_CACHE_MAX_ENTRIES,
+    OCR_CACHE_VERSION,
+)
+from disk_cache import DiskCache, sha256_hex
+
+try:
+    import numpy as np
+    _NP_AVAILABLE = True
+except ImportError:
+    _NP_AVAILABLE = False
+
+# 与背景灰度差超过该值视为文字（高于 JPEG 噪声与抗锯齿边缘的幅度）
+_INK_DELTA = 64
+
+
+def open_ocr_cache(cache_dir: Union[str, Path]) -> Optional[DiskCache]:
+    """在 cache_dir 下打开（或创建）OCR 结果缓存，超出条数/字节上限时按最近访问时间淘汰；未安装 numpy 时返回 None。"""
+    if not _NP_AVAILABLE:
+        return None
+    return DiskCache(
+        Path(cache_dir) / OCR_CACHE_FILENAME,
+        max_entries=OCR_CACHE_MAX_ENTRIES,
+        max_bytes=OCR_CACHE_MAX_BYTES,
+    )
+
+
+def text_region_digest(image: Image.Image) -> str:
+    """
+    文案区文字掩码摘要：灰度图中与背景（直方图众数）差异超过 _INK_DELTA 的像素为文字，
+    对原分辨率的二值掩码（连同宽高）取 sha256。同尺寸的空白文案区得到同一个摘要。
+    """
+    gray = np.asarray(image.convert("L"))
+    if gray.size == 0:
+        return ""
+    bg = int(np.argmax(np.bincount(gray.ravel(), minlength=256)))
+    ink = np.abs(gray.astype(np.int16) - bg) > _INK_DELTA
+    return sha256_hex(f"{ink.shape[1]}x{ink.shape[0]}", np.packbits(ink).tobytes())
+
+
+def ocr_cache_key(image: Image.Image, lang: str, engine: str, whitelist: Optional[str] = None) -> str:
+    return sha256_hex("ocr", OCR_CACHE_VERSION, text_region_digest(image), lang, engine, whitelist or "")
@@ -0,0 +1,358 @@
+"""
+可插拔的 OCR 引擎层：tesseract（pytesseract 调用命令行，支持拼图单次 OCR）、tesserocr（进程内常驻的 Tesseract API 句柄）、
+rapidocr（RapidOCR：ONNX Runtime 中文检测 + 识别模型）。引擎按 (名称, 语言, 线程数, 字符白名单) 在进程内缓存，
+常驻后端的句柄/模型每个工作线程加载一次，之后的调用不再启动进程、不再重新加载语言模型。
+每个引擎记录逐格耗时（拼图模式按格均摊）与出错次数，供 judge 输出。
+引擎在并发任务间共享，累计出错次数不能说明某一次调用是否干净；recognize_counted 返回本次调用的出错次数，
+ocr_error_scope() 在当前上下文内累计这些次数（断点清单据此判断一个达人的 OCR 阶段是否完成）。
+"""
+from __future__ import annotations
+
+import importlib.util
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from config import OCR_BATCH_MAX_CELLS, OCR_ENGINE, OCR_MONTAGE_PSM, OCR_THREADS
+
+# auto 时按此顺序选第一个可用的引擎
+ENGINE_PREFERENCE = ("tesserocr", "tesseract", "rapidocr")
+_ENGINE_MODULES = {"tesseract": "pytesseract", "tesserocr": "tesserocr", "rapidocr": "rapidocr_onnxruntime"}
+_INSTALL_HINTS = {
+    "tesseract": "pip install pytesseract（并安装 Tesseract 与 chi_sim 语言包）",
+    "tesserocr": "pip install tesserocr（需系统 Tesseract 库与 chi_sim 语言包）",
+    "rapidocr": "pip install rapidocr_onnxruntime",
+}
+_LATENCY_WINDOW = 10000
+_ERROR_SCOPE: ContextVar[Optional[List[int]]] = ContextVar("ocr_error_scope", default=None)
+
+
+class OCREngineUnavailable(RuntimeError):
+    """显式指定的 OCR 引擎未安装。"""
+
+
+def available_ocr_engines() -> List[str]:
+    """已安装的引擎（只查找模块，不导入）。"""
+    return [name for name in ENGINE_PREFERENCE if importlib.util.find_spec(_ENGINE_MODULES[name]) is not None]
+
+
+def resolve_ocr_engine(name: str = OCR_ENGINE) -> str:
+    """auto -> 第一个已安装的引擎（都未安装时为 none）；显式指定但未安装时抛 OCREngineUnavailable。"""
+    if name == "auto":
+        found = available_ocr_engines()
+        return found[0] if found else "none"
+    if name == "none":
+        return name
+    if name not in _ENGINE_MODULES:
+        raise ValueError(f"未知 OCR 引擎: {name}（可选 auto / {' / '.join(ENGINE_PREFERENCE)}）")
+    if importlib.util.find_spec(_ENGINE_MODULES[name]) is None:
+        raise OCREngineUnavailable(f"OCR 引擎 {name} 未安装: {_INSTALL_HINTS[name]}")
+    return name
+
+
+def default_ocr_threads() -> int:
+    return max(1, min(4, os.cpu_count() or 1))
+
+
+class OCREngine:
+    """
+    引擎基类：recognize(images, batch) 返回与 images 等长的文本列表。
+    逐格识别在 threads 个工作线程上并行，每个线程持有自己的后端会话（_open_session，首次使用时创建并常驻）；
+    支持拼图的引擎（supports_montage）在 batch=True 时每 OCR_BATCH_MAX_CELLS 格只识别一次。
+    whitelist 不为空时只识别其中的字符（如点赞数的数字与「万」），按单行文本识别。
+    单格出错时该格返回空串，错误计入 stats()。
+    """
+
+    name = "base"
+    supports_montage = False
+
+    def __init__(self, lang: str = "chi_sim+eng", threads: Optional[int] = None, whitelist: Optional[str] = None):
+        self.lang = lang
+        self.whitelist = whitelist or None
+        self.threads = max(1, int(threads or default_ocr_threads()))
+        self._local = threading.local()
+        self._sessions: List[Any] = []
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._latencies_ms: deque = deque(maxlen=_LATENCY_WINDOW)
+        self._calls = 0
+        self._cells = 0
+        self._errors = 0
+        self._last_error: Optional[str] = None
+
+    # --- 后端实现 ---
+    def _open_session(self) -> Any:
+        return None
+
+    def _recognize_one(self, session: Any, image: Image.Image) -> str:
+        raise NotImplementedError
+
+    def _recognize_montage(self, images: Sequence[Image.Image]) -> List[str]:
+        raise NotImplementedError
+
+    # --- 公共部分 ---
+    def _session(self) -> Any:
+        if not getattr(self._local, "opened", False):
+            session = self._open_session()
+            self._local.session, self._local.opened = session, True
+            if session is not None:
+                with self._lock:
+                    self._sessions.append(session)
+        return self._local.session
+
+    def _record(self, cells: int, elapsed: float, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._calls += 1
+            self._cells += cells
+            per_cell = elapsed * 1000.0 / max(1, cells)
+            self._latencies_ms.extend([per_cell] * cells)
+            if error is not None:
+                self._errors += 1
+                self._last_error = f"{type(error).__name__}: {error}"
+
+    def _timed_one(self, image: Image.Image) -> Tuple[str, int]:
+        t0 = time.perf_counter()
+        try:
+            text = self._recognize_one(self._session(), image)
+        except Exception as e:
+            self._record(1, time.perf_counter() - t0, e)
+            return "", 1
+        self._record(1, time.perf_counter() - t0)
+        return (text or "").strip(), 0
+
+    def _timed_montage(self, images: Sequence[Image.Image]) -> Tuple[List[str], int]:
+        t0 = time.perf_counter()
+        try:
+            texts = self._recognize_montage(images)
+        except Exception as e:
+            # 拼图识别失败：记一次错误，该批退回逐格识别（可能已在工作线程中，逐格串行避免线程池自等待）
+            self._record(0, time.perf_counter() - t0, e)
+            singles = [self._timed_one(im) for im in images]
+            return [t for t, _ in singles], 1 + sum(n for _, n in singles)
+        self._record(len(images), time.perf_counter() - t0)
+        return texts, 0
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=f"ocr-{self.name}")
+            return self._pool
+
+    def _map_cells(self, images: Sequence[Image.Image]) -> List[Tuple[str, int]]:
+        if self.threads <= 1 or len(images) <= 1:
+            return [self._timed_one(im) for im in images]
+        return list(self._executor().map(self._timed_one, images))
+
+    def recognize_counted(self, images: Sequence[Image.Image], batch: bool = True) -> Tuple[List[str], int]:
+        """同 recognize，另返回本次调用的出错次数（不受其它并发调用影响），并计入当前的 ocr_error_scope()。"""
+        images = list(images)
+        if not images:
+            return [], 0
+        if not (batch and self.supports_montage):
+            singles = self._map_cells(images)
+            texts, errors = [t for t, _ in singles], sum(n for _, n in singles)
+        else:
+            step = max(1, OCR_BATCH_MAX_CELLS)
+            chunks = [images[s:s + step] for s in range(0, len(images), step)]
+            if self.threads <= 1 or len(chunks) <= 1:
+                parts = [self._timed_montage(c) for c in chunks]
+            else:
+                parts = list(self._executor().map(self._timed_montage, chunks))
+            texts, errors = [t for part, _ in parts for t in part], sum(n for _, n in parts)
+        scope = _ERROR_SCOPE.get()
+        if scope is not None:
+            scope[0] += errors
+        return texts, errors
+
+    def recognize(self, images: Sequence[Image.Image], batch: bool = True) -> List[str]:
+        return self.recognize_counted(images, batch=batch)[0]
+
+    @property
+    def errors(self) -> int:
+        """累计出错次数（进程内所有调用之和；判断某一次调用是否出错用 recognize_counted）。"""
+        with self._lock:
+            return self._errors
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self._latencies_ms)
+            n = len(lat)
+            return {
+                "engine": self.name,
+                "lang": self.lang,
+                "whitelist": self.whitelist,
+                "threads": self.threads,
+                "sessions": len(self._sessions),
+                "calls": self._calls,
+                "cells": self._cells,
+                "errors": self._errors,
+                "last_error": self._last_error,
+                "cell_ms_mean": round(sum(lat) / n, 2) if n else 0.0,
+                "cell_ms_p50": round(lat[n // 2], 2) if n else 0.0,
+                "cell_ms_p95": round(lat[min(n - 1, int(n * 0.95))], 2) if n else 0.0,
+                "cell_ms_max": round(lat[-1], 2) if n else 0.0,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+            sessions, self._sessions = self._sessions, []
+            self._local = threading.local()
+        if pool is not None:
+            pool.shutdown(wait=True)
+        for session in sessions:
+            end = getattr(session, "End", None)
+            if callable(end):
+                try:
+                    end()
+                except Exception:
+                    pass
+
+
+class NullOCREngine(OCREngine):
+    """没有可用引擎时的占位：每格返回空串（与未安装 pytesseract 时的旧行为一致）。"""
+
+    name = "none"
+
+    def _recognize_one(self, session: Any, image: Image.Image) -> str:
+        return ""
+
+
+class TesseractCLIEngine(OCREngine):
+    """pytesseract（每次调用启动一个 tesseract 进程）；batch=True 时多格拼成一张图只调用一次（TSV 输出按包围框映射回各格）。"""
+
+    name = "tesseract"
+    supports_montage = True
+
+    def __init__(self, lang: str = "chi_sim+eng", threads: Optional[int] = None, whitelist: Optional[str] = None):
+        super().__init__(lang, threads, whitelist)
+        import pytesseract
+        self._pytesseract = pytesseract
+
+    def _config(self, psm: int) -> str:
+        config = f"--psm {psm}"
+        if self.whitelist:
+            config += f" -c tessedit_char_whitelist={self.whitelist}"
+        return config
+
+    def _recognize_one(self, session: Any, image: Image.Image) -> str:
+        if self.whitelist:
+            # 白名单模式的输入是单行小框（点赞数）：psm 7 = 单行文本
+            return self._pytesseract.image_to_string(image.convert("L"), lang=self.lang, config=self._config(7))
+        return self._pytesseract.image_to_string(image.convert("L"), lang=self.lang)
+
+    def _recognize_montage(self, images: Sequence[Image.Image]) -> List[str]:
+        from ocr_utils import build_ocr_montage, tsv_texts
+        montage, spans = build_ocr_montage(images)
+        data = self._pytesseract.image_to_data(
+            montage, lang=self.lang, config=self._config(OCR_MONTAGE_PSM), output_type=self._pytesseract.Output.DICT,
+        )
+        return tsv_texts(data, spans)
+
+
+class TesserOCREngine(OCREngine):
+    """tesserocr：每个工作线程一个常驻 PyTessBaseAPI（语言模型只加载一次），逐格 SetImage + GetUTF8Text。"""
+
+    name = "tesserocr"
+
+    def _open_session(self) -> Any:
+        from tesserocr import PSM, PyTessBaseAPI
+        if not self.whitelist:
+            return PyTessBaseAPI(lang=self.lang)
+        api = PyTessBaseAPI(lang=self.lang, psm=PSM.SINGLE_LINE)
+        api.SetVariable("tessedit_char_whitelist", self.whitelist)
+        return api
+
+    def _recognize_one(self, session: Any, image: Image.Image) -> str:
+        session.SetImage(image.convert("L"))
+        return session.GetUTF8Text()
+
+
+class RapidOCREngine(OCREngine):
+    """
+    RapidOCR（ONNX Runtime 上的中文检测 + 识别模型，不使用 lang）：每个工作线程一个常驻实例（ORT 单线程推理），
+    每格的文本行按检测框自上而下拼接。模型本身不支持字符白名单，whitelist 模式下识别后再过滤字符。
+    """
+
+    name = "rapidocr"
+
+    def _open_session(self) -> Any:
+        from rapidocr_onnxruntime import RapidOCR
+        try:
+            return RapidOCR(intra_op_num_threads=1, inter_op_num_threads=1)
+        except TypeError:
+            return RapidOCR()
+
+    def _recognize_one(self, session: Any, image: Image.Image) -> str:
+        import numpy as np
+        result, _ = session(np.asarray(image.convert("RGB")))
+        if not result:
+            return ""
+        lines = sorted(result, key=lambda r: (min(p[1] for p in r[0]), min(p[0] for p in r[0])))
+        text = "\n".join(str(r[1]) for r in lines)
+        if self.whitelist:
+            allowed = set(self.whitelist) | {"\n"}
+            text = "".join(c for c in text if c in allowed)
+        return text
+
+
+_ENGINE_CLASSES = {
+    "none": NullOCREngine,
+    "tesseract": TesseractCLIEngine,
+    "tesserocr": TesserOCREngine,
+    "rapidocr": RapidOCREngine,
+}
+_ENGINES: Dict[Tuple[str, str, int, Optional[str]], OCREngine] = {}
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_ocr_engine(
+    name: str = OCR_ENGINE,
+    lang: str = "chi_sim+eng",
+    threads: Optional[int] = OCR_THREADS,
+    whitelist: Optional[str] = None,
+) -> OCREngine:
+    """返回进程内共享的引擎（按 解析后的名称 + 语言 + 线程数 + 字符白名单 缓存；白名单模式的会话单独常驻）。"""
+    resolved = resolve_ocr_engine(name)
+    n_threads = max(1, int(threads or default_ocr_threads()))
+    key = (resolved, lang, n_threads, whitelist or None)
+    with _ENGINE_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None:
+            engine = _ENGINE_CLASSES[resolved](lang=lang, threads=n_threads, whitelist=whitelist)
+            _ENGINES[key] = engine
+        return engine
+
+
+@contextmanager
+def ocr_error_scope() -> Iterator[List[int]]:
+    """with ocr_error_scope() as errors: ...；块内（当前线程/上下文）所有 OCR 调用的出错次数累计到 errors[0]。"""
+    scope = [0]
+    token = _ERROR_SCOPE.set(scope)
+    try:
+        yield scope
+    finally:
+        _ERROR_SCOPE.reset(token)
+
+
+def ocr_engine_stats() -> List[Dict[str, Any]]:
+    """所有已创建引擎的统计（逐格耗时均值/p50/p95/最大值、调用与出错次数）。"""
+    with _ENGINE_LOCK:
+        engines = list(_ENGINES.values())
+    return [e.stats() for e in engines]
+
+
+def reset_ocr_engines() -> None:
+    """关闭并清空引擎注册表（释放常驻句柄与线程池）。"""
+    with _ENGINE_LOCK:
+        engines = list(_ENGINES.values())
+        _ENGINES.clear()
+    for e in engines:
+        e.close()
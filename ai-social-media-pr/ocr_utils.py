@@ -1,47 +1,165 @@
 """
 对单张文案区图像做 OCR，提取标题、话题、点赞数等文本。
 当外部已提供笔记标题时，以传入的 title 为准，OCR 仅作补充。
+识别由 ocr_engines 中的可插拔引擎完成（tesseract / tesserocr / rapidocr，默认 config.OCR_ENGINE）。
+批量模式下 tesseract 引擎把多格文案区纵向拼成一张长图（build_ocr_montage），只调用一次 Tesseract（TSV 输出），
+再按每个词的包围框中心落在哪一格映射回各格（tsv_texts），省去逐格启动进程、重复加载 chi_sim 模型的开销。
+传入 cache（ocr_cache.open_ocr_cache）时按文案区文字掩码摘要 + 语言 + 引擎查缓存，只 OCR 未命中的格子。
 """
 from __future__ import annotations
 
-from typing import Optional
+import re
+from bisect import bisect_right
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
 
-from PIL import Image
+from PIL import Image, ImageOps
 
-try:
-    import pytesseract
-    PYTESSERACT_AVAILABLE = True
-except ImportError:
-    PYTESSERACT_AVAILABLE = False
+from config import OCR_ENGINE, OCR_MONTAGE_GAP, OCR_THREADS
+from tracing import annotate, traced
+
+if TYPE_CHECKING:
+    from disk_cache import DiskCache
+
+_LIKES_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(万|亿|w|W)?")
+_LIKES_UNITS = {"万": 10_000, "w": 10_000, "W": 10_000, "亿": 100_000_000}
+
+
+def _engine(engine: Optional[str], lang: str, threads: Optional[int], whitelist: Optional[str] = None):
+    from ocr_engines import get_ocr_engine
+    return get_ocr_engine(engine or OCR_ENGINE, lang=lang, threads=threads or OCR_THREADS, whitelist=whitelist)
+
+
+def _recognize(
+    images: Sequence[Image.Image],
+    lang: str,
+    engine: Optional[str],
+    threads: Optional[int],
+    batch: bool,
+    whitelist: Optional[str] = None,
+    cache: Optional["DiskCache"] = None,
+) -> List[str]:
+    """引擎识别；有 cache 时先按文字掩码摘要查缓存，未命中的格子一起识别后写回（本批出过错或没有可用引擎时不写回）。"""
+    recognizer = _engine(engine, lang, threads, whitelist)
+    images = list(images)
+    if cache is None or recognizer.name == "none":
+        return recognizer.recognize(images, batch=batch)
+    from ocr_cache import ocr_cache_key
+    keys = [ocr_cache_key(im, lang, recognizer.name, whitelist) for im in images]
+    texts: List[Optional[str]] = []
+    for key in keys:
+        hit = cache.get_json(key)
+        texts.append(hit.get("text") if isinstance(hit, dict) else None)
+    # 未命中的格子按键去重（如空白文案区、同一标题），每个键只识别一次
+    todo: Dict[str, List[int]] = {}
+    for i, t in enumerate(texts):
+        if t is None:
+            todo.setdefault(keys[i], []).append(i)
+    if todo:
+        fresh, errors = recognizer.recognize_counted([images[idx[0]] for idx in todo.values()], batch=batch)
+        clean = errors == 0
+        for (key, idx), text in zip(todo.items(), fresh):
+            for i in idx:
+                texts[i] = text
+            if clean:
+                cache.set_json(key, {"text": text})
+    return [t or "" for t in texts]
 
 
 def ocr_text_region(
     image: Image.Image,
     lang: str = "chi_sim+eng",
+    engine: Optional[str] = None,
+    cache: Optional["DiskCache"] = None,
 ) -> str:
     """
     对文案区图像做 OCR，返回整段文本。
-    若未安装 pytesseract 或 Tesseract，返回空字符串。
+    没有可用引擎时返回空字符串；识别出错时同样返回空串，错误计入 ocr_engines.ocr_engine_stats()。
     """
-    if not PYTESSERACT_AVAILABLE:
-        return ""
-    try:
-        img = image.convert("L")
-        text = pytesseract.image_to_string(img, lang=lang)
-        return (text or "").strip()
-    except Exception:
-        return ""
+    return _recognize([image], lang, engine, None, batch=False, cache=cache)[0]
 
 
-def extract_cell_text(
-    text_region_image: Image.Image,
+def _background(gray: Image.Image) -> int:
+    """灰度图的背景色：直方图众数。"""
+    hist = gray.histogram()
+    return max(range(256), key=hist.__getitem__)
+
+
+def build_ocr_montage(images: Sequence[Image.Image], gap: int = OCR_MONTAGE_GAP) -> Tuple[Image.Image, List[Tuple[int, int]]]:
+    """
+    把多格文案区（转灰度）纵向拼成一张图：每格上下各留 gap 像素、右侧补齐到最宽格，留白用该格自身的背景色，
+    拼接处不会出现伪边缘。返回 (拼图, 每格在拼图中的 [y0, y1) 范围（含留白）)。
+    """
+    tiles = []
+    for im in images:
+        gray = im.convert("L")
+        tiles.append(ImageOps.expand(gray, border=(0, gap, 0, gap), fill=_background(gray)))
+    width = max((t.width for t in tiles), default=1)
+    montage = Image.new("L", (width, max(1, sum(t.height for t in tiles))), 255)
+    spans: List[Tuple[int, int]] = []
+    y = 0
+    for t in tiles:
+        if t.width < width:
+            montage.paste(_background(t), (t.width, y, width, y + t.height))
+        montage.paste(t, (0, y))
+        spans.append((y, y + t.height))
+        y += t.height
+    return montage, spans
+
+
+def tsv_texts(data: Dict[str, list], spans: List[Tuple[int, int]]) -> List[str]:
+    """image_to_data 的词级结果按包围框中心的 y 归到各格；同一格内按 TSV 顺序拼词，换行（block/par/line 变化）处换行。"""
+    lines: List[List[List[str]]] = [[] for _ in spans]
+    last_key: List[Optional[Tuple[int, int, int]]] = [None] * len(spans)
+    tops = [a for a, _ in spans]
+    for i, word in enumerate(data.get("text", [])):
+        word = (word or "").strip()
+        if not word:
+            continue
+        cy = int(data["top"][i]) + int(data["height"][i]) // 2
+        lo = bisect_right(tops, cy) - 1
+        if lo < 0 or cy >= spans[lo][1]:
+            continue
+        key = (int(data["block_num"][i]), int(data["par_num"][i]), int(data["line_num"][i]))
+        if key != last_key[lo]:
+            lines[lo].append([])
+            last_key[lo] = key
+        lines[lo][-1].append(word)
+    return ["\n".join(" ".join(words) for words in cell) for cell in lines]
+
+
+def ocr_text_regions_batch(
+    images: Sequence[Image.Image],
     lang: str = "chi_sim+eng",
-) -> dict:
+    engine: Optional[str] = None,
+    threads: Optional[int] = None,
+    whitelist: Optional[str] = None,
+    cache: Optional["DiskCache"] = None,
+) -> List[str]:
+    """
+    批量 OCR：支持拼图的引擎（tesseract）每 OCR_BATCH_MAX_CELLS 格拼成一张图识别一次，其余引擎在工作线程池上逐格识别。
+    whitelist 限定可识别的字符（如点赞数的数字与「万」），使用单独的引擎实例。返回与 images 等长的文本列表。
     """
-    从单格文案区 OCR 结果中提取结构化字段。
+    return _recognize(images, lang, engine, threads, batch=True, whitelist=whitelist, cache=cache)
+
+
+def parse_like_count(text: str) -> Optional[int]:
+    """点赞数文本 -> 整数：「1320」-> 1320，「2.8万」/「2.8w」-> 28000，「1.2亿」-> 120000000；取最后一个数字。"""
+    matches = _LIKES_PATTERN.findall((text or "").replace(",", "").replace("，", ""))
+    if not matches:
+        return None
+    number, unit = matches[-1]
+    try:
+        value = float(number)
+    except ValueError:
+        return None
+    return int(round(value * _LIKES_UNITS.get(unit, 1)))
+
+
+def parse_cell_text(raw: str) -> dict:
+    """
+    从单格文案区 OCR 文本中提取结构化字段。
     返回 {"raw": str, "title": str, "has_zhiding": bool, "likes_approx": Optional[int]}
     """
-    raw = ocr_text_region(text_region_image, lang=lang)
     has_zhiding = "置顶" in raw
     title = raw
     likes_approx: Optional[int] = None
@@ -49,14 +167,44 @@ def extract_cell_text(
     for w in reversed(words):
         w_clean = "".join(c for c in w if c.isdigit())
         if w_clean and len(w_clean) <= 10:
-            try:
-                likes_approx = int(w_clean)
+            # 「2.8万」「3.5w」按单位换算
+            likes_approx = parse_like_count(w)
+            if likes_approx is not None:
                 break
-            except ValueError:
-                pass
     return {
         "raw": raw,
         "title": title,
         "has_zhiding": has_zhiding,
         "likes_approx": likes_approx,
     }
+
+
+@traced("extract_cell_text", "ocr")
+def extract_cell_text(
+    text_region_image: Image.Image,
+    lang: str = "chi_sim+eng",
+    engine: Optional[str] = None,
+    cache: Optional["DiskCache"] = None,
+) -> dict:
+    """
+    对单格文案区 OCR 并提取结构化字段（见 parse_cell_text）；传入 cache 时文案区未变化（文字掩码摘要相同）则不再 OCR。
+    """
+    return parse_cell_text(ocr_text_region(text_region_image, lang=lang, engine=engine, cache=cache))
+
+
+@traced("extract_cells_text", "ocr")
+def extract_cells_text(
+    text_region_images: Sequence[Image.Image],
+    lang: str = "chi_sim+eng",
+    batch: bool = True,
+    engine: Optional[str] = None,
+    threads: Optional[int] = None,
+    cache: Optional["DiskCache"] = None,
+) -> List[dict]:
+    """
+    多格文案区：batch=True 时走拼图/批量识别（ocr_text_regions_batch），否则逐格识别（仍在引擎线程池上并行）。
+    传入 cache 时只识别缓存未命中的格子（见 extract_cell_text）。
+    """
+    raws = _recognize(text_region_images, lang, engine, threads, batch=batch, cache=cache)
+    annotate(cells=len(raws))
+    return [parse_cell_text(raw) for raw in raws]
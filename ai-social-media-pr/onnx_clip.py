@@ -0,0 +1,107 @@
+"""
+CLIP 图像塔的 ONNX Runtime CPU 推理（可选 int8 动态量化），用于无 GPU 的机器上批量编码封面。
+预处理（短边缩放到 224 → 中心裁剪 → CLIP 均值/方差归一化）用 NumPy 批量完成，与 sentence-transformers 的 CLIP 输出同一向量空间。
+onnxruntime 只在加载模型时导入；导出（export_clip_image_onnx）需要 sentence-transformers + torch，只在离线导出时使用。
+"""
+from __future__ import annotations
+
+import importlib.util
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from config import EMBEDDING_BATCH_SIZE, EMBEDDING_ONNX_DIR
+
+CLIP_IMAGE_SIZE = 224
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+PROJECT_ROOT = Path(__file__).resolve().parent
+
+
+def onnxruntime_available() -> bool:
+    """是否安装了 onnxruntime（只查找模块，不导入）。"""
+    return importlib.util.find_spec("onnxruntime") is not None
+
+
+def default_onnx_path(model_name: str, quantized: bool = True) -> Path:
+    """导出文件默认位置：<项目>/models/<模型名>.image[-int8].onnx。"""
+    suffix = ".image-int8.onnx" if quantized else ".image.onnx"
+    return PROJECT_ROOT / EMBEDDING_ONNX_DIR / f"{model_name}{suffix}"
+
+
+def preprocess_clip(images: List[Image.Image], size: int = CLIP_IMAGE_SIZE) -> np.ndarray:
+    """PIL 列表 → (n, 3, size, size) float32：短边 bicubic 缩放到 size，中心裁剪，按 CLIP 均值/方差归一化。"""
+    batch = np.empty((len(images), size, size, 3), dtype=np.uint8)
+    for i, im in enumerate(images):
+        if im.mode != "RGB":
+            im = im.convert("RGB")
+        w, h = im.size
+        scale = size / min(w, h)
+        nw, nh = max(size, round(w * scale)), max(size, round(h * scale))
+        im = im.resize((nw, nh), Image.BICUBIC, reducing_gap=3.0)
+        left, top = (nw - size) // 2, (nh - size) // 2
+        batch[i] = np.asarray(im.crop((left, top, left + size, top + size)))
+    x = (batch.astype(np.float32) / 255.0 - CLIP_MEAN) / CLIP_STD
+    return np.ascontiguousarray(x.transpose(0, 3, 1, 2))
+
+
+class OnnxClipImageEncoder:
+    """与 SentenceTransformer.encode 同形的图像编码器：encode(images, batch_size) -> (n, d) ndarray。"""
+
+    def __init__(self, model_path: Union[str, Path], threads: Optional[int] = None):
+        import onnxruntime as ort
+        self.model_path = Path(model_path)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = int(threads)
+        self.session = ort.InferenceSession(str(self.model_path), sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.cache_tag = f"ort:{self.model_path.name}:{self.model_path.stat().st_size}"
+
+    def encode(self, images: List[Image.Image], batch_size: int = EMBEDDING_BATCH_SIZE, **_: object) -> np.ndarray:
+        if isinstance(images, Image.Image):
+            return self.encode([images], batch_size=batch_size)[0]
+        outs = []
+        for s in range(0, len(images), max(1, batch_size)):
+            x = preprocess_clip(images[s:s + batch_size])
+            outs.append(self.session.run(None, {self.input_name: x})[0].astype(np.float32))
+        return np.concatenate(outs) if outs else np.zeros((0, 0), dtype=np.float32)
+
+
+def export_clip_image_onnx(model_name: str, output_path: Optional[Union[str, Path]] = None, quantize: bool = True) -> Path:
+    """
+    把 sentence-transformers CLIP 模型的图像塔（含投影层）导出为 ONNX（batch 维动态），
+    quantize=True 时再做 int8 动态量化（权重 int8，激活运行时量化）。返回最终文件路径。
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_path = Path(output_path) if output_path else default_onnx_path(model_name, quantized=quantize)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    clip = SentenceTransformer(model_name, device="cpu")[0].model.eval()
+
+    class _ImageTower(torch.nn.Module):
+        def __init__(self, m):
+            super().__init__()
+            self.m = m
+
+        def forward(self, pixel_values):
+            return self.m.get_image_features(pixel_values=pixel_values)
+
+    fp32_path = output_path.with_name(output_path.stem.replace("-int8", "") + ".fp32.onnx") if quantize else output_path
+    dummy = torch.zeros(1, 3, CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE)
+    torch.onnx.export(
+        _ImageTower(clip), dummy, str(fp32_path),
+        input_names=["pixel_values"], output_names=["image_embeds"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+        opset_version=17,
+    )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(fp32_path), str(output_path), weight_type=QuantType.QInt8)
+        fp32_path.unlink(missing_ok=True)
+    return output_path
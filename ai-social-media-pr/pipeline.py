@@ -0,0 +1,240 @@
+"""
+内存流水线：切格/OCR -> Vision -> 封面向量 -> 打分，各阶段之间通过 JudgeContext 传递
+PIL 封面、编码后的上传负载、格子信息、Vision 结果与 embedding，不经过磁盘往返。
+落盘（covers/、cells.json、vision_results.json、result.json）是可选的最后一步。
+整页长截图可用 stage_stream_slice_vision：按行带流式切格，每凑满一个 Vision 批次就提交请求，OCR 与 Vision 重叠进行。
+"""
+from __future__ import annotations
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from PIL import Image
+
+from aggregate_score import aggregate_scores, load_criteria
+from config import GRID_CELLS, VISION_BATCH_SIZE, VISION_CONCURRENCY, VISION_DETAIL
+from disk_cache import DiskCache
+from scoring_aggregate import aggregate_by_scoring, load_scoring
+from slice_and_ocr import cell_summary, iter_slice_and_ocr, run_slice_and_ocr
+from tracing import bind, traced
+from vision_cell import run_vision_on_cells
+from vision_prompt import load_cover_payload
+
+
+@dataclass
+class JudgeContext:
+    """一次 judge 的全部中间状态；各 stage_* 函数就地填充。"""
+
+    screenshot: Union[str, Path, Image.Image]
+    profile_dir: Path
+    creator_name: Optional[str] = None
+    creator_desc: Optional[str] = None
+    note_titles: Optional[List[str]] = None
+    ref_store_path: Optional[Path] = None
+    covers: List[Image.Image] = field(default_factory=list)
+    cover_payloads: List[Optional[bytes]] = field(default_factory=list)
+    cells: List[Dict[str, Any]] = field(default_factory=list)
+    vision_results: List[Dict[str, Any]] = field(default_factory=list)
+    cell_embeddings: Optional[List[Optional[List[float]]]] = None
+    result: Dict[str, Any] = field(default_factory=dict)
+
+    def cover_label(self, idx: int) -> str:
+        """封面在输出目录中的相对路径（落盘时写到这里）。"""
+        return f"covers/cell_{idx:02d}.jpg"
+
+    def resolve_ref_store(self) -> Optional[Path]:
+        """未显式指定时使用 profile 目录下的参考向量库（ref_embeddings.npy，其次旧版 ref_embeddings.json）。"""
+        if self.ref_store_path is None:
+            from embedding_store import resolve_reference_store_path
+            self.ref_store_path = resolve_reference_store_path(self.profile_dir)
+        if self.ref_store_path is not None and not self.ref_store_path.exists():
+            return None
+        return self.ref_store_path
+
+
+@traced("stage_slice_ocr", "stage")
+def stage_slice_ocr(
+    ctx: JudgeContext,
+    ocr_lang: str = "chi_sim+eng",
+    ocr_engine: Optional[str] = None,
+    ocr_threads: Optional[int] = None,
+    ocr_cache: Optional[DiskCache] = None,
+    max_cells: Optional[int] = None,
+) -> None:
+    """
+    切格 + 文案区 OCR，封面保留在内存中。ocr_engine / ocr_threads 见 ocr_engines.get_ocr_engine，
+    ocr_cache 为 OCR 结果缓存（ocr_cache.open_ocr_cache）；max_cells 不为 None 时按整页长截图流式切格。
+    """
+    pairs = run_slice_and_ocr(
+        ctx.screenshot, ocr_lang=ocr_lang, note_titles=ctx.note_titles, ocr_engine=ocr_engine, ocr_threads=ocr_threads,
+        ocr_cache=ocr_cache, max_cells=max_cells,
+    )
+    ctx.covers = [cover for cover, _ in pairs]
+    ctx.cells = [cell_summary(idx, info, ctx.cover_label(idx)) for idx, (_, info) in enumerate(pairs)]
+
+
+@traced("stage_vision", "stage")
+def stage_vision(
+    ctx: JudgeContext,
+    api_client: str = "openai",
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    concurrency: int = VISION_CONCURRENCY,
+    cache: Optional[DiskCache] = None,
+    batch_size: int = VISION_BATCH_SIZE,
+    detail: str = VISION_DETAIL,
+) -> None:
+    """每格封面只编码一次上传负载（已由上游编码好时直接复用），直接交给 Vision，无需先写 covers/ 再读回。"""
+    if len(ctx.cover_payloads) != len(ctx.covers):
+        ctx.cover_payloads = [load_cover_payload(im, detail=detail) for im in ctx.covers]
+    ctx.vision_results = run_vision_on_cells(
+        ctx.cover_payloads, api_client=api_client, model=model, api_key=api_key,
+        concurrency=concurrency, cache=cache, batch_size=batch_size, detail=detail,
+        cover_labels=[ctx.cover_label(i) for i in range(len(ctx.covers))],
+    )
+
+
+@traced("stage_stream_slice_vision", "stage")
+def stage_stream_slice_vision(
+    ctx: JudgeContext,
+    max_cells: Optional[int] = None,
+    ocr_lang: str = "chi_sim+eng",
+    api_client: str = "openai",
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    concurrency: int = VISION_CONCURRENCY,
+    cache: Optional[DiskCache] = None,
+    batch_size: int = VISION_BATCH_SIZE,
+    detail: str = VISION_DETAIL,
+    ocr_engine: Optional[str] = None,
+    ocr_threads: Optional[int] = None,
+    ocr_cache: Optional[DiskCache] = None,
+) -> None:
+    """
+    整页长截图：按行带流式切格 + OCR（max_cells 为 None/0 时切到页面底部），每凑满 batch_size 格就把这一批封面
+    提交给 Vision（同时在途的批次数不超过 concurrency），等效于 stage_slice_ocr + stage_vision，但不必先切完整页。
+    """
+    step = max(1, batch_size)
+    futures = []
+    describe = bind(run_vision_on_cells)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="vision-stream") as pool:
+
+        def submit(start: int) -> None:
+            futures.append(pool.submit(
+                describe, ctx.cover_payloads[start:], api_client=api_client, model=model, api_key=api_key,
+                concurrency=1, cache=cache, batch_size=batch_size, detail=detail,
+                cover_labels=[ctx.cover_label(i) for i in range(start, len(ctx.cover_payloads))],
+            ))
+
+        submitted = 0
+        for idx, (cover, info) in enumerate(iter_slice_and_ocr(
+            ctx.screenshot, ocr_lang=ocr_lang, note_titles=ctx.note_titles, max_cells=max_cells,
+            ocr_engine=ocr_engine, ocr_threads=ocr_threads, ocr_cache=ocr_cache,
+        )):
+            ctx.covers.append(cover)
+            ctx.cells.append(cell_summary(idx, info, ctx.cover_label(idx)))
+            ctx.cover_payloads.append(load_cover_payload(cover, detail=detail))
+            if len(ctx.cover_payloads) - submitted >= step:
+                submit(submitted)
+                submitted = len(ctx.cover_payloads)
+        if submitted < len(ctx.cover_payloads):
+            submit(submitted)
+        ctx.vision_results = [r for fut in futures for r in fut.result()]
+
+
+@traced("stage_embed", "stage")
+def stage_embed(ctx: JudgeContext, cache: Optional[DiskCache] = None) -> None:
+    """有参考向量库时，对内存中的封面编码一次，打分阶段共用；cache 命中的封面不过模型（全部命中时不加载模型）。"""
+    if ctx.resolve_ref_store() is None:
+        return
+    try:
+        from embedding_store import embed_images
+        embs = embed_images(ctx.covers, cache=cache)
+        ctx.cell_embeddings = embs if any(e is not None for e in embs) else None
+    except Exception:
+        ctx.cell_embeddings = None
+
+
+@traced("stage_embed_many", "stage")
+def stage_embed_many(ctxs: List[JudgeContext], cache: Optional[DiskCache] = None) -> None:
+    """
+    批量模式：有参考向量库的多个达人的封面合并成一次 embed_images 调用（模型按 EMBEDDING_BATCH_SIZE 分批前向），
+    结果按顺序切回各自的 ctx.cell_embeddings；与逐个 stage_embed 等效。
+    """
+    todo = [ctx for ctx in ctxs if ctx.covers and ctx.resolve_ref_store() is not None]
+    if not todo:
+        return
+    try:
+        from embedding_store import embed_images
+        embs = embed_images([im for ctx in todo for im in ctx.covers], cache=cache)
+    except Exception:
+        embs = [None] * sum(len(ctx.covers) for ctx in todo)
+    start = 0
+    for ctx in todo:
+        part = embs[start:start + len(ctx.covers)]
+        start += len(ctx.covers)
+        ctx.cell_embeddings = part if any(e is not None for e in part) else None
+
+
+@traced("stage_score", "stage")
+def stage_score(ctx: JudgeContext, similarity_bonus_scale: float = 0.5, ann_nprobe: Optional[int] = None) -> Dict[str, Any]:
+    """
+    按 profile 打分：有 scoring.json 走规则打分，否则走类型/调性准则打分。ann_nprobe 见 ReferenceIndex.max_similarities。
+    格子数超过 24（整页长截图流式切格）时全部参与聚合。
+    """
+    ref_store_path = ctx.resolve_ref_store()
+    scoring = load_scoring(ctx.profile_dir)
+    max_cells = max(GRID_CELLS, len(ctx.cells))
+    if scoring:
+        result = aggregate_by_scoring(
+            ctx.cells, ctx.vision_results, scoring,
+            creator_name=ctx.creator_name, creator_desc=ctx.creator_desc,
+            max_cells=max_cells,
+        )
+        result["profile_mode"] = "scoring"
+        # scoring 模式也支持向量相似度加分
+        if ref_store_path and ctx.cell_embeddings:
+            try:
+                from embedding_store import load_reference_index
+                ref_index = load_reference_index(ref_store_path)
+                k = min(len(ctx.cell_embeddings), len(result.get("rule_breakdown", {})))
+                if ref_index is not None and k:
+                    sims = ref_index.max_similarities(ctx.cell_embeddings[:k], ("type",), nprobe=ann_nprobe)["type"]
+                    for sim in sims.tolist():
+                        # 相似度高时给总分加分
+                        if sim > 0.7:
+                            result["score_total"] = min(10, round(result.get("score_total", 0) + sim * 0.5, 1))
+            except Exception:
+                pass
+    else:
+        ct, co = load_criteria(ctx.profile_dir)
+        result = aggregate_scores(
+            ctx.cells, ctx.vision_results, ct, co,
+            creator_name=ctx.creator_name, creator_desc=ctx.creator_desc,
+            ref_store_path=str(ref_store_path) if ref_store_path else None,
+            cell_embeddings=ctx.cell_embeddings,
+            similarity_bonus_scale=similarity_bonus_scale,
+            ann_nprobe=ann_nprobe,
+            max_cells=max_cells,
+        )
+        result["profile_mode"] = "criteria"
+    ctx.result = result
+    return result
+
+
+@traced("persist_context", "io")
+def persist_context(ctx: JudgeContext, output_dir: Union[str, Path], save_covers: bool = True) -> None:
+    """可选落盘：covers/cell_XX.jpg、cells.json、vision_results.json、result.json。"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if save_covers and ctx.covers:
+        covers_dir = output_dir / "covers"
+        covers_dir.mkdir(parents=True, exist_ok=True)
+        for idx, cover in enumerate(ctx.covers):
+            cover.save(covers_dir / f"cell_{idx:02d}.jpg", "JPEG", quality=85)
+    for name, data in (("cells.json", ctx.cells), ("vision_results.json", ctx.vision_results), ("result.json", ctx.result)):
+        with open(output_dir / name, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,246 @@
+"""
+Vision 接口的限流与重试：按 (provider, model) 共享令牌桶与自适应并发上限（AIMD），
+遇到 429/5xx/超时等可重试错误时按指数退避 + 抖动重试，并优先遵循 Retry-After。
+自适应上限以 --vision-concurrency 为起点，可升到 max(起点, VISION_ADAPTIVE_MAX_CONCURRENCY)；
+调用方的线程池按 vision_pool_size() 开足线程，实际在途请求数由共享的上限控制。
+"""
+from __future__ import annotations
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+from config import (
+    VISION_ADAPTIVE_MAX_CONCURRENCY,
+    VISION_CONCURRENCY,
+    VISION_MAX_RETRIES,
+    VISION_RATE_LIMITS,
+    VISION_RETRY_BASE_DELAY,
+    VISION_RETRY_MAX_DELAY,
+)
+
+T = TypeVar("T")
+
+# 视为瞬时错误、可重试的 HTTP 状态码（529 为 Anthropic overloaded）
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+THROTTLE_STATUS = {429, 529}
+# SDK 未带状态码时按异常类名判断（连接/超时/配额类）
+_RETRYABLE_NAME_HINTS = ("Timeout", "Connection", "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "RateLimit", "Overloaded")
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充令牌数，capacity 为突发上限。acquire 阻塞直到拿到令牌。"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """取令牌，返回等待的秒数。"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        """被限流时清空令牌并推迟补充 seconds 秒，使所有共享者一起退让；同时被限流的多个请求不叠加推迟时间。"""
+        with self._lock:
+            # 先补充到当前时刻，否则下次 acquire 会把暂停前的空闲时间一并补回，抵消暂停
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class AdaptiveConcurrency:
+    """自适应在途上限（AIMD）：限流时减半，连续成功 limit 次后加一，范围 [minimum, maximum]。"""
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 16):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def on_success(self) -> None:
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_throttle(self) -> None:
+        with self._cond:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._successes = 0
+
+
+class ProviderLimiter:
+    """单个 (provider, model) 共享的令牌桶 + 自适应并发 + 统计。"""
+
+    def __init__(self, rate: float, initial_concurrency: int, max_concurrency: int):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, maximum=max_concurrency)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, float] = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0, "wait_seconds": 0.0}
+
+    def _bump(self, key: str, value: float = 1) -> None:
+        with self._lock:
+            self.stats[key] += value
+
+
+_LIMITERS: Dict[Tuple[str, str], ProviderLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(provider: str, model: str, initial_concurrency: Optional[int] = None) -> ProviderLimiter:
+    """
+    取进程内共享的限流器；速率取 config.VISION_RATE_LIMITS[provider]（每秒请求数）。
+    首次创建时自适应并发以 initial_concurrency（默认 config.VISION_CONCURRENCY）为起点；已存在时沿用其当前状态。
+    """
+    key = (provider, model)
+    with _LIMITERS_LOCK:
+        lim = _LIMITERS.get(key)
+        if lim is None:
+            rate = VISION_RATE_LIMITS.get(provider, VISION_RATE_LIMITS.get("default", 5.0))
+            initial = max(1, int(initial_concurrency or VISION_CONCURRENCY))
+            lim = ProviderLimiter(rate, initial, max(initial, VISION_ADAPTIVE_MAX_CONCURRENCY))
+            _LIMITERS[key] = lim
+        return lim
+
+
+def vision_pool_size(provider: str, model: str, concurrency: int) -> int:
+    """
+    按 concurrency（--vision-concurrency）初始化该 provider/model 的限流器，返回调用方线程池应开的线程数：
+    自适应上限能达到的最大值，使 AIMD 既能压低也能抬高实际在途请求数（由限流器的 slot 控制）。
+    """
+    return get_limiter(provider, model, initial_concurrency=concurrency).concurrency.maximum
+
+
+def rate_limit_stats() -> Dict[str, Dict[str, Any]]:
+    """各 (provider/model) 的请求、重试、限流次数及当前自适应并发上限。"""
+    with _LIMITERS_LOCK:
+        items = list(_LIMITERS.items())
+    out: Dict[str, Dict[str, Any]] = {}
+    for (provider, model), lim in items:
+        with lim._lock:
+            s: Dict[str, Any] = dict(lim.stats)
+        s["wait_seconds"] = round(s["wait_seconds"], 3)
+        s["concurrency_limit"] = lim.concurrency.limit
+        out[f"{provider}/{model}"] = s
+    return out
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for attr in ("status_code", "code", "status"):
+        v = getattr(exc, attr, None)
+        if isinstance(v, int):
+            return v
+        v = getattr(v, "value", None)  # grpc StatusCode 等枚举
+        if isinstance(v, int) and 100 <= v < 600:
+            return v
+    resp = getattr(exc, "response", None)
+    v = getattr(resp, "status_code", None)
+    return v if isinstance(v, int) else None
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """从异常附带的响应头解析 Retry-After（秒或 HTTP 日期）/ retry-after-ms。"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        ms = headers.get("retry-after-ms")
+        if ms:
+            return max(0.0, float(ms) / 1000.0)
+        ra = headers.get("retry-after")
+        if not ra:
+            return None
+        try:
+            return max(0.0, float(ra))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(ra).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def classify_error(exc: BaseException) -> Tuple[bool, bool]:
+    """返回 (是否可重试, 是否为限流)。"""
+    code = _status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS, code in THROTTLE_STATUS
+    name = type(exc).__name__
+    retryable = any(h in name for h in _RETRYABLE_NAME_HINTS)
+    throttled = "RateLimit" in name or "ResourceExhausted" in name or "429" in str(exc)
+    return retryable or throttled, throttled
+
+
+def call_with_retry(
+    fn: Callable[[], T],
+    provider: str,
+    model: str,
+    max_retries: int = VISION_MAX_RETRIES,
+    base_delay: float = VISION_RETRY_BASE_DELAY,
+    max_delay: float = VISION_RETRY_MAX_DELAY,
+) -> T:
+    """
+    在共享限流器下执行 fn；可重试错误按 full-jitter 指数退避重试（有 Retry-After 时以其为准），
+    不可重试错误或重试耗尽时抛出最后一次异常。
+    """
+    lim = get_limiter(provider, model)
+    attempt = 0
+    while True:
+        lim._bump("wait_seconds", lim.bucket.acquire())
+        lim._bump("requests")
+        try:
+            with lim.concurrency.slot():
+                result = fn()
+        except Exception as e:
+            retryable, throttled = classify_error(e)
+            if throttled:
+                lim._bump("throttled")
+                lim.concurrency.on_throttle()
+            if not retryable or attempt >= max_retries:
+                lim._bump("failures")
+                raise
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            delay = min(delay, max_delay)
+            if throttled:
+                lim.bucket.pause(delay)
+            attempt += 1
+            lim._bump("retries")
+            time.sleep(delay)
+            continue
+        lim.concurrency.on_success()
+        return result
@@ -10,6 +10,7 @@ from pathlib import Path
 from typing import Any, Dict, List, Optional, Union
 
 from config import GRID_CELLS
+from tracing import traced
 
 
 def load_scoring(profile_dir: Union[str, Path]) -> Dict[str, Any]:
@@ -50,16 +51,19 @@ def _is_real_baby_cell(v: Dict[str, Any]) -> bool:
     return real_home if real_home is not None else True
 
 
+@traced("aggregate_by_scoring", "aggregate")
 def aggregate_by_scoring(
     cells: List[Dict[str, Any]],
     vision_results: List[Dict[str, Any]],
     scoring: Dict[str, Any],
     creator_name: Optional[str] = None,
     creator_desc: Optional[str] = None,
+    max_cells: int = GRID_CELLS,
 ) -> Dict[str, Any]:
     """
     按 scoring.json 规则汇总得分，并应用婴幼儿年龄、杂乱调性两项细化。
     返回 score_total (1-10), perfect_match (>= threshold), rule_breakdown。
+    规则统计前 grid_scope 格（scoring.json，默认 24），不超过 max_cells（整页长截图流式切格时可大于 24）。
     """
     if not scoring:
         return {"error": "no scoring config", "score_total": 0, "perfect_match": False}
@@ -68,7 +72,7 @@ def aggregate_by_scoring(
     qualifies_threshold = sys_cfg.get("qualifies_threshold", 6)
     very_recommended_threshold = sys_cfg.get("very_recommended_threshold", 9)
     rules = sys_cfg.get("rules") or []
-    grid_scope = min(scoring.get("grid_scope", 24), GRID_CELLS)
+    grid_scope = min(scoring.get("grid_scope", 24), max_cells)
     n = min(len(cells), len(vision_results), grid_scope)
 
     # 置顶格：取 has_zhiding 的格子，按索引顺序前 3 个
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+对比参考库精确搜索与 IVF 近似搜索：每个 nprobe 下的 recall@1（近似最大相似度与精确值一致的比例）、
+平均绝对误差与单格子（24 个查询）延迟 p50/p95。可用真实 .npy 参考库或合成数据。
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from ann_index import IVFIndex, default_nlist
+from config import GRID_CELLS
+from embedding_store import ReferenceIndex, load_reference_store
+
+
+def _synthetic(n: int, dim: int, clusters: int, seed: int):
+    """聚簇分布的合成向量（近似真实封面 embedding 的成团结构）。"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    refs = centers[rng.integers(0, clusters, n)] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+    meta = [{"label_type": "宝妈" if i % 3 else "", "label_tone": "温馨" if i % 2 else "", "weight": "high" if i % 5 == 0 else "normal"} for i in range(n)]
+    return refs, meta, centers
+
+
+def _timeit(fn, repeats: int):
+    times = []
+    out = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        out = fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return out, float(np.percentile(times, 50)), float(np.percentile(times, 95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="参考库 ANN（IVF）召回/延迟基准")
+    parser.add_argument("--store", type=str, default=None, help="参考库 .npy/.json 路径；不传则用合成数据")
+    parser.add_argument("--synthetic", type=int, default=100_000, help="合成参考向量条数，默认 100000")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=20, help="查询批次数（每批 24 格）")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF 桶数，默认约 4·√n")
+    parser.add_argument("--nprobe", type=str, default="1,4,8,16,32,64", help="逗号分隔的 nprobe 列表")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed + 1)
+    if args.store:
+        store = load_reference_store(args.store)
+        if not store:
+            print(f"参考库为空或不存在: {args.store}")
+            sys.exit(1)
+        matrix = np.asarray([r["embedding"] for r in store], dtype=np.float32)
+        meta = [{k: v for k, v in r.items() if k != "embedding"} for r in store]
+        # 以库内向量加噪声作为查询
+        picks = matrix[rng.integers(0, len(matrix), args.queries * GRID_CELLS)]
+        queries = picks + 0.1 * rng.standard_normal(picks.shape).astype(np.float32)
+    else:
+        matrix, meta, centers = _synthetic(args.synthetic, args.dim, max(16, args.synthetic // 500), args.seed)
+        picks = centers[rng.integers(0, len(centers), args.queries * GRID_CELLS)]
+        queries = picks + 0.35 * rng.standard_normal(picks.shape).astype(np.float32)
+
+    exact = ReferenceIndex(matrix, meta)
+    t0 = time.perf_counter()
+    ann = IVFIndex.build(exact.matrix, nlist=args.nlist)
+    print(f"参考向量 {len(exact)} 条，dim={exact.dim}，nlist={ann.nlist}（默认 {default_nlist(len(exact))}），建索引 {time.perf_counter() - t0:.2f}s")
+    approx = ReferenceIndex(exact.matrix, meta, normalized=True, ann=ann)
+    batches = [queries[i:i + GRID_CELLS] for i in range(0, len(queries), GRID_CELLS)]
+
+    def run(index: ReferenceIndex, nprobe: int):
+        return [index.max_similarities(b, ("type", "tone"), nprobe=nprobe) for b in batches]
+
+    ref, p50, p95 = _timeit(lambda: run(exact, 0), 3)
+    print(f"{'exact':>8}  recall@1=1.000  mae=0.00000  p50={p50 / len(batches):.2f}ms  p95={p95 / len(batches):.2f}ms  每格子")
+    for nprobe in [int(x) for x in args.nprobe.split(",") if x.strip()]:
+        got, p50, p95 = _timeit(lambda: run(approx, nprobe), 3)
+        hits, errs = [], []
+        for r, g in zip(ref, got):
+            for f in ("type", "tone"):
+                hits.append(np.isclose(r[f], g[f], atol=1e-6))
+                errs.append(np.abs(r[f] - g[f]))
+        recall = float(np.mean(np.concatenate(hits)))
+        mae = float(np.mean(np.concatenate(errs)))
+        print(f"{'n=' + str(nprobe):>8}  recall@1={recall:.3f}  mae={mae:.5f}  p50={p50 / len(batches):.2f}ms  p95={p95 / len(batches):.2f}ms  每格子")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 """
 从 samples/nice 目录的截图自动生成参考向量库。
 对每张截图：切格 → Vision 识别正例格子（0-3岁婴幼儿、真实居家、非杂乱）→ 生成 embedding → 保存到 profile 目录。
+增量构建：按截图内容哈希跳过已处理过的样本，只追加新样本的正例，并删除已从样本目录移除的截图对应条目。
 """
 from __future__ import annotations
 
@@ -10,7 +11,7 @@ import json
 import os
 import sys
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = SCRIPT_DIR.parent
@@ -18,10 +19,19 @@ if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
 from build_ref_store import build_from_sliced_dir
-from embedding_store import build_reference_store, get_image_embedding_model
+from config import EMBEDDING_BATCH_SIZE, EMBEDDING_THREADS, VISION_BATCH_SIZE, VISION_CONCURRENCY, VISION_DETAIL, VISION_DETAIL_TIERS
+from disk_cache import DiskCache, sha256_hex
+from embedding_store import (
+    REF_STORE_FILENAME,
+    embedding_cache_stats,
+    open_embedding_cache,
+    reference_store_sources,
+    update_reference_store,
+)
 from slice_and_ocr import run_slice_and_ocr_to_dir
-from vision_cell import run_vision_on_sliced_dir
-from vision_prompt import describe_cover_with_vision
+from vision_cell import open_vision_cache, run_vision_on_sliced_dir
+from rate_limit import rate_limit_stats
+from vision_prompt import describe_cover_with_vision, vision_client_stats
 
 
 def _is_positive_cell(v: dict) -> bool:
@@ -46,9 +56,18 @@ def process_samples_to_ref_store(
     api_client: str = "openai",
     vision_model: Optional[str] = None,
     api_key: Optional[str] = None,
+    vision_concurrency: int = VISION_CONCURRENCY,
+    vision_batch_size: int = VISION_BATCH_SIZE,
+    vision_detail: str = VISION_DETAIL,
+    vision_cache: Optional[DiskCache] = None,
+    rebuild: bool = False,
+    embedding_cache: Optional[DiskCache] = None,
+    embedding_batch_size: int = EMBEDDING_BATCH_SIZE,
+    embedding_threads: Optional[int] = EMBEDDING_THREADS,
 ) -> bool:
     """
-    处理 samples_dir 下所有截图，提取正例格子，生成参考向量并保存到 profile_dir/ref_embeddings.json。
+    处理 samples_dir 下的截图，提取正例格子，生成参考向量并保存到 profile_dir/ref_embeddings.npy（+ ref_embeddings.meta.json）。
+    默认增量：内容哈希已记录在库中的截图跳过，新截图的正例追加，已删除截图的条目移除；rebuild=True 时全量重建。
     """
     samples_dir = Path(samples_dir)
     profile_dir = Path(profile_dir)
@@ -59,12 +78,24 @@ def process_samples_to_ref_store(
         print(f"未找到截图文件: {samples_dir}")
         return False
 
-    print(f"找到 {len(screenshot_files)} 张截图，开始处理...")
+    output_path = profile_dir / REF_STORE_FILENAME
+    known = {} if rebuild else reference_store_sources(output_path)
+    current: Dict[str, Path] = {}
+    for screenshot in sorted(screenshot_files):
+        current.setdefault(sha256_hex(screenshot.read_bytes()), screenshot)
+    pending = [(sha, p) for sha, p in current.items() if sha not in known]
+    removed = set(known) - set(current)
+    print(f"找到 {len(screenshot_files)} 张截图：新增 {len(pending)}，已处理跳过 {len(current) - len(pending)}，已删除 {len(removed)}")
+    if not pending and not removed and output_path.exists():
+        print(f"参考向量库已是最新: {output_path}")
+        return True
+
     all_positive_covers: List[Path] = []
     all_labels: List[dict] = []
+    processed: Dict[str, dict] = {}
 
-    for idx, screenshot in enumerate(screenshot_files):
-        print(f"\n[{idx+1}/{len(screenshot_files)}] 处理: {screenshot.name}")
+    for idx, (sha, screenshot) in enumerate(pending):
+        print(f"\n[{idx+1}/{len(pending)}] 处理: {screenshot.name}")
         temp_dir = PROJECT_ROOT / "temp_sliced" / screenshot.stem
         temp_dir.mkdir(parents=True, exist_ok=True)
         
@@ -73,7 +104,9 @@ def process_samples_to_ref_store(
             run_slice_and_ocr_to_dir(screenshot, temp_dir)
             # Vision 分析
             vision_results = run_vision_on_sliced_dir(
-                temp_dir, api_client=api_client, model=vision_model, api_key=api_key
+                temp_dir, api_client=api_client, model=vision_model, api_key=api_key,
+                concurrency=vision_concurrency, cache=vision_cache,
+                batch_size=vision_batch_size, detail=vision_detail,
             )
             # 找出正例格子
             positive_indices = [i for i, v in enumerate(vision_results) if _is_positive_cell(v)]
@@ -88,23 +121,37 @@ def process_samples_to_ref_store(
                         "label_tone": "真实生活感",
                         "weight": "high",
                         "source": screenshot.name,
+                        "source_sha256": sha,
                         "cell_index": i,
                     })
+            processed[sha] = {"name": screenshot.name, "positives": len(positive_indices)}
         except Exception as e:
             print(f"  处理失败: {e}")
             continue
 
-    if not all_positive_covers:
+    if not all_positive_covers and not removed and not known:
         print("未找到正例格子")
         return False
 
-    print(f"\n共提取 {len(all_positive_covers)} 个正例封面，生成参考向量...")
-    output_path = profile_dir / "ref_embeddings.json"
-    success = build_reference_store(all_positive_covers, all_labels, output_path)
-    
+    if pending:
+        print(f"Vision 客户端复用: {vision_client_stats()}")
+        print(f"Vision 限流/重试: {rate_limit_stats()}")
+        if vision_cache is not None:
+            print(f"Vision 缓存: {vision_cache.stats()}")
+    print(f"\n新增 {len(all_positive_covers)} 个正例封面，更新参考向量...")
+    success = update_reference_store(
+        all_positive_covers, all_labels, output_path,
+        # 库中没有来源记录（新建、旧版库或模型已变）时整体替换，避免与无哈希的旧条目重复
+        drop_sources=removed, sources=processed, replace=rebuild or not known,
+        cache=embedding_cache,
+        batch_size=embedding_batch_size,
+        threads=embedding_threads,
+    )
+    print(f"向量缓存: {embedding_cache_stats(embedding_cache)}")
+
     if success:
         print(f"参考向量已保存: {output_path}")
-        print(f"  正例数量: {len(all_positive_covers)}")
+        print(f"  新增正例: {len(all_positive_covers)}，移除样本: {len(removed)}")
         return True
     else:
         print("生成失败（可能未安装 sentence-transformers）")
@@ -117,6 +164,16 @@ def main():
     parser.add_argument("-p", "--profile", type=str, default="douyin_mom_finder", help="profile 名")
     parser.add_argument("--api", type=str, default="openai", choices=["openai", "gemini", "anthropic"])
     parser.add_argument("--model", type=str, default=None)
+    parser.add_argument("--vision-concurrency", type=int, default=VISION_CONCURRENCY, help=f"Vision 同时在途请求数的起点（之后按限流自适应调整），1 为串行；默认 {VISION_CONCURRENCY}")
+    parser.add_argument("--vision-batch-size", type=int, default=VISION_BATCH_SIZE, help=f"每次 Vision 请求发送的封面数，1 为逐格请求；默认 {VISION_BATCH_SIZE}")
+    parser.add_argument("--vision-detail", type=str, default=VISION_DETAIL, choices=list(VISION_DETAIL_TIERS), help=f"封面上传档位（缩放/重编码/OpenAI detail），默认 {VISION_DETAIL}")
+    parser.add_argument("--vision-cache", type=str, default=str(PROJECT_ROOT / ".cache"), help="Vision 结果缓存目录（SQLite），默认 <项目>/.cache")
+    parser.add_argument("--no-vision-cache", action="store_true", help="不读写 Vision 结果缓存")
+    parser.add_argument("--embedding-cache", type=str, default=str(PROJECT_ROOT / ".cache"), help="封面向量缓存目录（SQLite），默认 <项目>/.cache")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="不读写封面向量磁盘缓存")
+    parser.add_argument("--embedding-batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help=f"封面编码批大小，默认 {EMBEDDING_BATCH_SIZE}")
+    parser.add_argument("--embedding-threads", type=int, default=EMBEDDING_THREADS, help="封面编码 CPU 线程数，默认由后端决定")
+    parser.add_argument("--rebuild", action="store_true", help="忽略已有参考库，全量重新处理所有样本截图")
     args = parser.parse_args()
 
     samples_dir = Path(args.samples) if args.samples else PROJECT_ROOT / "samples" / "nice"
@@ -127,9 +184,18 @@ def main():
         sys.exit(1)
 
     api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("GEMINI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")
+    vision_cache = None if args.no_vision_cache else open_vision_cache(args.vision_cache)
     success = process_samples_to_ref_store(
         samples_dir, profile_dir,
-        api_client=args.api, vision_model=args.model, api_key=api_key
+        api_client=args.api, vision_model=args.model, api_key=api_key,
+        vision_concurrency=args.vision_concurrency,
+        vision_batch_size=args.vision_batch_size,
+        vision_detail=args.vision_detail,
+        vision_cache=vision_cache,
+        rebuild=args.rebuild,
+        embedding_cache=None if args.no_embedding_cache else open_embedding_cache(args.embedding_cache),
+        embedding_batch_size=args.embedding_batch_size,
+        embedding_threads=args.embedding_threads,
     )
     sys.exit(0 if success else 1)
 
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+把 CLIP 图像塔导出为 ONNX（默认 int8 动态量化）到 <项目>/models/，之后 embedding 后端为 auto/onnx 时自动使用。
+--bench N 用 N 张封面（--images 目录或合成图）对比 sentence-transformers 与 ONNX 的耗时及向量余弦一致性。
+需要 sentence-transformers、torch、onnx、onnxruntime。
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from config import EMBEDDING_BATCH_SIZE, EMBEDDING_MODEL_NAME
+from onnx_clip import OnnxClipImageEncoder, default_onnx_path, export_clip_image_onnx
+
+
+def _bench(onnx_path: Path, model_name: str, n: int, images_dir: str, batch_size: int, threads: int) -> None:
+    import numpy as np
+    from PIL import Image
+    from sentence_transformers import SentenceTransformer
+
+    if images_dir:
+        paths = sorted(p for p in Path(images_dir).rglob("*") if p.suffix.lower() in (".jpg", ".jpeg", ".png"))[:n]
+        images = [Image.open(p).convert("RGB") for p in paths]
+    else:
+        rng = np.random.default_rng(0)
+        images = [Image.fromarray(rng.integers(0, 255, (400, 300, 3), dtype=np.uint8)) for _ in range(n)]
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    st = SentenceTransformer(model_name)
+    ort = OnnxClipImageEncoder(onnx_path, threads=threads)
+    st.encode(images[:2]); ort.encode(images[:2])  # 预热
+    t0 = time.perf_counter()
+    a = np.asarray(st.encode(images, batch_size=batch_size), dtype=np.float32)
+    t_st = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    b = ort.encode(images, batch_size=batch_size)
+    t_ort = time.perf_counter() - t0
+    cos = (a * b).sum(1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) + 1e-12)
+    print(f"{len(images)} 张：sentence-transformers {t_st:.2f}s，ONNX {t_ort:.2f}s（{t_st / max(t_ort, 1e-9):.1f}x）")
+    print(f"余弦一致性：mean={cos.mean():.4f} min={cos.min():.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 CLIP 图像塔为 ONNX（int8）")
+    parser.add_argument("--model", type=str, default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("-o", "--output", type=str, default=None, help="输出路径，默认 models/<模型名>.image-int8.onnx")
+    parser.add_argument("--no-quantize", action="store_true", help="只导出 fp32，不做 int8 量化")
+    parser.add_argument("--bench", type=int, default=0, help="导出后用 N 张图对比两种后端")
+    parser.add_argument("--images", type=str, default=None, help="基准用的封面目录，默认合成图")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    out = Path(args.output) if args.output else default_onnx_path(args.model, quantized=not args.no_quantize)
+    path = export_clip_image_onnx(args.model, out, quantize=not args.no_quantize)
+    print(f"已导出: {path}（{path.stat().st_size / 1e6:.1f} MB）")
+    if args.no_quantize and args.output is None:
+        print("注意：auto/onnx 后端默认读取 int8 文件，fp32 导出仅供对比")
+    if args.bench:
+        _bench(path, args.model, args.bench, args.images, args.batch_size, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 """
-对整屏截图做 4×6 切格、Vision 分析、聚合，输出类型分与调性分。
+对整屏截图做 4×6 切格、Vision 分析、聚合，输出类型分与调性分（--max-cells 时按行带流式切整页长截图，可多于 24 格）。
 达人名称、简介、笔记标题由参数传入（视为已由外部脚本提供）。
+--batch <目录|清单> 在一个进程内批量筛查（batch_judge.py：切格/OCR 进程池、Vision 线程、合并 CLIP 编码三阶段重叠）。
+有输出目录时按其中的断点清单（checkpoint.py）续跑，--no-resume 从头跑。
+结果中的 timings 为各阶段耗时 p50/p95 与 Vision token/费用（tracing.py），--trace 另导出 span 时间线。
 """
 from __future__ import annotations
 
@@ -10,22 +13,37 @@ import json
 import os
 import sys
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = SCRIPT_DIR.parent
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from aggregate_score import aggregate_scores, load_criteria
-from scoring_aggregate import aggregate_by_scoring, load_scoring
-from slice_and_ocr import run_slice_and_ocr_to_dir
-from vision_cell import run_vision_on_sliced_dir
+from checkpoint import (
+    Checkpoint,
+    covers_needed,
+    open_checkpoint,
+    record_score,
+    restore_covers,
+    resume_embed,
+    resume_slice_ocr,
+    resume_vision,
+    stage_keys,
+)
+from config import ANN_NPROBE, BATCH_VISION_WORKERS, OCR_ENGINE, VISION_BATCH_SIZE, VISION_CONCURRENCY, VISION_DETAIL, VISION_DETAIL_TIERS
+from disk_cache import DiskCache
+from ocr_engines import ENGINE_PREFERENCE, OCREngineUnavailable, ocr_engine_stats, ocr_error_scope, resolve_ocr_engine
+from pipeline import JudgeContext, persist_context, stage_embed, stage_score, stage_slice_ocr, stage_stream_slice_vision, stage_vision
+from rate_limit import rate_limit_stats
+from tracing import Tracer, activate
+from vision_cell import open_vision_cache
+from vision_prompt import vision_client_stats
 
 
 def run_full_judge(
     screenshot_path: Path,
-    output_dir: Path,
+    output_dir: Optional[Path],
     profile_dir: Path,
     creator_name: Optional[str] = None,
     creator_desc: Optional[str] = None,
@@ -35,96 +53,185 @@ def run_full_judge(
     ref_store_path: Optional[Path] = None,
     similarity_bonus_scale: float = 0.5,
     ocr_lang: str = "chi_sim+eng",
+    vision_concurrency: int = VISION_CONCURRENCY,
+    vision_batch_size: int = VISION_BATCH_SIZE,
+    vision_detail: str = VISION_DETAIL,
+    vision_cache: Optional[DiskCache] = None,
+    save_covers: bool = True,
+    ann_nprobe: Optional[int] = None,
+    embedding_cache: Optional[DiskCache] = None,
+    max_cells: Optional[int] = None,
+    ocr_engine: Optional[str] = None,
+    ocr_threads: Optional[int] = None,
+    ocr_cache: Optional[DiskCache] = None,
+    resume: bool = True,
+    tracer: Optional[Tracer] = None,
 ) -> dict:
-    output_dir.mkdir(parents=True, exist_ok=True)
-    run_slice_and_ocr_to_dir(
-        screenshot_path, output_dir,
-        ocr_lang=ocr_lang,
+    """
+    内存流水线跑完一次 judge（各阶段通过 JudgeContext 传递，无中间文件读回）。
+    output_dir 为 None 时不落盘；否则写 cells.json / vision_results.json / result.json，save_covers 控制是否写封面。
+    max_cells 不为 None 时按整页长截图流式切格（最多 max_cells 格，0 为切到页面底部），边切边提交 Vision。
+    ocr_engine / ocr_threads 为 OCR 引擎与工作线程数（None 用 config 默认值），ocr_cache 为 OCR 结果缓存。
+    有 output_dir 时按 output_dir/checkpoint/ 断点续跑：截图与配置未变的阶段直接复用，只重跑未完成的部分；
+    resume=False 时忽略已有清单从头跑（清单随之重写）。
+    tracer 记录各阶段耗时与 Vision token 用量（tracing.py），汇总写入结果的 timings；None 时新建一个。
+    """
+    ctx = JudgeContext(
+        screenshot=screenshot_path,
+        profile_dir=profile_dir,
+        creator_name=creator_name,
+        creator_desc=creator_desc,
         note_titles=note_titles,
+        ref_store_path=ref_store_path,
     )
-    api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("GEMINI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")
-    vision_results = run_vision_on_sliced_dir(output_dir, api_client=api_client, model=vision_model, api_key=api_key)
-    with open(output_dir / "vision_results.json", "w", encoding="utf-8") as f:
-        json.dump(vision_results, f, ensure_ascii=False, indent=2)
+    tracer = tracer if tracer is not None else Tracer(ctx.creator_name or screenshot_path.stem)
+    with activate(tracer):
+        api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("GEMINI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")
+        checkpoint = None
+        if output_dir is not None:
+            checkpoint = _resume_stages(
+                ctx, output_dir, fresh=not resume, ocr_lang=ocr_lang, ocr_engine=ocr_engine, ocr_threads=ocr_threads,
+                ocr_cache=ocr_cache, max_cells=max_cells, api_client=api_client, vision_model=vision_model, api_key=api_key,
+                vision_concurrency=vision_concurrency, vision_batch_size=vision_batch_size, vision_detail=vision_detail,
+                vision_cache=vision_cache, embedding_cache=embedding_cache, similarity_bonus_scale=similarity_bonus_scale,
+                ann_nprobe=ann_nprobe, save_covers=save_covers,
+            )
+        else:
+            if max_cells is not None:
+                stage_stream_slice_vision(
+                    ctx, max_cells=max_cells, ocr_lang=ocr_lang, api_client=api_client, model=vision_model, api_key=api_key,
+                    concurrency=vision_concurrency, cache=vision_cache,
+                    batch_size=vision_batch_size, detail=vision_detail,
+                    ocr_engine=ocr_engine, ocr_threads=ocr_threads, ocr_cache=ocr_cache,
+                )
+            else:
+                stage_slice_ocr(ctx, ocr_lang=ocr_lang, ocr_engine=ocr_engine, ocr_threads=ocr_threads, ocr_cache=ocr_cache)
+                stage_vision(
+                    ctx, api_client=api_client, model=vision_model, api_key=api_key,
+                    concurrency=vision_concurrency, cache=vision_cache,
+                    batch_size=vision_batch_size, detail=vision_detail,
+                )
+            stage_embed(ctx, cache=embedding_cache)
+            stage_score(ctx, similarity_bonus_scale=similarity_bonus_scale, ann_nprobe=ann_nprobe)
+        # 清单中只记录打分结果本身，本次运行的统计加在副本上
+        scored = ctx.result
+        result = ctx.result = dict(scored)
+        result["ocr_engine_stats"] = ocr_engine_stats()
+        if ocr_cache is not None:
+            result["ocr_cache_stats"] = ocr_cache.stats()
+        result["vision_client_stats"] = vision_client_stats()
+        result["vision_rate_limit_stats"] = rate_limit_stats()
+        if vision_cache is not None:
+            result["vision_cache_stats"] = vision_cache.stats()
+        if ctx.cell_embeddings is not None:
+            from embedding_store import embedding_cache_stats
+            result["embedding_cache_stats"] = embedding_cache_stats(embedding_cache)
+        result["timings"] = tracer.summary()
+        if output_dir is not None:
+            persist_context(ctx, output_dir, save_covers=save_covers)
+            # 落盘之后才记录 score 阶段：中途退出时下次会重新打分并补齐输出文件
+            cp, keys = checkpoint
+            record_score(cp, keys, scored)
+            result["checkpoint"] = cp.status()
+    return result
 
-    cell_embeddings = None
-    if ref_store_path and ref_store_path.exists():
-        try:
-            from embedding_store import get_image_embedding_model, embed_images
-            model = get_image_embedding_model()
-            if model is not None:
-                from config import GRID_CELLS
-                cover_paths = [output_dir / "covers" / f"cell_{i:02d}.jpg" for i in range(GRID_CELLS)]
-                cell_embeddings = embed_images(cover_paths, model)
-        except Exception:
-            cell_embeddings = None
 
-    cells = json.loads((output_dir / "cells.json").read_text(encoding="utf-8"))
-    scoring = load_scoring(profile_dir)
-    
-    # 默认使用 profile 目录下的 ref_embeddings.json（如果存在且未指定 --ref-store）
-    if ref_store_path is None:
-        default_ref = profile_dir / "ref_embeddings.json"
-        if default_ref.exists():
-            ref_store_path = default_ref
-    
-    if scoring:
-        result = aggregate_by_scoring(
-            cells, vision_results, scoring,
-            creator_name=creator_name, creator_desc=creator_desc,
-        )
-        result["profile_mode"] = "scoring"
-        # scoring 模式也支持向量相似度加分（通过 aggregate_score 的逻辑）
-        if ref_store_path and ref_store_path.exists():
-            try:
-                from embedding_store import get_image_embedding_model, embed_images
-                model = get_image_embedding_model()
-                if model is not None:
-                    from config import GRID_CELLS
-                    cover_paths = [output_dir / "covers" / f"cell_{i:02d}.jpg" for i in range(GRID_CELLS)]
-                    cell_embeddings = embed_images(cover_paths, model)
-                    # 对每个格子的原始分做相似度加权（简单加法）
-                    from embedding_store import load_reference_store, max_similarity_to_references
-                    ref_store = load_reference_store(ref_store_path)
-                    for i in range(min(len(cell_embeddings), len(result.get("rule_breakdown", {})))):
-                        if cell_embeddings[i]:
-                            sim = max_similarity_to_references(cell_embeddings[i], ref_store, "type")
-                            # 相似度高时给总分加分（最多+1分）
-                            if sim > 0.7:
-                                result["score_total"] = min(10, round(result.get("score_total", 0) + sim * 0.5, 1))
-            except Exception:
-                pass
+def _resume_stages(
+    ctx: JudgeContext,
+    output_dir: Path,
+    fresh: bool,
+    ocr_lang: str,
+    ocr_engine: Optional[str],
+    ocr_threads: Optional[int],
+    ocr_cache: Optional[DiskCache],
+    max_cells: Optional[int],
+    api_client: str,
+    vision_model: Optional[str],
+    api_key: Optional[str],
+    vision_concurrency: int,
+    vision_batch_size: int,
+    vision_detail: str,
+    vision_cache: Optional[DiskCache],
+    embedding_cache: Optional[DiskCache],
+    similarity_bonus_scale: float,
+    ann_nprobe: Optional[int],
+    save_covers: bool,
+) -> Tuple[Checkpoint, Dict[str, str]]:
+    """
+    带断点的切格/OCR -> Vision -> embed -> 打分（checkpoint.py）：按 output_dir/checkpoint/manifest.json 跳过已完成的阶段，
+    Vision 只重发出错或缺失的格子；fresh 时忽略已有清单。打分结果填入 ctx.result，返回 (清单, 各阶段键)。
+    """
+    cp = open_checkpoint(output_dir, ctx.screenshot, fresh=fresh)
+    keys = stage_keys(
+        ctx, cp.input_hash, ocr_lang=ocr_lang, ocr_engine=ocr_engine, max_cells=max_cells, api_client=api_client,
+        vision_model=vision_model, vision_detail=vision_detail,
+        similarity_bonus_scale=similarity_bonus_scale, ann_nprobe=ann_nprobe,
+    )
+    vision_kwargs = dict(
+        api_client=api_client, model=vision_model, api_key=api_key, concurrency=vision_concurrency,
+        cache=vision_cache, batch_size=vision_batch_size, detail=vision_detail,
+    )
+    if max_cells is not None and cp.get("ocr", keys["ocr"]) is None and cp.partial("vision", keys["vision"]) is None:
+        # 长截图首次运行：仍边切边提交 Vision，结束后一并记录 OCR 与 Vision 阶段
+        with ocr_error_scope() as ocr_errors:
+            stage_stream_slice_vision(
+                ctx, max_cells=max_cells, ocr_lang=ocr_lang, ocr_engine=ocr_engine, ocr_threads=ocr_threads,
+                ocr_cache=ocr_cache, **vision_kwargs,
+            )
+        cp.put("ocr", keys["ocr"], ctx.cells, done=ocr_errors[0] == 0)
+        cp.put("vision", keys["vision"], ctx.vision_results, done=not any(r.get("error") for r in ctx.vision_results))
     else:
-        ct, co = load_criteria(profile_dir)
-        result = aggregate_scores(
-            cells, vision_results, ct, co,
-            creator_name=creator_name, creator_desc=creator_desc,
-            ref_store_path=str(ref_store_path) if ref_store_path else None,
-            cell_embeddings=cell_embeddings,
-            similarity_bonus_scale=similarity_bonus_scale,
-        )
-        result["profile_mode"] = "criteria"
-    with open(output_dir / "result.json", "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
-    return result
+        if resume_slice_ocr(ctx, cp, keys, ocr_lang=ocr_lang, ocr_engine=ocr_engine, ocr_threads=ocr_threads, ocr_cache=ocr_cache, max_cells=max_cells):
+            if covers_needed(cp, keys, output_dir, len(ctx.cells), save_covers):
+                restore_covers(ctx, max_cells)
+        resume_vision(ctx, cp, keys, max_cells=max_cells, **vision_kwargs)
+    resume_embed(ctx, cp, keys, max_cells=max_cells, cache=embedding_cache)
+    ctx.result = cp.get("score", keys["score"]) or stage_score(ctx, similarity_bonus_scale=similarity_bonus_scale, ann_nprobe=ann_nprobe)
+    return cp, keys
 
 
 def main():
     parser = argparse.ArgumentParser(description="截图分析：类型/调性 1–10 分")
-    parser.add_argument("screenshot", type=str, help="整屏截图路径")
+    parser.add_argument("screenshot", type=str, nargs="?", default=None, help="整屏截图路径（--batch 时省略）")
+    parser.add_argument("--batch", type=str, default=None, help="批量模式：截图目录，或 .jsonl/.json 清单（screenshot、id、creator_name、creator_desc、note_titles）")
+    parser.add_argument("--slice-workers", type=int, default=None, help="批量模式：切格/OCR 进程数，默认 min(4, CPU 核数)")
+    parser.add_argument("--vision-workers", type=int, default=BATCH_VISION_WORKERS, help=f"批量模式：同时处于 Vision 阶段的达人数，默认 {BATCH_VISION_WORKERS}")
     parser.add_argument("-o", "--output", type=str, default=None, help="输出目录")
     parser.add_argument("-p", "--profile", type=str, default="douyin_mom_finder", help="profile 名，对应 profiles/<name>/；默认 douyin_mom_finder（规则打分）")
     parser.add_argument("--creator-name", type=str, default=None)
     parser.add_argument("--creator-desc", type=str, default=None)
     parser.add_argument("--note-titles", type=str, default=None, help='JSON 数组，24 个笔记标题，如 \'["t1","t2",...]\'')
-    parser.add_argument("--api", type=str, default="openai", choices=["openai", "gemini", "anthropic"])
+    parser.add_argument("--api", type=str, default="openai", choices=["openai", "gemini", "anthropic", "stub"], help="Vision provider；stub 为不联网的离线后端（测试用）")
     parser.add_argument("--model", type=str, default=None)
     parser.add_argument("--ref-store", type=str, default=None)
     parser.add_argument("--similarity-bonus", type=float, default=0.5)
+    parser.add_argument("--ann-nprobe", type=int, default=None, help=f"参考库有 IVF 索引时每次查询探测的桶数，0 为精确搜索；默认 {ANN_NPROBE}")
+    parser.add_argument("--max-cells", type=int, default=None, help="整页长截图：按行带流式切格，最多 N 格（0 为切到页面底部）；默认只切首屏 4×6")
+    parser.add_argument("--ocr-engine", type=str, default=OCR_ENGINE, choices=["auto", *ENGINE_PREFERENCE], help=f"文案区 OCR 引擎，默认 {OCR_ENGINE}（依次尝试 {' / '.join(ENGINE_PREFERENCE)}）")
+    parser.add_argument("--ocr-threads", type=int, default=None, help="OCR 工作线程数（每线程一个常驻会话），默认 min(4, CPU 核数)")
+    parser.add_argument("--ocr-cache", type=str, default=str(PROJECT_ROOT / ".cache"), help="OCR 结果缓存目录（SQLite，按文案区文字掩码摘要；需 numpy），默认 <项目>/.cache")
+    parser.add_argument("--no-ocr-cache", action="store_true", help="不读写 OCR 结果缓存")
+    parser.add_argument("--no-resume", action="store_true", help="忽略输出目录下的断点清单（checkpoint/manifest.json），所有阶段从头跑")
+    parser.add_argument("--no-save-covers", action="store_true", help="不把 24 张封面写入输出目录（其余结果仍落盘）")
+    parser.add_argument("--vision-concurrency", type=int, default=VISION_CONCURRENCY, help=f"Vision 同时在途请求数的起点（之后按限流自适应调整），1 为串行；默认 {VISION_CONCURRENCY}")
+    parser.add_argument("--vision-batch-size", type=int, default=VISION_BATCH_SIZE, help=f"每次 Vision 请求发送的封面数，1 为逐格请求；默认 {VISION_BATCH_SIZE}")
+    parser.add_argument("--vision-detail", type=str, default=VISION_DETAIL, choices=list(VISION_DETAIL_TIERS), help=f"封面上传档位（缩放/重编码/OpenAI detail），默认 {VISION_DETAIL}")
+    parser.add_argument("--vision-cache", type=str, default=str(PROJECT_ROOT / ".cache"), help="Vision 结果缓存目录（SQLite），默认 <项目>/.cache")
+    parser.add_argument("--no-vision-cache", action="store_true", help="不读写 Vision 结果缓存")
+    parser.add_argument("--embedding-cache", type=str, default=str(PROJECT_ROOT / ".cache"), help="封面向量缓存目录（SQLite），默认 <项目>/.cache")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="不读写封面向量磁盘缓存")
+    parser.add_argument("--trace", type=str, default=None, help="导出各阶段 span 时间线：.jsonl 为逐行事件，其余为 Chrome trace JSON（chrome://tracing / Perfetto）")
     args = parser.parse_args()
+    if not args.screenshot and not args.batch:
+        parser.error("需要截图路径或 --batch")
 
-    base = Path(args.screenshot).resolve().parent
-    out = Path(args.output).resolve() if args.output else base / "judge_out"
+    if args.batch:
+        batch_src = Path(args.batch).resolve()
+        base = batch_src if batch_src.is_dir() else batch_src.parent
+        out = Path(args.output).resolve() if args.output else base / "judge_batch_out"
+    else:
+        base = Path(args.screenshot).resolve().parent
+        out = Path(args.output).resolve() if args.output else base / "judge_out"
     profile_dir = PROJECT_ROOT / "profiles" / args.profile
     if not profile_dir.exists():
         print(f"profile 不存在: {profile_dir}")
@@ -136,10 +243,57 @@ def main():
             note_titles = json.loads(args.note_titles)
             if len(note_titles) < 24:
                 note_titles = note_titles + [""] * (24 - len(note_titles))
-            note_titles = note_titles[:24]
+            if args.max_cells is None:
+                note_titles = note_titles[:24]
         except Exception:
             note_titles = None
 
+    try:
+        resolve_ocr_engine(args.ocr_engine)
+    except OCREngineUnavailable as e:
+        print(e)
+        sys.exit(1)
+
+    vision_cache = None if args.no_vision_cache else open_vision_cache(args.vision_cache)
+    embedding_cache = None
+    if not args.no_embedding_cache:
+        from embedding_store import open_embedding_cache
+        embedding_cache = open_embedding_cache(args.embedding_cache)
+    if args.batch:
+        from batch_judge import load_batch_jobs, run_batch_judge
+        jobs = load_batch_jobs(batch_src)
+        stats = run_batch_judge(
+            jobs, out, profile_dir,
+            api_client=args.api,
+            vision_model=args.model,
+            ref_store_path=ref_store,
+            similarity_bonus_scale=args.similarity_bonus,
+            ocr_engine=args.ocr_engine,
+            ocr_threads=args.ocr_threads,
+            ocr_cache_dir=None if args.no_ocr_cache else args.ocr_cache,
+            max_cells=args.max_cells,
+            vision_concurrency=args.vision_concurrency,
+            vision_batch_size=args.vision_batch_size,
+            vision_detail=args.vision_detail,
+            vision_cache=vision_cache,
+            embedding_cache=embedding_cache,
+            ann_nprobe=args.ann_nprobe,
+            save_covers=not args.no_save_covers,
+            slice_workers=args.slice_workers,
+            vision_workers=args.vision_workers,
+            resume=not args.no_resume,
+            trace_path=Path(args.trace).resolve() if args.trace else None,
+        )
+        if vision_cache is not None:
+            stats["vision_cache_stats"] = vision_cache.stats()
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return
+
+    ocr_cache = None
+    if not args.no_ocr_cache:
+        from ocr_cache import open_ocr_cache
+        ocr_cache = open_ocr_cache(args.ocr_cache)
+    tracer = Tracer(args.creator_name or Path(args.screenshot).stem)
     result = run_full_judge(
         Path(args.screenshot).resolve(),
         out,
@@ -151,7 +305,22 @@ def main():
         vision_model=args.model,
         ref_store_path=ref_store,
         similarity_bonus_scale=args.similarity_bonus,
+        vision_concurrency=args.vision_concurrency,
+        vision_batch_size=args.vision_batch_size,
+        vision_detail=args.vision_detail,
+        vision_cache=vision_cache,
+        save_covers=not args.no_save_covers,
+        ann_nprobe=args.ann_nprobe,
+        embedding_cache=embedding_cache,
+        max_cells=args.max_cells,
+        ocr_engine=args.ocr_engine,
+        ocr_threads=args.ocr_threads,
+        ocr_cache=ocr_cache,
+        resume=not args.no_resume,
+        tracer=tracer,
     )
+    if args.trace:
+        tracer.export(Path(args.trace).resolve())
     print(json.dumps(result, ensure_ascii=False, indent=2))
     if result.get("profile_mode") == "scoring":
         print(f"\n总分: {result.get('score_total', 0)}  合格>6: {result.get('qualifies')}  非常推荐>9: {result.get('very_recommended')}")
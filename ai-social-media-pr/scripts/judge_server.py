@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+常驻 judge 服务：一个进程内保持 OCR 引擎会话、CLIP 模型、参考向量库矩阵、Vision 客户端连接池与各缓存连接，
+每个请求直接走 run_full_judge（整屏截图）或内存流水线（已切好的封面组），省去每次启动 judge.py 的导入与加载开销。
+请求进入有界队列，由 --workers 个工作线程执行；提交后立即返回任务 id，结果通过 GET /jobs/<id> 取回（可长轮询）。
+--api stub 使用不联网的离线 Vision 后端，便于本地测试。
+
+接口（JSON）：
+  POST /judge         {"screenshot": 服务器本地路径 | "screenshot_base64": ..., "creator_name", "creator_desc",
+                       "note_titles", "profile", "max_cells", "name", "wait": 秒}
+  POST /judge/covers  {"covers": [本地路径, ...] | "covers_base64": [...], "cells": [{"title", "has_zhiding", "likes_approx"}, ...],
+                       "note_titles", "creator_name", "creator_desc", "profile", "name", "wait": 秒}
+  GET  /jobs/<id>[?wait=秒]
+  GET  /health
+
+用法：python scripts/judge_server.py --port 8765 --workers 2 [--unix-socket /tmp/judge.sock] [--output-root server_out]
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import io
+import json
+import os
+import queue
+import re
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import parse_qs, urlparse
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = SCRIPT_DIR.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+from PIL import Image
+
+from config import (
+    LIKES_OCR_WHITELIST,
+    OCR_ENGINE,
+    SERVICE_HOST,
+    SERVICE_MAX_BODY_BYTES,
+    SERVICE_MAX_JOBS,
+    SERVICE_PORT,
+    SERVICE_QUEUE_SIZE,
+    SERVICE_WORKERS,
+    VISION_BATCH_SIZE,
+    VISION_CONCURRENCY,
+    VISION_DETAIL,
+    VISION_DETAIL_TIERS,
+)
+from judge import run_full_judge
+from ocr_engines import ENGINE_PREFERENCE, OCREngineUnavailable, get_ocr_engine, ocr_engine_stats, resolve_ocr_engine
+from pipeline import JudgeContext, persist_context, stage_embed, stage_score, stage_vision
+from rate_limit import rate_limit_stats
+from slice_and_ocr import cell_summary
+from tracing import Tracer, activate
+from vision_cell import open_vision_cache
+from vision_prompt import get_vision_client, vision_client_stats
+
+# 任务名与 profile 名直接用作目录名：只允许单层名称，全由点组成的 "." / ".." 会指向当前或上级目录
+_NAME_PATTERN = re.compile(r"^(?!\.+$)[\w.\-]{1,128}$")
+_STOP = object()
+
+
+class JobConflict(ValueError):
+    """同名（同一输出子目录）的任务仍在排队或执行中。"""
+
+
+@dataclass
+class JudgeJob:
+    """一次提交：kind 为 screenshot / covers；status 依次为 queued -> running -> done / error。"""
+
+    id: str
+    kind: str
+    name: str
+    params: Dict[str, Any]
+    status: str = "queued"
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"id": self.id, "kind": self.kind, "name": self.name, "status": self.status}
+        if self.started is not None:
+            out["queued_seconds"] = round(self.started - self.created, 3)
+        if self.finished is not None and self.started is not None:
+            out["seconds"] = round(self.finished - self.started, 3)
+        if self.result is not None:
+            out["result"] = self.result
+        if self.error:
+            out["error"] = self.error
+        return out
+
+
+def _decode_image(value: str, what: str) -> Image.Image:
+    try:
+        im = Image.open(io.BytesIO(base64.b64decode(value, validate=True)))
+        im.load()
+        return im
+    except Exception as e:
+        raise ValueError(f"{what} 不是有效的 base64 图片: {e}") from e
+
+
+def _local_path(value: Any, what: str) -> Path:
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"{what} 应为路径字符串")
+    path = Path(value).expanduser().resolve()
+    if not path.is_file():
+        raise ValueError(f"{what} 不存在: {path}")
+    return path
+
+
+def _open_local_image(value: Any, what: str) -> Image.Image:
+    path = _local_path(value, what)
+    try:
+        im = Image.open(path)
+        im.load()
+        return im
+    except Exception as e:
+        raise ValueError(f"{what} 不是有效的图片: {path}") from e
+
+
+class JudgeService:
+    """
+    任务队列 + 工作线程。模型、参考库、OCR 会话与 Vision 客户端都在进程级注册表中常驻（见 warm_up），
+    各任务共享；options 为传给 run_full_judge 的公共参数（api_client、vision_cache、ocr_cache 等）。
+    output_root 不为 None 时每个任务落盘到 output_root/<name>/，同名任务重复提交时按断点清单续跑。
+    """
+
+    def __init__(
+        self,
+        profiles_root: Path,
+        default_profile: str,
+        options: Dict[str, Any],
+        output_root: Optional[Path] = None,
+        workers: int = SERVICE_WORKERS,
+        queue_size: int = SERVICE_QUEUE_SIZE,
+        max_jobs: int = SERVICE_MAX_JOBS,
+    ):
+        self.profiles_root = Path(profiles_root)
+        self.default_profile = default_profile
+        self.options = options
+        self.output_root = Path(output_root) if output_root else None
+        self.max_jobs = max(1, int(max_jobs))
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._jobs: "OrderedDict[str, JudgeJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "done": 0, "errors": 0, "rejected": 0}
+        self._started = time.time()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"judge-worker-{i}", daemon=True) for i in range(max(1, int(workers)))
+        ]
+        for t in self._threads:
+            t.start()
+
+    # --- 预热 ---
+    def warm_up(self) -> Dict[str, Any]:
+        """提前创建 OCR 会话、Vision 客户端并加载默认 profile 的参考库与 CLIP 模型，返回各项耗时（秒）。"""
+        o = self.options
+        timings: Dict[str, Any] = {}
+        t = time.perf_counter()
+        get_ocr_engine(o["ocr_engine"], lang=o["ocr_lang"], threads=o["ocr_threads"])
+        get_ocr_engine(o["ocr_engine"], lang=o["ocr_lang"], threads=o["ocr_threads"], whitelist=LIKES_OCR_WHITELIST)
+        timings["ocr_engine"] = round(time.perf_counter() - t, 3)
+        t = time.perf_counter()
+        try:
+            get_vision_client(o["api_client"], api_key=o["api_key"], model=o["vision_model"])
+        except ImportError as e:
+            timings["vision_client_error"] = str(e)
+        timings["vision_client"] = round(time.perf_counter() - t, 3)
+        ctx = JudgeContext(screenshot=None, profile_dir=self.profile_dir(None), ref_store_path=o["ref_store_path"])
+        ref_store = ctx.resolve_ref_store()
+        if ref_store is not None:
+            from embedding_store import get_image_embedding_model, load_reference_index
+            t = time.perf_counter()
+            load_reference_index(ref_store)
+            timings["reference_index"] = round(time.perf_counter() - t, 3)
+            t = time.perf_counter()
+            timings["embedding_model_loaded"] = get_image_embedding_model() is not None
+            timings["embedding_model"] = round(time.perf_counter() - t, 3)
+        return timings
+
+    # --- 提交与查询 ---
+    def profile_dir(self, name: Optional[str]) -> Path:
+        name = name or self.default_profile
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"profile 名不合法: {name}")
+        path = self.profiles_root / name
+        if not path.is_dir():
+            raise ValueError(f"profile 不存在: {name}")
+        return path
+
+    def submit(self, kind: str, request: Dict[str, Any]) -> JudgeJob:
+        """校验并解码请求后入队；参数错误抛 ValueError，同名任务未完成抛 JobConflict，队列满抛 queue.Full。"""
+        params = self._parse(kind, request)
+        job_id = uuid.uuid4().hex[:12]
+        name = request.get("name") or job_id
+        if not isinstance(name, str) or not _NAME_PATTERN.match(name):
+            raise ValueError(f"name 只能包含字母、数字、下划线、点和横线，且不能全是点: {name}")
+        job = JudgeJob(id=job_id, kind=kind, name=name, params=params)
+        with self._lock:
+            if any(j.name == name and not j.done.is_set() for j in self._jobs.values()):
+                raise JobConflict(f"同名任务仍在排队或执行中: {name}")
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._counts["rejected"] += 1
+                raise
+            self._jobs[job_id] = job
+            self._counts["submitted"] += 1
+            self._trim_locked()
+        return job
+
+    def get(self, job_id: str, wait: float = 0.0) -> Optional[JudgeJob]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and wait > 0:
+            job.done.wait(wait)
+        return job
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            statuses: Dict[str, int] = {}
+            for j in self._jobs.values():
+                statuses[j.status] = statuses.get(j.status, 0) + 1
+            counts = dict(self._counts)
+        out: Dict[str, Any] = {
+            "status": "ok",
+            "uptime_seconds": round(time.time() - self._started, 1),
+            "workers": len(self._threads),
+            "queue_length": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "jobs": statuses,
+            "counts": counts,
+            "ocr_engine_stats": ocr_engine_stats(),
+            "vision_client_stats": vision_client_stats(),
+            "vision_rate_limit_stats": rate_limit_stats(),
+        }
+        for name in ("vision_cache", "ocr_cache"):
+            if self.options.get(name) is not None:
+                out[f"{name}_stats"] = self.options[name].stats()
+        from embedding_store import embedding_cache_stats
+        out["embedding_cache_stats"] = embedding_cache_stats(self.options.get("embedding_cache"))
+        return out
+
+    def close(self) -> None:
+        """处理完已排队的任务后停止工作线程。"""
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for t in self._threads:
+            t.join()
+
+    def _trim_locked(self) -> None:
+        # 只淘汰已完成的最早任务，排队/执行中的任务始终可查
+        excess = len(self._jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in [jid for jid, j in self._jobs.items() if j.done.is_set()][:excess]:
+            del self._jobs[job_id]
+
+    def _parse(self, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        params: Dict[str, Any] = {
+            "profile_dir": self.profile_dir(request.get("profile")),
+            "creator_name": request.get("creator_name") or None,
+            "creator_desc": request.get("creator_desc") or None,
+            "note_titles": request.get("note_titles") or None,
+        }
+        if params["note_titles"] is not None and not isinstance(params["note_titles"], list):
+            raise ValueError("note_titles 应为字符串数组")
+        if kind == "screenshot":
+            if request.get("screenshot_base64"):
+                params["screenshot"] = _decode_image(request["screenshot_base64"], "screenshot_base64")
+            else:
+                params["screenshot"] = _local_path(request.get("screenshot"), "screenshot")
+            max_cells = request.get("max_cells")
+            params["max_cells"] = None if max_cells is None else int(max_cells)
+            titles = params["note_titles"]
+            if titles is not None:
+                # 与 judge.py --note-titles 相同：补齐到 24 格，首屏模式截断到 24 格
+                titles = titles + [""] * (24 - len(titles))
+                params["note_titles"] = titles if params["max_cells"] is not None else titles[:24]
+        elif kind == "covers":
+            if request.get("covers_base64"):
+                covers = [_decode_image(v, f"covers_base64[{i}]") for i, v in enumerate(request["covers_base64"])]
+            else:
+                paths = request.get("covers")
+                if not isinstance(paths, list) or not paths:
+                    raise ValueError("需要 covers（本地路径数组）或 covers_base64")
+                covers = [_open_local_image(p, f"covers[{i}]") for i, p in enumerate(paths)]
+            params["covers"] = [im.convert("RGB") for im in covers]
+            cells = request.get("cells") or []
+            if not isinstance(cells, list):
+                raise ValueError("cells 应为对象数组")
+            params["cells"] = cells
+        else:
+            raise ValueError(f"未知任务类型: {kind}")
+        return params
+
+    # --- 执行 ---
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            job.status, job.started = "running", time.time()
+            try:
+                job.result = self._run_screenshot(job) if job.kind == "screenshot" else self._run_covers(job)
+                job.status = "done"
+            except Exception as e:
+                job.status, job.error = "error", f"{type(e).__name__}: {e}"
+            job.finished = time.time()
+            # 结果已在 job 上，释放解码后的图片
+            job.params.pop("screenshot", None)
+            job.params.pop("covers", None)
+            with self._lock:
+                self._counts["done" if job.status == "done" else "errors"] += 1
+            job.done.set()
+
+    def _output_dir(self, job: JudgeJob) -> Optional[Path]:
+        return self.output_root / job.name if self.output_root else None
+
+    def _run_screenshot(self, job: JudgeJob) -> Dict[str, Any]:
+        o, p = self.options, job.params
+        return run_full_judge(
+            p["screenshot"], self._output_dir(job), p["profile_dir"],
+            creator_name=p["creator_name"], creator_desc=p["creator_desc"], note_titles=p["note_titles"],
+            api_client=o["api_client"], vision_model=o["vision_model"], ref_store_path=o["ref_store_path"],
+            similarity_bonus_scale=o["similarity_bonus_scale"], ocr_lang=o["ocr_lang"],
+            vision_concurrency=o["vision_concurrency"], vision_batch_size=o["vision_batch_size"],
+            vision_detail=o["vision_detail"], vision_cache=o["vision_cache"], save_covers=o["save_covers"],
+            ann_nprobe=o["ann_nprobe"], embedding_cache=o["embedding_cache"], max_cells=p["max_cells"],
+            ocr_engine=o["ocr_engine"], ocr_threads=o["ocr_threads"], ocr_cache=o["ocr_cache"], tracer=Tracer(job.id),
+        )
+
+    def _run_covers(self, job: JudgeJob) -> Dict[str, Any]:
+        """已切好的封面组：不切格、不 OCR，格子信息来自请求（cells / note_titles），其余同内存流水线。"""
+        o, p = self.options, job.params
+        ctx = JudgeContext(
+            screenshot=None, profile_dir=p["profile_dir"], creator_name=p["creator_name"],
+            creator_desc=p["creator_desc"], note_titles=p["note_titles"], ref_store_path=o["ref_store_path"],
+        )
+        ctx.covers = p["covers"]
+        titles: List[str] = p["note_titles"] or []
+        for idx in range(len(ctx.covers)):
+            given = p["cells"][idx] if idx < len(p["cells"]) and isinstance(p["cells"][idx], dict) else {}
+            info = {
+                "raw": "",
+                "title": given.get("title") or (titles[idx] if idx < len(titles) else "") or "",
+                "has_zhiding": bool(given.get("has_zhiding", False)),
+                "likes_approx": given.get("likes_approx"),
+            }
+            ctx.cells.append(cell_summary(idx, info, ctx.cover_label(idx)))
+        tracer = Tracer(job.id)
+        with activate(tracer):
+            stage_vision(
+                ctx, api_client=o["api_client"], model=o["vision_model"], api_key=o["api_key"],
+                concurrency=o["vision_concurrency"], cache=o["vision_cache"],
+                batch_size=o["vision_batch_size"], detail=o["vision_detail"],
+            )
+            stage_embed(ctx, cache=o["embedding_cache"])
+            stage_score(ctx, similarity_bonus_scale=o["similarity_bonus_scale"], ann_nprobe=o["ann_nprobe"])
+            result = ctx.result = dict(ctx.result, timings=tracer.summary())
+            output_dir = self._output_dir(job)
+            if output_dir is not None:
+                persist_context(ctx, output_dir, save_covers=o["save_covers"])
+        return result
+
+
+def make_handler(service: JudgeService, verbose: bool = False):
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "judge-server/1"
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, code: int, payload: Dict[str, Any]) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _job_response(self, job: JudgeJob) -> None:
+            self._send(200 if job.done.is_set() else 202, job.to_dict())
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            if url.path == "/health":
+                self._send(200, service.health())
+                return
+            m = re.match(r"^/jobs/([0-9a-f]+)$", url.path)
+            if not m:
+                self._send(404, {"error": f"未知路径: {url.path}"})
+                return
+            try:
+                wait = float((parse_qs(url.query).get("wait") or ["0"])[0])
+            except ValueError:
+                wait = 0.0
+            job = service.get(m.group(1), wait=wait)
+            if job is None:
+                self._send(404, {"error": f"任务不存在或已过期: {m.group(1)}"})
+                return
+            self._job_response(job)
+
+        def do_POST(self) -> None:
+            url = urlparse(self.path)
+            kind = {"/judge": "screenshot", "/judge/covers": "covers"}.get(url.path)
+            if kind is None:
+                self._send(404, {"error": f"未知路径: {url.path}"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > SERVICE_MAX_BODY_BYTES:
+                self._send(413, {"error": f"请求体超过 {SERVICE_MAX_BODY_BYTES} 字节"})
+                self.close_connection = True
+                return
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("请求体应为 JSON 对象")
+                job = service.submit(kind, request)
+            except JobConflict as e:
+                self._send(409, {"error": str(e)})
+                return
+            except queue.Full:
+                self._send(503, {"error": "队列已满，请稍后重试"})
+                return
+            except (ValueError, json.JSONDecodeError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            except Exception as e:
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+                return
+            wait = request.get("wait") or 0
+            if wait:
+                job.done.wait(float(wait))
+            self._job_response(job)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            if verbose:
+                super().log_message(format, *args)
+
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix 域套接字上的 HTTP 服务（本机调用方不占端口，权限由套接字文件控制）。"""
+
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler 记录日志时取 client_address[0]
+        return request, ("unix", 0)
+
+
+def make_server(service: JudgeService, host: str = SERVICE_HOST, port: int = SERVICE_PORT, unix_socket: Optional[str] = None, verbose: bool = False):
+    handler = make_handler(service, verbose=verbose)
+    if unix_socket:
+        path = Path(unix_socket)
+        if path.exists():
+            path.unlink()
+        return UnixHTTPServer(str(path), handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻 judge 服务（HTTP / Unix 套接字）")
+    parser.add_argument("--host", type=str, default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--unix-socket", type=str, default=None, help="改为监听 Unix 域套接字（忽略 --host/--port）")
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help=f"同时执行的任务数，默认 {SERVICE_WORKERS}")
+    parser.add_argument("--queue-size", type=int, default=SERVICE_QUEUE_SIZE, help=f"排队任务上限（满时返回 503），默认 {SERVICE_QUEUE_SIZE}")
+    parser.add_argument("--output-root", type=str, default=None, help="每个任务落盘到 <目录>/<name>/（同名任务按断点清单续跑）；默认不落盘")
+    parser.add_argument("-p", "--profile", type=str, default="douyin_mom_finder", help="请求未指定 profile 时使用的 profile")
+    parser.add_argument("--api", type=str, default="openai", choices=["openai", "gemini", "anthropic", "stub"], help="Vision provider；stub 为不联网的离线后端（测试用）")
+    parser.add_argument("--model", type=str, default=None)
+    parser.add_argument("--ref-store", type=str, default=None)
+    parser.add_argument("--similarity-bonus", type=float, default=0.5)
+    parser.add_argument("--ann-nprobe", type=int, default=None)
+    parser.add_argument("--ocr-engine", type=str, default=OCR_ENGINE, choices=["auto", *ENGINE_PREFERENCE])
+    parser.add_argument("--ocr-threads", type=int, default=None)
+    parser.add_argument("--ocr-cache", type=str, default=str(PROJECT_ROOT / ".cache"))
+    parser.add_argument("--no-ocr-cache", action="store_true")
+    parser.add_argument("--vision-concurrency", type=int, default=VISION_CONCURRENCY, help=f"Vision 在途请求数的起点（之后按限流自适应调整），默认 {VISION_CONCURRENCY}")
+    parser.add_argument("--vision-batch-size", type=int, default=VISION_BATCH_SIZE)
+    parser.add_argument("--vision-detail", type=str, default=VISION_DETAIL, choices=list(VISION_DETAIL_TIERS))
+    parser.add_argument("--vision-cache", type=str, default=str(PROJECT_ROOT / ".cache"))
+    parser.add_argument("--no-vision-cache", action="store_true")
+    parser.add_argument("--embedding-cache", type=str, default=str(PROJECT_ROOT / ".cache"))
+    parser.add_argument("--no-embedding-cache", action="store_true")
+    parser.add_argument("--no-save-covers", action="store_true")
+    parser.add_argument("--no-warm-up", action="store_true", help="启动时不预加载 OCR / Vision 客户端 / 参考库 / CLIP")
+    parser.add_argument("-v", "--verbose", action="store_true", help="打印每个 HTTP 请求")
+    args = parser.parse_args()
+
+    try:
+        resolve_ocr_engine(args.ocr_engine)
+    except OCREngineUnavailable as e:
+        print(e)
+        sys.exit(1)
+    ocr_cache = None
+    if not args.no_ocr_cache:
+        from ocr_cache import open_ocr_cache
+        ocr_cache = open_ocr_cache(args.ocr_cache)
+    embedding_cache = None
+    if not args.no_embedding_cache:
+        from embedding_store import open_embedding_cache
+        embedding_cache = open_embedding_cache(args.embedding_cache)
+    options: Dict[str, Any] = {
+        "api_client": args.api,
+        "vision_model": args.model,
+        "api_key": os.environ.get("OPENAI_API_KEY") or os.environ.get("GEMINI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY"),
+        "ref_store_path": Path(args.ref_store).resolve() if args.ref_store else None,
+        "similarity_bonus_scale": args.similarity_bonus,
+        "ann_nprobe": args.ann_nprobe,
+        "ocr_lang": "chi_sim+eng",
+        "ocr_engine": args.ocr_engine,
+        "ocr_threads": args.ocr_threads,
+        "ocr_cache": ocr_cache,
+        "vision_concurrency": args.vision_concurrency,
+        "vision_batch_size": args.vision_batch_size,
+        "vision_detail": args.vision_detail,
+        "vision_cache": None if args.no_vision_cache else open_vision_cache(args.vision_cache),
+        "embedding_cache": embedding_cache,
+        "save_covers": not args.no_save_covers,
+    }
+    try:
+        service = JudgeService(
+            PROJECT_ROOT / "profiles", args.profile, options,
+            output_root=Path(args.output_root).resolve() if args.output_root else None,
+            workers=args.workers, queue_size=args.queue_size,
+        )
+        service.profile_dir(None)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    if not args.no_warm_up:
+        print("预热:", json.dumps(service.warm_up(), ensure_ascii=False))
+    server = make_server(service, host=args.host, port=args.port, unix_socket=args.unix_socket, verbose=args.verbose)
+    where = f"unix:{args.unix_socket}" if args.unix_socket else f"http://{args.host}:{args.port}"
+    print(f"judge 服务已启动: {where}（workers={args.workers}, api={args.api}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.unix_socket and Path(args.unix_socket).exists():
+            Path(args.unix_socket).unlink()
+
+
+if __name__ == "__main__":
+    main()
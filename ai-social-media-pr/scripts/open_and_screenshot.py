@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 打开达人主页 URL，检查是否已登录；未登录则提示用户登录后按回车再截图。
-登录完成后对当前页面截图并保存。
+登录完成后对当前页面截图并保存（整页截图；--scrolls 先向下滚动加载更多笔记，配合 judge.py --max-cells 流式切格）。
 """
 from __future__ import annotations
 
@@ -22,6 +22,7 @@ def main():
     parser.add_argument("-o", "--output", type=str, default="screenshot.png", help="截图保存路径")
     parser.add_argument("--headless", action="store_true", help="无头模式（不检查登录，直接截图）")
     parser.add_argument("--timeout", type=float, default=30, help="页面加载等待秒数")
+    parser.add_argument("--scrolls", type=int, default=0, help="截图前滚动到页面底部的次数（每次等待懒加载），用于截取多于 4 行的整页长图")
     args = parser.parse_args()
 
     try:
@@ -58,6 +59,13 @@ def main():
         else:
             print("无头模式：直接截图（不进行登录检查）。")
 
+        for _ in range(max(0, args.scrolls)):
+            page.mouse.wheel(0, 100000)
+            page.wait_for_timeout(1500)
+        if args.scrolls > 0:
+            page.evaluate("window.scrollTo(0, 0)")
+            page.wait_for_timeout(500)
+
         page.screenshot(path=str(output_path), full_page=True)
         browser.close()
 
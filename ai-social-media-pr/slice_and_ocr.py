@@ -1,35 +1,150 @@
 """
 流水线：整屏截图 -> 4×6 切格 -> 每格 OCR 文案区（或使用已提供的笔记标题）-> 输出 24 个 (封面图, 文案结构化)。
 达人名称、简介、每个笔记标题可由外部脚本提供，此处通过 note_titles 传入即视为“已有”。
+整页长截图可用 iter_slice_and_ocr 按行带流式切格（不限 24 格），每切出一格就 OCR 并产出。
+OCR 默认批量进行（ocr_utils.ocr_text_regions_batch）：每 OCR_BATCH_MAX_CELLS 格一批，tesseract 引擎拼图调用一次，
+其他引擎在线程池上逐格识别；batch_ocr=False 为逐格 OCR。ocr_engine / ocr_threads 选择引擎与线程数（见 ocr_engines.py）。
+note_titles 覆盖到的格子（config.OCR_LAZY_WITH_TITLES）不做文案区 OCR：置顶与点赞数直接从封面角标/点赞小框读取（cell_badges.py）。
+ocr_cache（ocr_cache.open_ocr_cache）按文案区文字掩码摘要缓存 OCR 结果，重复筛查时未变化的格子不再 OCR。
 """
 from __future__ import annotations
 
+import json
 from pathlib import Path
-from typing import List, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Tuple, Union
 
 from PIL import Image
 
-from grid import slice_screenshot
-from ocr_utils import extract_cell_text
+from config import OCR_BATCH, OCR_BATCH_MAX_CELLS, OCR_LAZY_WITH_TITLES
+from grid import GridCell, slice_screenshot
+from ocr_utils import extract_cells_text
+
+if TYPE_CHECKING:
+    from disk_cache import DiskCache
+
+
+def _ocr_cells(
+    cells: Iterable[GridCell],
+    ocr_lang: str,
+    note_titles: Optional[List[str]],
+    batch_ocr: bool,
+    ocr_engine: Optional[str] = None,
+    ocr_threads: Optional[int] = None,
+    lazy: bool = OCR_LAZY_WITH_TITLES,
+    cache: Optional["DiskCache"] = None,
+) -> Iterator[Tuple[GridCell, Image.Image, dict]]:
+    """
+    每 OCR_BATCH_MAX_CELLS 格一批 OCR 文案区（batch_ocr 时拼图识别，否则在引擎线程池上逐格识别），
+    逐格产出 (格子, 文案区图, cell_info)；note_titles 按格子序号覆盖 title。
+    lazy 时 note_titles 已给出标题的格子跳过文案区 OCR，只做置顶角标检测与点赞数小框 OCR（raw 为空串）。
+    cells 可以是流式切格的生成器，凑满一批即 OCR，不必等整页切完。
+    """
+    step = max(1, OCR_BATCH_MAX_CELLS)
+    pending: List[GridCell] = []
+
+    def given_title(cell: GridCell) -> Optional[str]:
+        if note_titles and cell.index < len(note_titles) and note_titles[cell.index]:
+            return note_titles[cell.index]
+        return None
+
+    def flush() -> Iterator[Tuple[GridCell, Image.Image, dict]]:
+        regions = [cell.text_region for cell in pending]
+        titled = [i for i, cell in enumerate(pending) if lazy and given_title(cell)]
+        skip = set(titled)
+        full = [i for i in range(len(pending)) if i not in skip]
+        infos: List[Optional[dict]] = [None] * len(pending)
+        if titled:
+            from cell_badges import detect_cell_badges
+            badges = detect_cell_badges(
+                [pending[i] for i in titled], lang=ocr_lang, engine=ocr_engine, threads=ocr_threads, cache=cache,
+            )
+            for i, info in zip(titled, badges):
+                infos[i] = info
+        if full:
+            texts = extract_cells_text(
+                [regions[i] for i in full], lang=ocr_lang, batch=batch_ocr, engine=ocr_engine, threads=ocr_threads, cache=cache,
+            )
+            for i, info in zip(full, texts):
+                infos[i] = info
+        for cell, region, info in zip(pending, regions, infos):
+            title = given_title(cell)
+            if title:
+                info["title"] = title
+            yield cell, region, info
+        pending.clear()
+
+    for cell in cells:
+        pending.append(cell)
+        if len(pending) >= step:
+            yield from flush()
+    if pending:
+        yield from flush()
 
 
 def run_slice_and_ocr(
     screenshot_path: Union[str, Path],
     ocr_lang: str = "chi_sim+eng",
     note_titles: Optional[List[str]] = None,
+    max_cells: Optional[int] = None,
+    batch_ocr: bool = OCR_BATCH,
+    ocr_engine: Optional[str] = None,
+    ocr_threads: Optional[int] = None,
+    lazy_ocr: bool = OCR_LAZY_WITH_TITLES,
+    ocr_cache: Optional["DiskCache"] = None,
 ) -> List[Tuple[Image.Image, dict]]:
     """
-    对一张整屏截图：切 24 格，每格 OCR 文案区；若提供 note_titles（长度 24），则用其覆盖每格 title。
+    对一张整屏截图：切 24 格，OCR 文案区（默认 24 格拼图一次 OCR）；若提供 note_titles（长度 24），则用其覆盖每格 title。
     返回 list of (cover_pil, cell_info)，共 24 项。
+    max_cells 不为 None 时按整页长截图流式切格（见 iter_slice_and_ocr），最多 max_cells 格，0 为切到页面底部。
+    ocr_engine / ocr_threads 为 OCR 引擎名与工作线程数，None 时用 config.OCR_ENGINE / OCR_THREADS。
+    lazy_ocr 时已有标题的格子不做文案区 OCR，只检测置顶角标与点赞数（见 cell_badges.py）；ocr_cache 为 OCR 结果缓存。
     """
+    if max_cells is not None:
+        return list(iter_slice_and_ocr(screenshot_path, ocr_lang=ocr_lang, note_titles=note_titles, max_cells=max_cells,
+            batch_ocr=batch_ocr, ocr_engine=ocr_engine, ocr_threads=ocr_threads, lazy_ocr=lazy_ocr, ocr_cache=ocr_cache,
+        ))
     cells = slice_screenshot(screenshot_path)
-    out: List[Tuple[Image.Image, dict]] = []
-    for idx, (cover_im, text_region_im) in enumerate(cells):
-        cell_info = extract_cell_text(text_region_im, lang=ocr_lang)
-        if note_titles and idx < len(note_titles) and note_titles[idx]:
-            cell_info["title"] = note_titles[idx]
-        out.append((cover_im, cell_info))
-    return out
+    return [
+        (cell.cover, info)
+        for cell, _, info in _ocr_cells(cells, ocr_lang, note_titles, batch_ocr, ocr_engine, ocr_threads, lazy_ocr, ocr_cache)
+    ]
+
+
+def iter_slice_and_ocr(
+    screenshot_path: Union[str, Path, Image.Image],
+    ocr_lang: str = "chi_sim+eng",
+    note_titles: Optional[List[str]] = None,
+    max_cells: Optional[int] = None,
+    batch_ocr: bool = OCR_BATCH,
+    ocr_engine: Optional[str] = None,
+    ocr_threads: Optional[int] = None,
+    lazy_ocr: bool = OCR_LAZY_WITH_TITLES,
+    ocr_cache: Optional["DiskCache"] = None,
+) -> Iterator[Tuple[Image.Image, dict]]:
+    """
+    整页长截图的流式版本：按行带切格（grid_stream.iter_grid_cells），每凑满一个 OCR 批次（逐格模式为每格）就 OCR
+    并产出 (cover_pil, cell_info)，下游（Vision 等）可边切边处理。max_cells 为 None 或 0 时切到页面底部；
+    note_titles 按格子序号覆盖 title（lazy_ocr 时这些格子不做文案区 OCR）。
+    """
+    from grid_stream import iter_grid_cells
+
+    for cell, _, cell_info in _ocr_cells(
+        iter_grid_cells(screenshot_path, max_cells=max_cells), ocr_lang, note_titles, batch_ocr,
+        ocr_engine, ocr_threads, lazy_ocr, ocr_cache,
+    ):
+        yield cell.cover, cell_info
+
+
+def cell_summary(idx: int, cell_info: dict, cover_path: Optional[str] = None) -> dict:
+    """单格摘要（cells.json 的条目格式）：index、cover_path、title、raw_text、has_zhiding、likes_approx。"""
+    return {
+        "index": idx,
+        "cover_path": cover_path,
+        "raw_text": cell_info["raw"],
+        "title": cell_info["title"],
+        "has_zhiding": cell_info["has_zhiding"],
+        "likes_approx": cell_info["likes_approx"],
+    }
 
 
 def run_slice_and_ocr_to_dir(
@@ -39,10 +154,17 @@ def run_slice_and_ocr_to_dir(
     save_covers: bool = True,
     save_text_regions: bool = False,
     note_titles: Optional[List[str]] = None,
+    max_cells: Optional[int] = None,
+    batch_ocr: bool = OCR_BATCH,
+    ocr_engine: Optional[str] = None,
+    ocr_threads: Optional[int] = None,
+    lazy_ocr: bool = OCR_LAZY_WITH_TITLES,
+    ocr_cache: Optional["DiskCache"] = None,
 ) -> List[dict]:
     """
     切格 + OCR，封面写入 output_dir/covers/。若提供 note_titles（24 项），则每格 title 以之为准。
-    返回 24 个 cell 的摘要（含 cover 路径、title、raw_text、has_zhiding、likes_approx）。
+    返回 24 个 cell 的摘要（含 cover 路径、title、raw_text、has_zhiding、likes_approx），并写入 output_dir/cells.json。
+    max_cells、batch_ocr、ocr_engine、ocr_threads、lazy_ocr、ocr_cache 含义同 run_slice_and_ocr（整页长截图流式切格，格子按 OCR 批次边切边落盘）。
     """
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -53,24 +175,22 @@ def run_slice_and_ocr_to_dir(
     if text_regions_dir:
         text_regions_dir.mkdir(parents=True, exist_ok=True)
 
-    cells = slice_screenshot(screenshot_path)
+    if max_cells is None:
+        cells = slice_screenshot(screenshot_path)
+    else:
+        from grid_stream import iter_grid_cells
+        cells = iter_grid_cells(screenshot_path, max_cells=max_cells)
     results: List[dict] = []
-    for idx, (cover_im, text_region_im) in enumerate(cells):
-        cell_info = extract_cell_text(text_region_im, lang=ocr_lang)
-        if note_titles and idx < len(note_titles) and note_titles[idx]:
-            cell_info["title"] = note_titles[idx]
+    for cell, text_region_im, cell_info in _ocr_cells(cells, ocr_lang, note_titles, batch_ocr, ocr_engine, ocr_threads, lazy_ocr, ocr_cache):
+        idx = cell.index
         cover_path: Optional[str] = None
         if save_covers:
+            # 只在需要落盘时才裁出封面像素
             cover_path = str(covers_dir / f"cell_{idx:02d}.jpg")
-            cover_im.save(cover_path, "JPEG", quality=85)
+            cell.cover.save(cover_path, "JPEG", quality=85)
         if text_regions_dir:
             text_region_im.save(text_regions_dir / f"cell_{idx:02d}.jpg", "JPEG", quality=85)
-        results.append({
-            "index": idx,
-            "cover_path": cover_path,
-            "raw_text": cell_info["raw"],
-            "title": cell_info["title"],
-            "has_zhiding": cell_info["has_zhiding"],
-            "likes_approx": cell_info["likes_approx"],
-        })
+        results.append(cell_summary(idx, cell_info, cover_path))
+    with open(output_dir / "cells.json", "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
     return results
@@ -0,0 +1,363 @@
+"""
+judge 各阶段的耗时、调用链与 Vision 成本统计。
+热路径函数（切格、OCR、逐格 Vision、CLIP 编码、聚合、落盘）用 span() / @traced 记录一段耗时，写入当前激活的 Tracer；
+没有激活的 Tracer 时 span() 返回空操作对象，开销只是一次 ContextVar 读取。
+Vision 请求的 token 用量由各 provider 的响应解析后经 record_usage() 计入当前 span 与 Tracer，按 config.VISION_PRICING 折算费用。
+Tracer 按线程/进程边界显式传递：线程池用 bind() 包装任务，子进程把 export_state() 的结果带回父进程 merge_state()。
+summary() 给出每个 span 名称的次数与 p50/p95 耗时（写入 result.json 的 timings），
+export() 导出 Chrome trace（chrome://tracing / Perfetto 可打开）或逐行 JSONL 时间线。
+"""
+from __future__ import annotations
+
+import functools
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from config import VISION_PRICING
+
+_CURRENT: ContextVar[Optional["Tracer"]] = ContextVar("judge_tracer", default=None)
+_OPEN_SPAN: ContextVar[Optional["Span"]] = ContextVar("judge_open_span", default=None)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩百分位（q 为 0–100）；空列表为 0。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(q / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def vision_cost_usd(model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+    """按 config.VISION_PRICING（每百万 token 美元单价）折算；未登记单价的模型返回 None。"""
+    price = VISION_PRICING.get(model)
+    if price is None:
+        return None
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+class Span:
+    """一段计时；set() 追加参数（如格子数、token 数），退出时写入所属 Tracer。"""
+
+    __slots__ = ("tracer", "name", "cat", "args", "_t0", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def set(self, **args: Any) -> None:
+        self.args.update(args)
+
+    def add(self, key: str, value: float) -> None:
+        self.args[key] = self.args.get(key, 0) + value
+
+    def __enter__(self) -> "Span":
+        self._token = _OPEN_SPAN.set(self)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        t1 = time.perf_counter()
+        _OPEN_SPAN.reset(self._token)
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer._add(self.name, self.cat, self._t0, t1, self.args)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **args: Any) -> None:
+        pass
+
+    def add(self, key: str, value: float) -> None:
+        pass
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    一次 judge（或一个批量中的一个达人）的 span 记录。事件的起点为墙钟时间（跨进程可比），时长用 perf_counter。
+    线程安全；usage 按模型累计 Vision 请求数与 token，counters 为其它计数（如 Vision 缓存命中）。
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self.events: List[Dict[str, Any]] = []
+        self.usage: Dict[str, Dict[str, int]] = {}
+        self.counters: Dict[str, int] = {}
+        self.thread_names: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._wall0 = time.time()
+        self._perf0 = time.perf_counter()
+
+    def span(self, name: str, cat: str = "judge", **args: Any) -> Span:
+        return Span(self, name, cat, args)
+
+    def _add(self, name: str, cat: str, t0: float, t1: float, args: Dict[str, Any]) -> None:
+        thread = threading.current_thread()
+        tid = f"{os.getpid()}:{thread.ident}"
+        event = {
+            "name": name,
+            "cat": cat,
+            "start": self._wall0 + (t0 - self._perf0),
+            "seconds": t1 - t0,
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+            self.thread_names.setdefault(tid, thread.name)
+
+    def add_usage(self, model: str, input_tokens: int, output_tokens: int) -> None:
+        with self._lock:
+            u = self.usage.setdefault(model, {"requests": 0, "input_tokens": 0, "output_tokens": 0})
+            u["requests"] += 1
+            u["input_tokens"] += int(input_tokens)
+            u["output_tokens"] += int(output_tokens)
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    # --- 跨进程 ---
+    def export_state(self) -> Dict[str, Any]:
+        """可 pickle 的快照（子进程返回给父进程）。"""
+        with self._lock:
+            return {
+                "events": list(self.events), "usage": {k: dict(v) for k, v in self.usage.items()},
+                "counters": dict(self.counters), "thread_names": dict(self.thread_names),
+            }
+
+    def merge_state(self, state: Dict[str, Any]) -> None:
+        with self._lock:
+            self.events.extend(state.get("events", []))
+            for model, u in state.get("usage", {}).items():
+                mine = self.usage.setdefault(model, {"requests": 0, "input_tokens": 0, "output_tokens": 0})
+                for k, v in u.items():
+                    mine[k] = mine.get(k, 0) + v
+            for k, v in state.get("counters", {}).items():
+                self.counters[k] = self.counters.get(k, 0) + v
+            self.thread_names.update(state.get("thread_names", {}))
+
+    # --- 汇总与导出 ---
+    def summary(self) -> Dict[str, Any]:
+        """{"wall_seconds", "spans": {名称: {cat, count, total_ms, p50_ms, p95_ms, max_ms}}, "vision_usage", "counters"}。"""
+        with self._lock:
+            events = list(self.events)
+            usage = {k: dict(v) for k, v in self.usage.items()}
+            counters = dict(self.counters)
+        out: Dict[str, Any] = {"wall_seconds": round(time.perf_counter() - self._perf0, 3)}
+        out["spans"] = summarize_events(events)
+        out["vision_usage"] = summarize_usage([usage])
+        if counters:
+            out["counters"] = counters
+        return out
+
+    def export(self, path: Union[str, Path]) -> Path:
+        """.jsonl 后缀导出逐行事件，其余导出 Chrome trace JSON。"""
+        return export_trace([self], path)
+
+
+def summarize_events(events: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """按 span 名称汇总耗时（毫秒），按首次出现的顺序排列。"""
+    groups: Dict[str, List[float]] = {}
+    cats: Dict[str, str] = {}
+    for ev in events:
+        groups.setdefault(ev["name"], []).append(ev["seconds"] * 1000.0)
+        cats.setdefault(ev["name"], ev["cat"])
+    return {
+        name: {
+            "cat": cats[name],
+            "count": len(ms),
+            "total_ms": round(sum(ms), 1),
+            "p50_ms": round(percentile(ms, 50), 1),
+            "p95_ms": round(percentile(ms, 95), 1),
+            "max_ms": round(max(ms), 1),
+        }
+        for name, ms in groups.items()
+    }
+
+
+def summarize_usage(usages: Iterable[Dict[str, Dict[str, int]]]) -> Dict[str, Any]:
+    """合并多个 Tracer.usage，给出总请求数、token 与费用（美元；有未登记单价的模型时 cost_complete 为 False）。"""
+    models: Dict[str, Dict[str, Any]] = {}
+    for usage in usages:
+        for model, u in usage.items():
+            m = models.setdefault(model, {"requests": 0, "input_tokens": 0, "output_tokens": 0})
+            for k in ("requests", "input_tokens", "output_tokens"):
+                m[k] += u.get(k, 0)
+    total_cost = 0.0
+    complete = True
+    for model, m in models.items():
+        cost = vision_cost_usd(model, m["input_tokens"], m["output_tokens"])
+        m["cost_usd"] = None if cost is None else round(cost, 6)
+        if cost is None:
+            complete = False
+        else:
+            total_cost += cost
+    return {
+        "requests": sum(m["requests"] for m in models.values()),
+        "input_tokens": sum(m["input_tokens"] for m in models.values()),
+        "output_tokens": sum(m["output_tokens"] for m in models.values()),
+        "cost_usd": round(total_cost, 6),
+        "cost_complete": complete,
+        "models": models,
+    }
+
+
+def summarize_tracers(tracers: Iterable[Tracer]) -> Dict[str, Any]:
+    """合并多个 Tracer（如一批达人）：各 span 名称跨全部事件的 p50/p95、Vision 用量与费用合计、计数合计。"""
+    events: List[Dict[str, Any]] = []
+    usages: List[Dict[str, Dict[str, int]]] = []
+    counters: Dict[str, int] = {}
+    for tr in tracers:
+        state = tr.export_state()
+        events.extend(state["events"])
+        usages.append(state["usage"])
+        for k, v in state["counters"].items():
+            counters[k] = counters.get(k, 0) + v
+    out: Dict[str, Any] = {"spans": summarize_events(events), "vision_usage": summarize_usage(usages)}
+    if counters:
+        out["counters"] = counters
+    return out
+
+
+def export_trace(tracers: Iterable[Tracer], path: Union[str, Path]) -> Path:
+    """把若干 Tracer 的事件导出到一个文件：.jsonl 为逐行事件（附 trace 名），其余为 Chrome trace（ph=X 完整事件）。"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rows = []
+    thread_names: Dict[str, str] = {}
+    for tr in tracers:
+        state = tr.export_state()
+        thread_names.update(state["thread_names"])
+        rows.extend((tr.name, ev) for ev in state["events"])
+    rows.sort(key=lambda r: r[1]["start"])
+    if path.suffix.lower() == ".jsonl":
+        with open(path, "w", encoding="utf-8") as f:
+            for trace_name, ev in rows:
+                line = dict(ev, trace=trace_name, thread=thread_names.get(ev["tid"]))
+                f.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+        return path
+    tids: Dict[str, int] = {}
+    trace_events: List[Dict[str, Any]] = []
+    for trace_name, ev in rows:
+        tid = tids.setdefault(ev["tid"], len(tids) + 1)
+        args = dict(ev["args"], trace=trace_name) if trace_name else ev["args"]
+        trace_events.append({
+            "name": ev["name"], "cat": ev["cat"], "ph": "X",
+            "ts": round(ev["start"] * 1e6, 1), "dur": round(ev["seconds"] * 1e6, 1),
+            "pid": ev["pid"], "tid": tid, "args": args,
+        })
+    pids = {ev["pid"] for _, ev in rows}
+    for key, tid in tids.items():
+        pid = int(key.split(":", 1)[0])
+        trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_names.get(key, key)}})
+    for pid in pids:
+        trace_events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"judge[{pid}]"}})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+    return path
+
+
+# --- 埋点接口 ---
+def current_tracer() -> Optional[Tracer]:
+    return _CURRENT.get()
+
+
+@contextmanager
+def activate(tracer: Optional[Tracer]) -> Iterator[Optional[Tracer]]:
+    """在当前线程（及其上下文）中激活 tracer；None 时等于关闭记录。"""
+    token = _CURRENT.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _CURRENT.reset(token)
+
+
+def span(name: str, cat: str = "judge", **args: Any) -> Union[Span, _NullSpan]:
+    """with span("embed_images", "embed", images=n) as s: ...；没有激活的 Tracer 时为空操作。"""
+    tracer = _CURRENT.get()
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, cat, **args)
+
+
+def traced(name: str, cat: str = "judge") -> Callable:
+    """函数装饰器：每次调用记录一个 span（普通函数，不适用于生成器）。"""
+
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            tracer = _CURRENT.get()
+            if tracer is None:
+                return fn(*args, **kwargs)
+            with tracer.span(name, cat):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return deco
+
+
+def bind(fn: Callable) -> Callable:
+    """把提交线程当前的 Tracer 带到线程池任务里（ContextVar 不会自动传给工作线程）。"""
+    tracer = _CURRENT.get()
+    if tracer is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with activate(tracer):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def record_usage(model: str, input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+    """记录一次 Vision 请求的 token 用量：累加到当前打开的 span（input_tokens/output_tokens/cost_usd）与 Tracer。"""
+    tracer = _CURRENT.get()
+    if tracer is None:
+        return
+    tin, tout = int(input_tokens or 0), int(output_tokens or 0)
+    tracer.add_usage(model, tin, tout)
+    s = _OPEN_SPAN.get()
+    if s is not None and s.tracer is tracer:
+        s.add("input_tokens", tin)
+        s.add("output_tokens", tout)
+        cost = vision_cost_usd(model, tin, tout)
+        if cost is not None:
+            s.add("cost_usd", round(cost, 6))
+
+
+def count(key: str, n: int = 1) -> None:
+    tracer = _CURRENT.get()
+    if tracer is not None:
+        tracer.count(key, n)
+
+
+def annotate(**args: Any) -> None:
+    """给当前打开的 span（如 @traced 包装的调用）追加参数；未在记录时为空操作。"""
+    s = _OPEN_SPAN.get()
+    if s is not None and _CURRENT.get() is s.tracer:
+        s.set(**args)
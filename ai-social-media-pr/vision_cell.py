@@ -1,30 +1,197 @@
 """
-对 24 个封面格依次调用 Vision API，得到每格的结构化判断结果。
+对 24 个封面格调用 Vision API，得到每格的结构化判断结果。封面可来自文件，也可直接是内存中的 PIL 图。
+支持线程池并发，结果始终按格子顺序返回。线程池按 rate_limit.vision_pool_size 开线程，
+同时在途的请求数由按 provider 共享的自适应上限控制（以 concurrency 为起点，限流时降低、持续成功时升高）。
+传入 cache 时先查持久化缓存，封面未变的格子不再调用 API。
+batch_size > 1 时每次请求发送多张封面，模型未答出的格子回退为单格调用。
 """
 from __future__ import annotations
 
-import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from config import GRID_CELLS
-from vision_prompt import describe_cover_with_vision
+from config import (
+    GRID_CELLS,
+    VISION_CACHE_FILENAME,
+    VISION_CACHE_MAX_AGE_DAYS,
+    VISION_CACHE_MAX_ENTRIES,
+    VISION_BATCH_SIZE,
+    VISION_CONCURRENCY,
+    VISION_DETAIL,
+)
+from disk_cache import DiskCache
+from rate_limit import vision_pool_size
+from tracing import bind, count
+from vision_prompt import (
+    COVER_BATCH_SYSTEM_SUFFIX,
+    COVER_BATCH_USER_TEMPLATE,
+    COVER_JUDGE_SYSTEM,
+    COVER_JUDGE_USER_TEMPLATE,
+    DEFAULT_VISION_MODELS,
+    CoverSource,
+    describe_cover_with_vision,
+    describe_covers_batch_with_vision,
+    load_cover_payload,
+    vision_cache_key,
+)
+
+
+def open_vision_cache(cache_dir: Union[str, Path]) -> DiskCache:
+    """在 cache_dir 下打开（或创建）Vision 结果缓存，使用 config 中的淘汰策略。"""
+    return DiskCache(
+        Path(cache_dir) / VISION_CACHE_FILENAME,
+        max_entries=VISION_CACHE_MAX_ENTRIES,
+        max_age_seconds=VISION_CACHE_MAX_AGE_DAYS * 86400,
+    )
+
+
+def _cover_label(source: CoverSource, index: int) -> str:
+    """结果中的 cover_path：路径输入用路径本身，内存输入用 cell_XX。"""
+    if isinstance(source, (str, Path)):
+        return str(source)
+    return f"cell_{index:02d}"
+
+
+def _encode(source: CoverSource, detail: str) -> Optional[bytes]:
+    """按档位编码一次上传负载；文件缺失/无法解码时返回 None，交由 describe 给出错误信息。"""
+    try:
+        return load_cover_payload(source, detail=detail)
+    except OSError:
+        return None
+
+
+def _cache_lookup(
+    cache: Optional[DiskCache],
+    payload: Optional[bytes],
+    api_client: str,
+    model: Optional[str],
+    system_prompt: str = COVER_JUDGE_SYSTEM,
+    user_prompt: str = COVER_JUDGE_USER_TEMPLATE,
+    detail: str = VISION_DETAIL,
+) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """返回 (缓存键, 命中的结果)；键基于按档位编码后的上传负载。无缓存或无负载时键为 None。"""
+    if cache is None or payload is None:
+        return None, None
+    key = vision_cache_key(payload, api_client, model, system_prompt=system_prompt, user_prompt=user_prompt, detail=detail)
+    return key, cache.get_json(key)
+
+
+def _describe_one(
+    source: CoverSource,
+    label: str,
+    api_client: str,
+    model: Optional[str],
+    api_key: Optional[str],
+    cache: Optional[DiskCache] = None,
+    detail: str = VISION_DETAIL,
+    payload: Optional[bytes] = None,
+) -> Dict[str, Any]:
+    """单格调用；任何异常都转为与 describe_cover_with_vision 一致的 {"error": ...} 结构。"""
+    if payload is None:
+        payload = _encode(source, detail)
+    key, cached = _cache_lookup(cache, payload, api_client, model, detail=detail)
+    if cached is not None:
+        count("vision_cache_hits")
+        cached["cover_path"] = label
+        return cached
+    try:
+        r = describe_cover_with_vision(payload if payload is not None else source, api_client=api_client, model=model, api_key=api_key, detail=detail)
+    except Exception as e:
+        r = {"error": str(e), "raw": None}
+    # 仅缓存成功结果，失败格下次重试
+    if key is not None and not r.get("error"):
+        cache.set_json(key, r)
+    r["cover_path"] = label
+    return r
 
 
 def run_vision_on_cells(
-    cover_paths: List[Union[str, Path]],
+    cover_paths: List[CoverSource],
     api_client: str = "openai",
     model: Optional[str] = None,
     api_key: Optional[str] = None,
+    concurrency: int = VISION_CONCURRENCY,
+    cache: Optional[DiskCache] = None,
+    batch_size: int = VISION_BATCH_SIZE,
+    detail: str = VISION_DETAIL,
+    cover_labels: Optional[List[str]] = None,
 ) -> List[Dict[str, Any]]:
+    """
+    对每个封面调用 Vision。cover_paths 可为路径、已编码字节或 PIL 图（内存流水线无需落盘）。
+    concurrency 为同时在途请求数的起点（<=1 时逐格串行），之后由共享的自适应上限调整；
+    cache 为 open_vision_cache 返回的缓存，None 表示不使用缓存；
+    batch_size 为每次请求的封面数（<=1 时逐格请求）；detail 为 config.VISION_DETAIL_TIERS 中的上传档位；
+    cover_labels 为写入结果 cover_path 的标识，默认路径本身或 cell_XX。
+    返回与 cover_paths 等长、顺序一致的结果列表。
+    """
     api_key = api_key or os.environ.get("OPENAI_API_KEY") or os.environ.get("GEMINI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")
-    results = []
-    for path in cover_paths:
-        r = describe_cover_with_vision(path, api_client=api_client, model=model, api_key=api_key)
-        r["cover_path"] = str(path)
-        results.append(r)
-    return results
+    labels = cover_labels or [_cover_label(src, i) for i, src in enumerate(cover_paths)]
+    if batch_size > 1 and len(cover_paths) > 1:
+        return _run_batched(cover_paths, labels, api_client, model, api_key, concurrency, cache, batch_size, detail)
+    if concurrency <= 1 or len(cover_paths) <= 1:
+        return [_describe_one(src, lab, api_client, model, api_key, cache, detail) for src, lab in zip(cover_paths, labels)]
+    workers = min(_pool_size(api_client, model, concurrency), len(cover_paths))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vision") as pool:
+        describe = bind(_describe_one)
+        futures = [pool.submit(describe, src, lab, api_client, model, api_key, cache, detail) for src, lab in zip(cover_paths, labels)]
+        return [f.result() for f in futures]
+
+
+def _pool_size(api_client: str, model: Optional[str], concurrency: int) -> int:
+    """线程数跟随 provider 自适应上限能达到的最大值；实际在途数由 call_with_retry 中的共享上限控制。"""
+    return vision_pool_size(api_client, model or DEFAULT_VISION_MODELS.get(api_client, ""), concurrency)
+
+
+def _run_batched(
+    cover_paths: List[CoverSource],
+    labels: List[str],
+    api_client: str,
+    model: Optional[str],
+    api_key: Optional[str],
+    concurrency: int,
+    cache: Optional[DiskCache],
+    batch_size: int,
+    detail: str = VISION_DETAIL,
+) -> List[Dict[str, Any]]:
+    """多图批量请求；批量结果按批量 Prompt 单独缓存，未答出的格子走单格调用（含单格缓存）。"""
+    batch_system = COVER_JUDGE_SYSTEM + COVER_BATCH_SYSTEM_SUFFIX
+    payloads = [_encode(src, detail) for src in cover_paths]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(cover_paths)
+    keys: List[Optional[str]] = [None] * len(cover_paths)
+    pending: List[int] = []
+    for i, payload in enumerate(payloads):
+        keys[i], cached = _cache_lookup(cache, payload, api_client, model, system_prompt=batch_system, user_prompt=COVER_BATCH_USER_TEMPLATE, detail=detail)
+        if cached is not None:
+            count("vision_cache_hits")
+            results[i] = cached
+        elif payload is not None:
+            pending.append(i)
+    chunks = [pending[k:k + batch_size] for k in range(0, len(pending), batch_size)]
+    workers = 1 if concurrency <= 1 else max(1, min(_pool_size(api_client, model, concurrency), len(chunks) or 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vision") as pool:
+        describe_batch, describe_one = bind(describe_covers_batch_with_vision), bind(_describe_one)
+        futures = [
+            pool.submit(describe_batch, [payloads[i] for i in chunk], api_client=api_client, model=model, api_key=api_key, detail=detail)
+            for chunk in chunks
+        ]
+        for chunk, fut in zip(chunks, futures):
+            for i, r in zip(chunk, fut.result()):
+                if r is None:
+                    continue
+                results[i] = r
+                if keys[i] is not None:
+                    cache.set_json(keys[i], r)
+        missing = [i for i, r in enumerate(results) if r is None]
+        fallback = [pool.submit(describe_one, cover_paths[i], labels[i], api_client, model, api_key, cache, detail, payloads[i]) for i in missing]
+        for i, fut in zip(missing, fallback):
+            results[i] = fut.result()
+    out: List[Dict[str, Any]] = []
+    for label, r in zip(labels, results):
+        r["cover_path"] = label
+        out.append(r)
+    return out
 
 
 def run_vision_on_sliced_dir(
@@ -32,10 +199,14 @@ def run_vision_on_sliced_dir(
     api_client: str = "openai",
     model: Optional[str] = None,
     api_key: Optional[str] = None,
+    concurrency: int = VISION_CONCURRENCY,
+    cache: Optional[DiskCache] = None,
+    batch_size: int = VISION_BATCH_SIZE,
+    detail: str = VISION_DETAIL,
 ) -> List[Dict[str, Any]]:
     sliced_dir = Path(sliced_dir)
     covers_dir = sliced_dir / "covers"
     if not covers_dir.exists():
         raise FileNotFoundError(f"covers dir not found: {covers_dir}")
     paths = [covers_dir / f"cell_{i:02d}.jpg" for i in range(GRID_CELLS)]
-    return run_vision_on_cells(paths, api_client=api_client, model=model, api_key=api_key)
+    return run_vision_on_cells(paths, api_client=api_client, model=model, api_key=api_key, concurrency=concurrency, cache=cache, batch_size=batch_size, detail=detail)
@@ -1,13 +1,32 @@
 """
 单格封面视觉判断：是否出现宝宝/儿童、人物气质是否偏宝妈、是否出现母婴用品等。
-供 Vision API（OpenAI / Gemini / Claude）使用，返回结构化得分与置信度。
+供 Vision API（OpenAI / Gemini / Claude）使用，返回结构化得分与置信度；api_client="stub" 为不联网的离线后端（StubVisionClient）。
 """
 from __future__ import annotations
 
 import base64
+import io
 import json
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from config import VISION_DETAIL, VISION_DETAIL_TIERS, VISION_STUB_LATENCY
+from disk_cache import sha256_hex
+from rate_limit import call_with_retry
+from tracing import annotate, record_usage, traced
+
+# 各 provider 未指定 model 时的默认模型
+DEFAULT_VISION_MODELS: Dict[str, str] = {
+    "openai": "gpt-4o",
+    "gemini": "gemini-1.5-flash",
+    "anthropic": "claude-sonnet-4-20250514",
+    "stub": "stub-v1",
+}
 
 # 单格封面判断的系统与用户 Prompt（类型 + 调性 + 母婴场景细化）
 COVER_JUDGE_SYSTEM = """你是一个抖音达人主页封面分析助手。给定一张视频封面的截图，请从以下维度打分并给出置信度。本评估用于母婴奶粉等推广，需区分「真实宝妈、0-3岁小宝宝、生活化」与「杂乱广告感、大龄儿童、AI/军装等」。
@@ -48,106 +67,416 @@ COVER_JUDGE_SYSTEM = """你是一个抖音达人主页封面分析助手。给
 
 COVER_JUDGE_USER_TEMPLATE = """请对这张抖音视频封面图按上述维度打分（重点：婴幼儿是否0-3岁、封面是否杂乱/广告感、是否真实居家场景、是否AI军装等），并输出完整 JSON。"""
 
+# 多图批量判断：在单格 system prompt 之后追加，要求按编号输出 JSON 数组
+COVER_BATCH_SYSTEM_SUFFIX = """
+【批量模式】本次会依次给出多张封面，每张图片前有「封面 #编号」标注。请对每张封面分别按上述维度打分，
+输出一个 JSON 数组，数组每个元素为上述 JSON 对象，并额外包含整数字段 "cell"（即该封面的编号）。
+必须覆盖所有编号，不要合并、不要遗漏，不要输出数组以外的文字。
+"""
+
+COVER_BATCH_USER_TEMPLATE = """以下共 {n} 张抖音视频封面（编号 {first}–{last}），请逐张按上述维度打分并输出 JSON 数组。"""
+
+# 封面输入：文件路径、已编码的 JPEG/PNG 字节、或内存中的 PIL 图
+CoverSource = Union[str, Path, bytes, Image.Image]
+
+# 供依赖缺失时的错误信息
+_PROVIDER_PACKAGES = {"openai": "openai", "gemini": "google-generativeai", "anthropic": "anthropic", "stub": "stub"}
+
+
+def vision_cache_key(
+    image_bytes: bytes,
+    api_client: str,
+    model: Optional[str] = None,
+    system_prompt: str = COVER_JUDGE_SYSTEM,
+    user_prompt: str = COVER_JUDGE_USER_TEMPLATE,
+    detail: str = VISION_DETAIL,
+) -> str:
+    """Vision 结果缓存键：上传负载哈希 + Prompt 哈希 + provider + 实际模型名 + 细节档位。"""
+    model_name = model or DEFAULT_VISION_MODELS.get(api_client, "")
+    image_hash = sha256_hex(image_bytes)
+    prompt_hash = sha256_hex(system_prompt, user_prompt)
+    return f"vision:{api_client}:{model_name}:{detail}:{prompt_hash[:16]}:{image_hash}"
+
 
 def image_to_base64_data_uri(image_path: Union[str, Path], mime: str = "image/jpeg") -> str:
-    path = Path(image_path)
-    raw = path.read_bytes()
+    return bytes_to_base64_data_uri(Path(image_path).read_bytes(), mime=mime)
+
+
+def bytes_to_base64_data_uri(raw: bytes, mime: str = "image/jpeg") -> str:
     b64 = base64.standard_b64encode(raw).decode("ascii")
     return f"data:{mime};base64,{b64}"
 
 
+# 已编码上传负载的进程内 LRU：键为 (路径, mtime, 大小, 档位)，同一封面在缓存键计算与实际请求间只编码一次
+_ENCODED_CACHE: "OrderedDict[Tuple[str, int, int, str], bytes]" = OrderedDict()
+_ENCODED_CACHE_MAX = 1024
+_ENCODED_LOCK = threading.Lock()
+
+
+def encode_image_for_vision(raw: bytes, detail: str = VISION_DETAIL) -> bytes:
+    """
+    按档位把 JPEG/PNG 字节缩放到长边 ≤ max_side 并重编码为 JPEG。
+    已是不超过上限的 JPEG 时原样返回，避免二次压缩；original 档不做处理。
+    """
+    tier = VISION_DETAIL_TIERS.get(detail) or VISION_DETAIL_TIERS[VISION_DETAIL]
+    max_side = tier.get("max_side")
+    if not max_side:
+        return raw
+    with Image.open(io.BytesIO(raw)) as im:
+        if max(im.size) <= max_side and im.format == "JPEG":
+            return raw
+        im.draft("RGB", (max_side, max_side))  # JPEG 解码时直接按 1/2^k 缩小
+        return encode_pil_for_vision(im, detail=detail)
+
+
+def encode_pil_for_vision(image: Image.Image, detail: str = VISION_DETAIL) -> bytes:
+    """把内存中的封面按档位缩放并编码为 JPEG（不修改传入的图）。"""
+    tier = VISION_DETAIL_TIERS.get(detail) or VISION_DETAIL_TIERS[VISION_DETAIL]
+    max_side = tier.get("max_side")
+    im = image.convert("RGB") if image.mode != "RGB" else image
+    if max_side and max(im.size) > max_side:
+        im = im.copy()
+        im.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=tier.get("quality") or 85, optimize=True)
+    return buf.getvalue()
+
+
+def load_cover_payload(image_path: CoverSource, detail: str = VISION_DETAIL) -> bytes:
+    """
+    把封面（路径 / 字节 / PIL 图）按档位编码为上传负载。
+    路径输入按 (路径, mtime, 大小, 档位) 缓存；字节与 PIL 输入由调用方（如 JudgeContext）自行持有结果。
+    """
+    if isinstance(image_path, Image.Image):
+        return encode_pil_for_vision(image_path, detail=detail)
+    if isinstance(image_path, (bytes, bytearray)):
+        return encode_image_for_vision(bytes(image_path), detail=detail)
+    path = Path(image_path)
+    st = path.stat()
+    key = (str(path.resolve()), st.st_mtime_ns, st.st_size, detail)
+    with _ENCODED_LOCK:
+        payload = _ENCODED_CACHE.get(key)
+        if payload is not None:
+            _ENCODED_CACHE.move_to_end(key)
+            return payload
+    payload = encode_image_for_vision(path.read_bytes(), detail=detail)
+    with _ENCODED_LOCK:
+        _ENCODED_CACHE[key] = payload
+        while len(_ENCODED_CACHE) > _ENCODED_CACHE_MAX:
+            _ENCODED_CACHE.popitem(last=False)
+    return payload
+
+
+@traced("describe_cover_with_vision", "vision")
 def describe_cover_with_vision(
-    image_path: Union[str, Path],
+    image_path: CoverSource,
     api_client: str = "openai",
     model: Optional[str] = None,
     api_key: Optional[str] = None,
     system_prompt: str = COVER_JUDGE_SYSTEM,
     user_prompt: str = COVER_JUDGE_USER_TEMPLATE,
+    detail: str = VISION_DETAIL,
 ) -> Dict[str, Any]:
-    image_path = Path(image_path)
-    if not image_path.exists():
-        return {"error": f"file not found: {image_path}", "raw": None}
-    data_uri = image_to_base64_data_uri(image_path)
-    if api_client == "openai":
-        return _call_openai_vision(data_uri, model=model, api_key=api_key, system_prompt=system_prompt, user_prompt=user_prompt)
-    if api_client == "gemini":
-        return _call_gemini_vision(image_path, model=model, api_key=api_key, system_prompt=system_prompt, user_prompt=user_prompt)
-    if api_client == "anthropic":
-        return _call_anthropic_vision(data_uri, model=model, api_key=api_key, system_prompt=system_prompt, user_prompt=user_prompt)
-    return {"error": f"unknown api_client: {api_client}", "raw": None}
-
-
-def _call_openai_vision(data_uri: str, model: Optional[str] = None, api_key: Optional[str] = None, system_prompt: str = COVER_JUDGE_SYSTEM, user_prompt: str = COVER_JUDGE_USER_TEMPLATE) -> Dict[str, Any]:
+    """image_path 可为文件路径、已编码图片字节或 PIL 图（内存流水线）。记录 tracing span（含 token 用量）。"""
+    annotate(provider=api_client, cells=1)
+    if isinstance(image_path, (str, Path)):
+        image_path = Path(image_path)
+        if not image_path.exists():
+            return {"error": f"file not found: {image_path}", "raw": None}
+    if api_client not in _PROVIDER_PACKAGES:
+        return {"error": f"unknown api_client: {api_client}", "raw": None}
     try:
-        from openai import OpenAI
+        payload = load_cover_payload(image_path, detail=detail)
+        text = _request_vision_text(api_client, [payload], model=model, api_key=api_key, system_prompt=system_prompt, user_prompt=user_prompt, detail=detail)
     except ImportError:
-        return {"error": "openai not installed", "raw": None}
-    client = OpenAI(api_key=api_key)
-    model = model or "gpt-4o"
-    content = [{"type": "text", "text": user_prompt}, {"type": "image_url", "image_url": {"url": data_uri}}]
-    try:
-        resp = client.chat.completions.create(model=model, messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": content}], max_tokens=1024)
-        text = (resp.choices[0].message.content or "").strip()
-        return _parse_cover_json(text)
+        return {"error": f"{_PROVIDER_PACKAGES[api_client]} not installed", "raw": None}
     except Exception as e:
         return {"error": str(e), "raw": None}
+    return _parse_cover_json(text)
 
 
-def _call_gemini_vision(image_path: Path, model: Optional[str] = None, api_key: Optional[str] = None, system_prompt: str = COVER_JUDGE_SYSTEM, user_prompt: str = COVER_JUDGE_USER_TEMPLATE) -> Dict[str, Any]:
-    try:
-        import google.generativeai as genai
-    except ImportError:
-        return {"error": "google-generativeai not installed", "raw": None}
-    if api_key:
-        genai.configure(api_key=api_key)
-    model_name = model or "gemini-1.5-flash"
+@traced("describe_covers_batch_with_vision", "vision")
+def describe_covers_batch_with_vision(
+    image_paths: List[CoverSource],
+    api_client: str = "openai",
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    system_prompt: str = COVER_JUDGE_SYSTEM,
+    detail: str = VISION_DETAIL,
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    一次请求判断多张封面（按 1..N 编号），要求模型按 COVER_JUDGE_SYSTEM 的字段输出 JSON 数组。
+    返回与 image_paths 等长的列表：模型答出的格子为与单格结果同结构的 dict，缺失/无法解析的格子为 None，
+    由调用方回退为单格调用。请求整体失败时全部为 None。
+    """
+    annotate(provider=api_client, cells=len(image_paths))
+    if api_client not in _PROVIDER_PACKAGES or not image_paths:
+        return [None] * len(image_paths)
     try:
-        gen_model = genai.GenerativeModel(model_name)
-        with open(image_path, "rb") as f:
-            img_data = f.read()
-        full_prompt = f"{system_prompt}\n\n{user_prompt}"
-        resp = gen_model.generate_content([full_prompt, {"mime_type": "image/jpeg", "data": img_data}])
-        text = (resp.text or "").strip()
-        return _parse_cover_json(text)
-    except Exception as e:
-        return {"error": str(e), "raw": None}
+        images = [load_cover_payload(p, detail=detail) for p in image_paths]
+        n = len(images)
+        user_prompt = COVER_BATCH_USER_TEMPLATE.format(n=n, first=1, last=n)
+        text = _request_vision_text(
+            api_client, images, model=model, api_key=api_key,
+            system_prompt=system_prompt + COVER_BATCH_SYSTEM_SUFFIX, user_prompt=user_prompt,
+            max_tokens=min(512 + 600 * n, 16384), detail=detail, batched=True,
+        )
+    except Exception:
+        return [None] * len(image_paths)
+    return _parse_cover_json_array(text, len(image_paths))
 
 
-def _call_anthropic_vision(data_uri: str, model: Optional[str] = None, api_key: Optional[str] = None, system_prompt: str = COVER_JUDGE_SYSTEM, user_prompt: str = COVER_JUDGE_USER_TEMPLATE) -> Dict[str, Any]:
-    try:
-        from anthropic import Anthropic
-    except ImportError:
-        return {"error": "anthropic not installed", "raw": None}
-    import re
-    client = Anthropic(api_key=api_key)
-    model_name = model or "claude-sonnet-4-20250514"
-    m = re.match(r"data:([^;]+);base64,(.+)", data_uri)
-    if not m:
-        return {"error": "invalid data_uri", "raw": None}
-    b64 = m.group(2)
-    media_type = "image/jpeg"
-    try:
-        resp = client.messages.create(model=model_name, max_tokens=1024, system=system_prompt, messages=[{"role": "user", "content": [{"type": "text", "text": user_prompt}, {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": b64}}]}])
-        text = resp.content[0].text if resp.content else ""
-        return _parse_cover_json(text)
-    except Exception as e:
-        return {"error": str(e), "raw": None}
+def _request_vision_text(
+    api_client: str,
+    images: List[bytes],
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    system_prompt: str = COVER_JUDGE_SYSTEM,
+    user_prompt: str = COVER_JUDGE_USER_TEMPLATE,
+    max_tokens: int = 1024,
+    detail: str = VISION_DETAIL,
+    batched: bool = False,
+) -> str:
+    """
+    向 provider 发送一次请求（1 张或多张 JPEG），返回模型文本。多张时每张前加「封面 #k」标注。
+    batched 表示这是多封面批量请求（期望 JSON 数组）；真实 provider 由 Prompt 决定输出格式，只有离线 stub 据此选择输出。
+    请求经 rate_limit 的共享令牌桶/自适应并发，429/5xx 等瞬时错误自动退避重试。
+    依赖缺失抛 ImportError，不可重试或重试耗尽的接口错误原样抛出。
+    """
+    if api_client == "openai":
+        openai_detail = (VISION_DETAIL_TIERS.get(detail) or {}).get("detail", "auto")
+        fn = lambda: _openai_request(images, model=model, api_key=api_key, system_prompt=system_prompt, user_prompt=user_prompt, max_tokens=max_tokens, detail=openai_detail)
+    elif api_client == "gemini":
+        fn = lambda: _gemini_request(images, model=model, api_key=api_key, system_prompt=system_prompt, user_prompt=user_prompt)
+    elif api_client == "stub":
+        fn = lambda: _stub_request(images, model=model, api_key=api_key, batched=batched)
+    elif api_client == "anthropic":
+        fn = lambda: _anthropic_request(images, model=model, api_key=api_key, system_prompt=system_prompt, user_prompt=user_prompt, max_tokens=max_tokens)
+    else:
+        raise ValueError(f"unknown api_client: {api_client}")
+    return call_with_retry(fn, api_client, model or DEFAULT_VISION_MODELS[api_client])
 
 
-def _parse_cover_json(text: str) -> Dict[str, Any]:
-    out: Dict[str, Any] = {"raw": text}
-    if not text:
-        return out
+# 进程级客户端注册表：按 (provider, api_key, model) 复用 SDK 客户端及其 keep-alive 连接池，
+# 跨格子、跨达人（batch）共享，避免每张封面重新握手 TLS。
+# google.generativeai 的 key 只能通过全局 genai.configure 设置，因此一个进程只支持一个 Gemini key。
+_CLIENT_LOCK = threading.Lock()
+_CLIENTS: Dict[Tuple[str, Optional[str], str], Dict[str, Any]] = {}
+_GEMINI_CONFIGURED_KEY: Optional[str] = None
+
+
+def get_vision_client(api_client: str, api_key: Optional[str] = None, model: Optional[str] = None) -> Any:
+    """
+    取（或首次创建）provider 的客户端。openai/anthropic 返回 SDK 客户端，gemini 返回 GenerativeModel。
+    依赖未安装时抛 ImportError；gemini 传入与已配置不同的 key 时抛 ValueError（全局配置会让已有客户端改用新 key）。
+    两者都由调用方转为 {"error": ...}。
+    """
+    global _GEMINI_CONFIGURED_KEY
+    model_name = model or DEFAULT_VISION_MODELS.get(api_client, "")
+    key = (api_client, api_key, model_name)
+    with _CLIENT_LOCK:
+        entry = _CLIENTS.get(key)
+        if entry is not None:
+            entry["registry_hits"] += 1
+            entry["requests"] += 1
+            return entry["client"]
+        if api_client == "openai":
+            from openai import OpenAI
+            # 重试由 rate_limit 统一处理，关闭 SDK 自带重试避免叠加
+            client = OpenAI(api_key=api_key, max_retries=0)
+        elif api_client == "anthropic":
+            from anthropic import Anthropic
+            client = Anthropic(api_key=api_key, max_retries=0)
+        elif api_client == "gemini":
+            import google.generativeai as genai
+            # genai.configure 是全局设置：首次配置后不再切换 key，否则已创建的客户端会悄悄改用新 key
+            if api_key and api_key != _GEMINI_CONFIGURED_KEY:
+                if _GEMINI_CONFIGURED_KEY is not None:
+                    raise ValueError("gemini: 一个进程只支持一个 API key（genai.configure 为全局设置）")
+                genai.configure(api_key=api_key)
+                _GEMINI_CONFIGURED_KEY = api_key
+            client = genai.GenerativeModel(model_name)
+        elif api_client == "stub":
+            client = StubVisionClient()
+        else:
+            raise ValueError(f"unknown api_client: {api_client}")
+        _CLIENTS[key] = {"client": client, "created": 1, "registry_hits": 0, "requests": 1}
+        return client
+
+
+def vision_client_stats() -> Dict[str, Dict[str, int]]:
+    """
+    按 provider 汇总客户端注册表的使用情况：clients 为注册表中的客户端数，requests 为取用次数，
+    registry_hits 为命中已有客户端对象的次数。这只说明没有重建客户端；底层 HTTP 连接是否复用由 SDK 的连接池决定，这里不统计。
+    """
+    out: Dict[str, Dict[str, int]] = {}
+    with _CLIENT_LOCK:
+        for (provider, _key, _model), entry in _CLIENTS.items():
+            s = out.setdefault(provider, {"clients": 0, "requests": 0, "registry_hits": 0})
+            s["clients"] += entry["created"]
+            s["requests"] += entry["requests"]
+            s["registry_hits"] += entry["registry_hits"]
+    return out
+
+
+def reset_vision_clients() -> None:
+    """关闭并清空注册表（测试或切换账号时使用；之后可以为 Gemini 配置新的 key）。"""
+    global _GEMINI_CONFIGURED_KEY
+    with _CLIENT_LOCK:
+        _GEMINI_CONFIGURED_KEY = None
+        for entry in _CLIENTS.values():
+            close = getattr(entry["client"], "close", None)
+            if callable(close):
+                try:
+                    close()
+                except Exception:
+                    pass
+        _CLIENTS.clear()
+
+
+def _openai_request(images: List[bytes], model: Optional[str] = None, api_key: Optional[str] = None, system_prompt: str = COVER_JUDGE_SYSTEM, user_prompt: str = COVER_JUDGE_USER_TEMPLATE, max_tokens: int = 1024, detail: str = "auto") -> str:
+    client = get_vision_client("openai", api_key=api_key, model=model)
+    model = model or DEFAULT_VISION_MODELS["openai"]
+    content: List[Dict[str, Any]] = [{"type": "text", "text": user_prompt}]
+    for k, img in enumerate(images, start=1):
+        if len(images) > 1:
+            content.append({"type": "text", "text": f"封面 #{k}"})
+        content.append({"type": "image_url", "image_url": {"url": bytes_to_base64_data_uri(img), "detail": detail}})
+    resp = client.chat.completions.create(model=model, messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": content}], max_tokens=max_tokens)
+    usage = getattr(resp, "usage", None)
+    record_usage(model, getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0))
+    return (resp.choices[0].message.content or "").strip()
+
+
+def _gemini_request(images: List[bytes], model: Optional[str] = None, api_key: Optional[str] = None, system_prompt: str = COVER_JUDGE_SYSTEM, user_prompt: str = COVER_JUDGE_USER_TEMPLATE) -> str:
+    gen_model = get_vision_client("gemini", api_key=api_key, model=model)
+    parts: List[Any] = [f"{system_prompt}\n\n{user_prompt}"]
+    for k, img in enumerate(images, start=1):
+        if len(images) > 1:
+            parts.append(f"封面 #{k}")
+        parts.append({"mime_type": "image/jpeg", "data": img})
+    resp = gen_model.generate_content(parts)
+    usage = getattr(resp, "usage_metadata", None)
+    record_usage(model or DEFAULT_VISION_MODELS["gemini"], getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0))
+    return (resp.text or "").strip()
+
+
+def _anthropic_request(images: List[bytes], model: Optional[str] = None, api_key: Optional[str] = None, system_prompt: str = COVER_JUDGE_SYSTEM, user_prompt: str = COVER_JUDGE_USER_TEMPLATE, max_tokens: int = 1024) -> str:
+    client = get_vision_client("anthropic", api_key=api_key, model=model)
+    model_name = model or DEFAULT_VISION_MODELS["anthropic"]
+    content: List[Dict[str, Any]] = [{"type": "text", "text": user_prompt}]
+    for k, img in enumerate(images, start=1):
+        if len(images) > 1:
+            content.append({"type": "text", "text": f"封面 #{k}"})
+        b64 = base64.standard_b64encode(img).decode("ascii")
+        content.append({"type": "image", "source": {"type": "base64", "media_type": "image/jpeg", "data": b64}})
+    resp = client.messages.create(model=model_name, max_tokens=max_tokens, system=system_prompt, messages=[{"role": "user", "content": content}])
+    usage = getattr(resp, "usage", None)
+    record_usage(model_name, getattr(usage, "input_tokens", 0), getattr(usage, "output_tokens", 0))
+    return resp.content[0].text if resp.content else ""
+
+
+def _stub_request(images: List[bytes], model: Optional[str] = None, api_key: Optional[str] = None, batched: bool = False) -> str:
+    client = get_vision_client("stub", api_key=api_key, model=model)
+    text = client.complete(images, batched=batched)
+    # 按 OpenAI 低细节档每图 85 token 估算，便于离线检查费用统计
+    record_usage(model or DEFAULT_VISION_MODELS["stub"], 85 * len(images), len(text) // 4)
+    return text
+
+
+class StubVisionClient:
+    """
+    离线 Vision 后端：不联网，按封面上传负载的哈希确定性地生成 COVER_JUDGE_SYSTEM 要求的全部字段
+    （同一封面每次结果相同），批量模式输出带 "cell" 编号的 JSON 数组。用于服务与流水线的离线测试，分数没有实际含义。
+    """
+
+    def __init__(self, latency: float = VISION_STUB_LATENCY):
+        self.latency = latency
+
+    def judge(self, image: bytes) -> Dict[str, Any]:
+        h = bytes.fromhex(sha256_hex(image))
+        conf = lambda i: round(0.5 + h[i] / 510, 2)
+        return {
+            "has_baby_or_child": h[0] % 2 == 0,
+            "has_baby_confidence": conf(1),
+            "child_age_0_3": h[2] % 3 == 0,
+            "child_age_0_3_confidence": conf(3),
+            "person_mom_like_score": 1 + h[4] % 10,
+            "person_mom_confidence": conf(5),
+            "has_maternal_products": h[6] % 3 == 0,
+            "maternal_confidence": conf(7),
+            "cover_cluttered_or_ad_like": h[8] % 4 == 0,
+            "cover_cluttered_confidence": conf(9),
+            "real_home_life_scene": h[10] % 2 == 0,
+            "real_home_confidence": conf(11),
+            "ai_army_or_filter": h[12] % 8 == 0,
+            "ai_army_confidence": conf(13),
+            "tone_refined_score": 1 + h[14] % 10,
+            "tone_refined_confidence": conf(15),
+            "brief_reason": "stub",
+        }
+
+    def complete(self, images: List[bytes], batched: bool = False) -> str:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if not batched:
+            return json.dumps(self.judge(images[0]), ensure_ascii=False)
+        return json.dumps([{"cell": k, **self.judge(img)} for k, img in enumerate(images, start=1)], ensure_ascii=False)
+
+
+def _strip_code_fence(text: str) -> str:
     text = text.strip()
     if text.startswith("```"):
         lines = text.split("\n")
-        start = 1 if lines[0].startswith("```json") else 0
+        start = 1
         end = next((i for i, l in enumerate(lines) if i > 0 and l.strip() == "```"), len(lines))
         text = "\n".join(lines[start:end])
+    return text
+
+
+def _parse_cover_json(text: str) -> Dict[str, Any]:
+    out: Dict[str, Any] = {"raw": text}
+    if not text:
+        return out
     try:
-        parsed = json.loads(text)
+        parsed = json.loads(_strip_code_fence(text))
         for k, v in parsed.items():
             out[k] = v
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, AttributeError):
         pass
     return out
+
+
+def _parse_cover_json_array(text: str, n: int) -> List[Optional[Dict[str, Any]]]:
+    """
+    解析批量模式的 JSON 数组，按 "cell"（1..n）映射回格子；无 cell 字段且长度恰为 n 时按位置映射。
+    每格输出 {"raw": 该元素 JSON, ...字段, "batched": True}，无法对应的格子为 None。
+    """
+    out: List[Optional[Dict[str, Any]]] = [None] * n
+    if not text:
+        return out
+    try:
+        parsed = json.loads(_strip_code_fence(text))
+    except json.JSONDecodeError:
+        return out
+    if isinstance(parsed, dict):
+        parsed = parsed.get("results") or parsed.get("cells") or []
+    if not isinstance(parsed, list):
+        return out
+    items = [it for it in parsed if isinstance(it, dict)]
+    positional = len(items) == n and not any("cell" in it for it in items)
+    for pos, item in enumerate(items):
+        if positional:
+            idx = pos
+        else:
+            try:
+                idx = int(item.get("cell")) - 1
+            except (TypeError, ValueError):
+                continue
+        if not 0 <= idx < n or out[idx] is not None:
+            continue
+        cell = {k: v for k, v in item.items() if k != "cell"}
+        cell["raw"] = json.dumps(item, ensure_ascii=False)
+        cell["batched"] = True
+        out[idx] = cell
+    return out